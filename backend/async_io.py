@@ -0,0 +1,39 @@
+"""Run the blocking SDK calls (Firestore, Firebase Auth, Cloudinary, HTTP) off the event loop.
+
+Every route is ``async def``, so a synchronous call made directly inside one
+stalls the whole worker. ``run_blocking`` hands such calls to a bounded thread
+pool instead; its size caps how many outbound calls a worker makes at once.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+load_dotenv()
+
+IO_THREADS = int(os.getenv("IO_THREADS", "32"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+
+_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="shopease-io")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Call ``fn(*args, **kwargs)`` in the I/O thread pool and await its result.
+
+    The call sees the caller's context variables, so per-request metrics
+    follow it into the thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, fn, *args, **kwargs))
+
+
+# Keep-alive session shared by all identitytoolkit calls; the pool is sized
+# like the executor so no thread ever waits for a connection.
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=IO_THREADS))
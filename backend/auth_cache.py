@@ -0,0 +1,89 @@
+"""Caches for the per-request authentication path.
+
+``get_current_user`` runs on every authenticated call. Verified ID tokens are
+cached under a SHA-256 of the token (the raw token is never kept) and never
+outlive their own ``exp`` claim. User profiles are cached by uid and must be
+invalidated with ``invalidate_user_profile`` whenever a ``users`` document is
+written; other workers pick the change up when their entry's TTL runs out.
+Concurrent misses for the same profile, as in a login burst, share one read.
+"""
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from async_io import run_blocking
+from cache import TTLCache
+from single_flight import SingleFlight
+
+load_dotenv()
+
+token_cache = TTLCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("TOKEN_CACHE_TTL", "300")),
+    name="tokens",
+)
+user_profile_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+    name="user_profiles",
+)
+user_profile_reads = SingleFlight(name="user_profiles")
+
+# Bumped by every invalidation. A read that started before a write must not
+# store what it fetched, or it would resurrect the pre-write profile.
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+async def verify_id_token(identity, token: str) -> dict:
+    """Verify an ID token with ``identity``, reusing a previous verification if cached"""
+    key = _token_key(token)
+    decoded_token = token_cache.get(key)
+    if decoded_token is None:
+        # May fetch Google's signing certificates, so keep it off the loop
+        decoded_token = await run_blocking(identity.verify_id_token, token)
+        remaining = decoded_token.get("exp", 0) - time.time()
+        token_cache.set(key, decoded_token, ttl=remaining)
+    return decoded_token
+
+
+async def get_user_profile(db, uid: str) -> Optional[dict]:
+    """Return the ``users/{uid}`` document data, or None if it does not exist.
+
+    Missing profiles are not cached: registration creates the Auth user before
+    its Firestore document.
+    """
+    profile = user_profile_cache.get(uid)
+    if profile is None:
+        profile = await user_profile_reads.do(uid, _load_user_profile, db, uid)
+        if profile is None:
+            return None
+    return dict(profile)
+
+
+async def _load_user_profile(db, uid: str) -> Optional[dict]:
+    generation = _generation
+    user_doc = await run_blocking(db.collection('users').document(uid).get)
+    if not user_doc.exists:
+        return None
+    profile = user_doc.to_dict()
+    with _generation_lock:
+        if generation == _generation:
+            user_profile_cache.set(uid, profile)
+    return profile
+
+
+def invalidate_user_profile(uid: str) -> None:
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        user_profile_cache.pop(uid)
+    user_profile_reads.forget(uid)
@@ -0,0 +1,267 @@
+"""Storage, identity and image hosting backends used by the API.
+
+``STORAGE_BACKEND`` picks the implementation:
+
+- ``firestore`` (default): Firestore, Firebase Auth and Cloudinary.
+- ``memory``: everything in process, ``MemoryFirestore`` for documents plus
+  ``MemoryIdentity`` and ``MemoryImages``, each sleeping ``MEMORY_LATENCY``
+  seconds per call to stand in for the network. Meant for load tests and
+  offline runs; the data is lost when the process exits.
+
+``get_backends`` creates them on first use and shares them process-wide. The
+API calls it from its lifespan, once per worker after any fork, because gRPC
+channels and HTTP pools must not be inherited by a forked child.
+
+Identity and image backends are synchronous like the SDKs they wrap, so
+async code calls them through ``run_blocking``. Every backend call is timed
+for ``/metrics``, under the same service names in both modes.
+"""
+import os
+import secrets
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, NamedTuple, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from async_io import HTTP_TIMEOUT, http_session
+from metrics import instrumented, traced
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+MEMORY_LATENCY = float(os.getenv("MEMORY_LATENCY", "0"))
+
+IDENTITY_TOOLKIT_URL = "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword"
+# Lifetime of the ID tokens issued by MemoryIdentity, like Firebase's
+MEMORY_TOKEN_TTL = 3600
+
+
+class FirebaseIdentity:
+    """Firebase Auth through the Admin SDK, plus the REST sign-in endpoint"""
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key or os.getenv("FIREBASE_WEB_API_KEY")
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    @instrumented("firebase_auth")
+    def create_user(self, email: str, password: str, display_name: str) -> str:
+        """Create an account and return its uid"""
+        from firebase_admin import auth
+
+        return auth.create_user(email=email, password=password, display_name=display_name).uid
+
+    @instrumented("firebase_auth")
+    def verify_id_token(self, token: str) -> dict:
+        from firebase_admin import auth
+
+        return auth.verify_id_token(token)
+
+    @instrumented("identitytoolkit")
+    def sign_in_with_password(self, email: str, password: str) -> requests.Response:
+        """Call identitytoolkit and return the raw response"""
+        return http_session.post(
+            IDENTITY_TOOLKIT_URL,
+            params={"key": self.api_key},
+            json={"email": email, "password": password, "returnSecureToken": True},
+            timeout=HTTP_TIMEOUT,
+        )
+
+
+class CloudinaryImages:
+    """Image hosting on Cloudinary"""
+
+    def __init__(self):
+        import cloudinary
+
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+            api_key=os.getenv("CLOUDINARY_API_KEY"),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+            secure=True
+        )
+
+    @instrumented("cloudinary")
+    def upload(self, path: str, public_id: str) -> str:
+        """Upload a file under ``public_id`` and return its secure URL"""
+        import cloudinary.uploader
+
+        upload_result = cloudinary.uploader.upload(
+            path,
+            public_id=public_id,
+            folder=None,  # Already included in public_id
+            overwrite=True,
+            resource_type="image"
+        )
+        return upload_result["secure_url"]
+
+    @instrumented("cloudinary")
+    def destroy(self, public_id: str) -> dict:
+        import cloudinary.uploader
+
+        return cloudinary.uploader.destroy(public_id)
+
+    @instrumented("cloudinary")
+    def list_assets(self, prefix: str) -> List[Tuple[str, datetime]]:
+        """``(public_id, created_at)`` of every uploaded image whose id starts with ``prefix``"""
+        import cloudinary.api
+
+        assets = []
+        cursor = None
+        while True:
+            page = cloudinary.api.resources(
+                type="upload", resource_type="image", prefix=prefix, max_results=500, next_cursor=cursor
+            )
+            for resource in page.get("resources", []):
+                created_at = datetime.fromisoformat(resource["created_at"].replace("Z", "+00:00"))
+                assets.append((resource["public_id"], created_at))
+            cursor = page.get("next_cursor")
+            if not cursor:
+                return assets
+
+
+class _MemoryService:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class MemoryAuthError(Exception):
+    """Raised like the Admin SDK errors, with a ``code``"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class MemoryResponse:
+    """The parts of ``requests.Response`` the login code reads"""
+
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+
+    @property
+    def text(self):
+        return str(self._payload)
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class MemoryIdentity(_MemoryService):
+    """Email/password accounts and opaque ID tokens kept in dicts"""
+
+    configured = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._accounts = {}
+        self._tokens = {}
+
+    @instrumented("firebase_auth")
+    def create_user(self, email: str, password: str, display_name: str) -> str:
+        self._call()
+        with self._lock:
+            if email in self._accounts:
+                raise MemoryAuthError("EMAIL_ALREADY_EXISTS", f"Email {email} already exists")
+            uid = uuid.uuid4().hex[:28]
+            self._accounts[email] = (uid, password)
+        return uid
+
+    @instrumented("firebase_auth")
+    def verify_id_token(self, token: str) -> dict:
+        self._call()
+        claims = self._tokens.get(token)
+        if claims is None or claims["exp"] < time.time():
+            raise ValueError("Invalid or expired ID token")
+        return dict(claims)
+
+    @instrumented("identitytoolkit")
+    def sign_in_with_password(self, email: str, password: str) -> MemoryResponse:
+        self._call()
+        account = self._accounts.get(email)
+        if account is None or account[1] != password:
+            return MemoryResponse(400, {"error": {"message": "INVALID_LOGIN_CREDENTIALS"}})
+        token = secrets.token_urlsafe(32)
+        self._tokens[token] = {"uid": account[0], "exp": time.time() + MEMORY_TOKEN_TTL}
+        return MemoryResponse(200, {"idToken": token, "localId": account[0]})
+
+
+class MemoryImages(_MemoryService):
+    """Remembers uploaded public ids and serves Cloudinary-shaped URLs"""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._assets = {}
+
+    @instrumented("cloudinary")
+    def upload(self, path: str, public_id: str) -> str:
+        self._call()
+        extension = os.path.splitext(path)[1]
+        with self._lock:
+            self._assets[public_id] = datetime.now(timezone.utc)
+        return f"https://res.cloudinary.com/memory/image/upload/v1/{public_id}{extension}"
+
+    @instrumented("cloudinary")
+    def destroy(self, public_id: str) -> dict:
+        self._call()
+        with self._lock:
+            found = self._assets.pop(public_id, None) is not None
+        return {"result": "ok" if found else "not found"}
+
+    @instrumented("cloudinary")
+    def list_assets(self, prefix: str) -> List[Tuple[str, datetime]]:
+        self._call()
+        with self._lock:
+            return [(public_id, created) for public_id, created in self._assets.items()
+                    if public_id.startswith(prefix)]
+
+
+class Backends(NamedTuple):
+    db: object
+    identity: object
+    images: object
+
+
+def create_backends(kind: str = STORAGE_BACKEND, latency: float = MEMORY_LATENCY) -> Backends:
+    if kind == "memory":
+        from memory_firestore import MemoryFirestore
+
+        return Backends(traced(MemoryFirestore(latency)), MemoryIdentity(latency), MemoryImages(latency))
+    if kind == "firestore":
+        from firebase_admin_config import get_db
+
+        return Backends(traced(get_db()), FirebaseIdentity(), CloudinaryImages())
+    raise ValueError(f"Unknown STORAGE_BACKEND {kind!r}, use 'firestore' or 'memory'")
+
+
+_backends = None
+_backends_lock = threading.Lock()
+
+
+def get_backends() -> Backends:
+    """The backends of this process, created on first call (thread-safe)"""
+    global _backends
+    if _backends is None:
+        with _backends_lock:
+            if _backends is None:
+                _backends = create_backends()
+    return _backends
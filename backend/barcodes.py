@@ -0,0 +1,173 @@
+"""In-memory barcode to product index for scanner lookups.
+
+Every worker keeps a dict from barcode to product id, so resolving a scanned
+code never touches Firestore; the product itself then comes from the product
+cache. The index is fed by ``product_feed``. Until the feed has delivered
+the catalog, lookups fall back to an equality query.
+
+Uniqueness is enforced by Firestore: ``barcodes/{code}`` names the product
+holding a code, and is written in the same transaction as that product, so
+two workers cannot give one code to two products. The index only rejects
+duplicates early, before any image is uploaded, and covers the products
+written before the registry existed, which have no ``barcodes`` document.
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import HTTPException, status
+
+from product_feed import product_feed
+
+# Largest number of codes resolved by one batch lookup
+MAX_BATCH_BARCODES = 500
+BARCODE_COLLECTION = 'barcodes'
+
+
+def normalize_barcode(barcode: Optional[str]) -> Optional[str]:
+    """Strip scanner whitespace; an empty barcode means no barcode"""
+    if barcode is None:
+        return None
+    return barcode.strip() or None
+
+
+def _conflict(barcode):
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Barcode {barcode} is already used by another product"
+    )
+
+
+def barcode_ref(db, barcode: str):
+    """Registry document of a normalized barcode"""
+    # Document ids cannot contain '/', be '.' or '..', or look like __name__
+    return db.collection(BARCODE_COLLECTION).document(quote(barcode, safe="").replace(".", "%2E").replace("_", "%5F"))
+
+
+def register_barcodes(transaction, db, changes: Iterable[Tuple[str, Optional[str], Optional[str]]]) -> List[str]:
+    """Move products from their ``previous`` barcode to ``barcode`` in the registry.
+
+    ``changes`` are ``(product_id, barcode, previous)``; None means no barcode.
+    Returns the ids of the products whose new code is held by another product,
+    whose change is left out. Reads the registry in ``transaction``, so it must
+    be called before the transaction writes anything.
+    """
+    changes = [
+        (product_id, normalize_barcode(barcode), normalize_barcode(previous))
+        for product_id, barcode, previous in changes
+    ]
+    refs = {}
+    for _, barcode, previous in changes:
+        for code in (barcode, previous):
+            if code is not None:
+                refs[barcode_ref(db, code).id] = code
+    holders = dict.fromkeys(refs.values())
+    if refs:
+        for snapshot in db.get_all([barcode_ref(db, code) for code in refs.values()], transaction=transaction):
+            if snapshot.exists:
+                holders[refs[snapshot.id]] = snapshot.to_dict().get('product_id')
+
+    refused = []
+    for product_id, barcode, previous in changes:
+        if barcode is not None and holders[barcode] != product_id:
+            # An unchanged code shared by legacy duplicates stays with each of them
+            if holders[barcode] is not None and barcode != previous:
+                refused.append(product_id)
+                continue
+            if holders[barcode] is None:
+                transaction.set(barcode_ref(db, barcode), {"barcode": barcode, "product_id": product_id})
+                holders[barcode] = product_id
+        if previous is not None and previous != barcode and holders[previous] == product_id:
+            transaction.delete(barcode_ref(db, previous))
+            holders[previous] = None
+    return refused
+
+
+def register_barcode(transaction, db, product_id: str, barcode: Optional[str], previous: Optional[str] = None) -> None:
+    """``register_barcodes`` for one product; raises 409 if the code is taken"""
+    if register_barcodes(transaction, db, [(product_id, barcode, previous)]):
+        _conflict(normalize_barcode(barcode))
+
+
+class BarcodeIndex:
+    """Thread-safe barcode -> product id mapping.
+
+    Barcodes should be unique, but products written before uniqueness was
+    enforced may share one, so each code maps to a set of ids.
+    """
+
+    def __init__(self):
+        self._products = {}
+        self._barcodes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return product_feed.ready
+
+    def __len__(self):
+        return len(self._barcodes)
+
+    def _set(self, product_id: str, barcode: Optional[str]) -> None:
+        previous = self._barcodes.pop(product_id, None)
+        if previous is not None:
+            ids = self._products.get(previous)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._products[previous]
+        if barcode is not None:
+            self._barcodes[product_id] = barcode
+            self._products.setdefault(barcode, set()).add(product_id)
+
+    def set(self, product_id: str, barcode: Optional[str]) -> None:
+        with self._lock:
+            self._set(product_id, normalize_barcode(barcode))
+
+    def remove(self, product_id: str) -> None:
+        with self._lock:
+            self._set(product_id, None)
+
+    def get(self, barcode: str) -> List[str]:
+        """Ids of the products with this barcode (several only for legacy duplicates)"""
+        with self._lock:
+            return sorted(self._products.get(barcode, ()))
+
+    def apply(self, product_id: str, data: Optional[dict]) -> None:
+        """``product_feed`` callback"""
+        self.set(product_id, (data or {}).get('barcode'))
+
+    def lookup(self, db, barcode: str) -> Optional[str]:
+        """Product id for a barcode, or None (blocking only while the index is not ready)"""
+        barcode = normalize_barcode(barcode)
+        if barcode is None:
+            return None
+        if self.ready:
+            ids = self.get(barcode)
+            return ids[0] if ids else None
+        docs = db.collection('products').where('barcode', '==', barcode).select(['barcode']).limit(1).get()
+        return docs[0].id if docs else None
+
+    def lookup_many(self, db, barcodes: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Map each barcode to a product id or None"""
+        return {barcode: self.lookup(db, barcode) for barcode in dict.fromkeys(barcodes)}
+
+    def claim(self, db, product_id: str, barcode: Optional[str]) -> None:
+        """Assign ``barcode`` to ``product_id``, or raise 409 if another product uses it.
+
+        A fast path within the worker; the write must still register the code
+        with ``register_barcode``. Blocking only while the index is not ready.
+        """
+        barcode = normalize_barcode(barcode)
+        if barcode is not None and not self.ready:
+            docs = db.collection('products').where('barcode', '==', barcode).select(['barcode']).limit(2).get()
+            if any(doc.id != product_id for doc in docs):
+                _conflict(barcode)
+        with self._lock:
+            if barcode is not None and self._products.get(barcode, set()) - {product_id}:
+                _conflict(barcode)
+            self._set(product_id, barcode)
+
+
+barcode_index = BarcodeIndex()
+product_feed.subscribe(barcode_index.apply, ['barcode'])
@@ -0,0 +1,4 @@
+"""Offline benchmarks for the API's Firestore access patterns.
+
+Run from the ``backend`` directory, e.g. ``python -m benchmarks.vendor_orders_bench``.
+"""
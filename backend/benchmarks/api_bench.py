@@ -0,0 +1,179 @@
+"""End-to-end benchmark of every endpoint on the in-memory backends.
+
+    python -m benchmarks.api_bench [--latency 0.005] [--concurrency 16] [--requests 400]
+
+Runs the real ASGI app in process with ``STORAGE_BACKEND=memory``, so the
+numbers are the API's own overhead plus ``--latency`` seconds per store,
+identity or image call. Each scenario sends ``--requests`` requests from
+``--concurrency`` concurrent clients and reports latency percentiles,
+throughput and backend calls per request. Read endpoints are measured after
+the writes that precede them, so their caches are warm as in steady state.
+
+Needs ``httpx`` (installed with FastAPI's test extras).
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import statistics
+import time
+
+SEED_PRODUCTS = 500
+WORDS = ("chocolat", "fromage", "café", "miel", "confiture", "savon", "bougie", "thé")
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Bench:
+    def __init__(self, main, client, concurrency, requests):
+        self.main = main
+        self.client = client
+        self.concurrency = concurrency
+        self.requests = requests
+        self.rng = random.Random(3)
+
+    def _backend_calls(self):
+        backends = self.main.backends
+        return backends.db.stats["calls"], backends.identity.calls + backends.images.calls
+
+    async def run(self, name, make_request, requests=None):
+        """Send ``requests`` requests built by ``make_request(i)`` and print one result row"""
+        total = requests or self.requests
+        counter = itertools.count()
+        latencies = []
+        errors = 0
+        db_before, other_before = self._backend_calls()
+
+        async def worker():
+            nonlocal errors
+            while True:
+                i = next(counter)
+                if i >= total:
+                    return
+                method, url, kwargs = make_request(i)
+                started = time.perf_counter()
+                response = await self.client.request(method, url, **kwargs)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - started
+
+        db_after, other_after = self._backend_calls()
+        latencies.sort()
+        print(f"{name:<24}{statistics.median(latencies) * 1000:>9.2f}"
+              f"{percentile(latencies, 0.95) * 1000:>9.2f}{percentile(latencies, 0.99) * 1000:>9.2f}"
+              f"{total / elapsed:>10.0f}{(db_after - db_before) / total:>9.2f}"
+              f"{(other_after - other_before) / total:>9.2f}{errors:>7}")
+
+
+def product_form(rng, i):
+    return {
+        "name": f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {i}",
+        "description": " ".join(rng.choice(WORDS) for _ in range(12)),
+        "price": str(round(rng.uniform(1, 50), 2)),
+        "stock": "1000000",
+        "barcode": f"{3000000000000 + i}",
+    }
+
+
+async def scenarios(bench):
+    client, rng = bench.client, bench.rng
+
+    async def sign_up(email, user_type):
+        response = await client.post("/auth/register", json={
+            "name": email, "email": email, "password": "secret123", "user_type": user_type
+        })
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+
+    vendor = await sign_up("vendor@bench.test", "vendor")
+    customer = await sign_up("customer@bench.test", "customer")
+    admin = await sign_up("admin@bench.test", "admin")
+
+    await bench.run("POST /auth/register", lambda i: ("POST", "/auth/register", {"json": {
+        "name": f"user{i}", "email": f"user{i}@bench.test", "password": "secret123", "user_type": "customer"
+    }}))
+    await bench.run("POST /auth/login", lambda i: ("POST", "/auth/login", {"json": {
+        "email": f"user{i}@bench.test", "password": "secret123"
+    }}))
+    await bench.run("GET /users/me", lambda i: ("GET", "/users/me", {"headers": customer}))
+
+    await bench.run("POST /products/", lambda i: (
+        "POST", "/products/", {"data": product_form(rng, i), "headers": vendor}
+    ), requests=SEED_PRODUCTS)
+    catalog = (await client.get("/products/")).json()
+    product_ids = [product["id"] for product in catalog]
+    barcodes = {product["id"]: product["barcode"] for product in catalog}
+
+    await bench.run("GET /products/", lambda i: ("GET", "/products/", {}))
+    await bench.run("GET /products/?limit=50", lambda i: ("GET", "/products/", {"params": {"limit": 50}}))
+    await bench.run("GET /products/{id}", lambda i: ("GET", f"/products/{rng.choice(product_ids)}", {}))
+    await bench.run("GET /products/search", lambda i: (
+        "GET", "/products/search", {"params": {"q": rng.choice(WORDS)[:4], "limit": 20}}
+    ))
+    await bench.run("GET /products/by-barcode", lambda i: (
+        "GET", f"/products/by-barcode/{3000000000000 + rng.randrange(SEED_PRODUCTS)}", {}
+    ))
+    def update(i):
+        product_id = product_ids[i % len(product_ids)]
+        form = dict(product_form(rng, i), barcode=barcodes[product_id])
+        return "PUT", f"/products/{product_id}", {"data": form, "headers": vendor}
+
+    await bench.run("PUT /products/{id}", update)
+
+    def order(i):
+        lines = [{"product_id": pid, "quantity": 1} for pid in rng.sample(product_ids, 3)]
+        return "POST", "/orders/", {"headers": customer, "json": {
+            "user_id": "ignored", "products": lines, "total_price": 10.0
+        }}
+
+    await bench.run("POST /orders/", order)
+    await bench.run("GET /orders/ (customer)", lambda i: ("GET", "/orders/", {"headers": customer}))
+    await bench.run("GET /orders/ (vendor)", lambda i: (
+        "GET", "/orders/", {"headers": vendor, "params": {"limit": 50}}
+    ))
+    await bench.run("GET /orders/ (admin)", lambda i: ("GET", "/orders/", {"headers": admin}),
+                    requests=max(1, bench.requests // 10))
+
+    order_ids = [o["id"] for o in (await client.get("/orders/", headers=admin)).json()]
+    await bench.run("GET /orders/{id}", lambda i: (
+        "GET", f"/orders/{rng.choice(order_ids)}", {"headers": vendor}
+    ))
+    await bench.run("DELETE /products/{id}", lambda i: (
+        "DELETE", f"/products/{product_ids[i]}", {"headers": vendor}
+    ), requests=min(bench.requests, len(product_ids)))
+
+
+async def main(args):
+    # Read by create_backends() when the lifespan starts
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["MEMORY_LATENCY"] = str(args.latency)
+    import httpx
+
+    import main as api
+
+    # httpx logs every request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            bench = Bench(api, client, args.concurrency, args.requests)
+            print(f"{args.latency * 1000:g} ms per backend call, concurrency {args.concurrency}, "
+                  f"{args.requests} requests per scenario")
+            print(f"{'endpoint':<24}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>10}"
+                  f"{'db/req':>9}{'ext/req':>9}{'errors':>7}")
+            await scenarios(bench)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per backend call")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario")
+    asyncio.run(main(parser.parse_args()))
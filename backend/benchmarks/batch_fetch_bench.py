@@ -0,0 +1,89 @@
+"""Rendering a cart: N product fetches vs one ``POST /products/batch``.
+
+    python -m benchmarks.batch_fetch_bench [--latency 0.005] [--sizes 10,50,300]
+
+Runs the app in process on the in-memory backends, like ``api_bench``. For
+each cart size it fetches the same products three ways: one
+``GET /products/{id}`` after another, all of them concurrently, and a single
+batch request. Each way runs with a cold product cache and again with a warm
+one, and reports the wall time and the Firestore round trips.
+
+Needs ``httpx`` (installed with FastAPI's test extras).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+
+SEED_PRODUCTS = 400
+
+
+async def sequential(client, ids):
+    for product_id in ids:
+        (await client.get(f"/products/{product_id}")).raise_for_status()
+
+
+async def concurrent(client, ids):
+    responses = await asyncio.gather(*(client.get(f"/products/{product_id}") for product_id in ids))
+    for response in responses:
+        response.raise_for_status()
+
+
+async def batch(client, ids):
+    response = await client.post("/products/batch", json={"ids": ids})
+    response.raise_for_status()
+    assert all(item["product"] for item in response.json())
+
+
+async def measure(api, client, fetch, ids, cold):
+    from product_cache import product_cache
+
+    if cold:
+        product_cache.clear()
+    db = api.backends.db
+    calls = db.stats["calls"]
+    started = time.perf_counter()
+    await fetch(client, ids)
+    return (time.perf_counter() - started) * 1000, db.stats["calls"] - calls
+
+
+async def main(args):
+    # Read by create_backends() when the lifespan starts
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["MEMORY_LATENCY"] = str(args.latency)
+    import httpx
+
+    import main as api
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    async with api.app.router.lifespan_context(api.app):
+        batch_write = api.db.batch()
+        for i in range(SEED_PRODUCTS):
+            batch_write.set(api.db.collection('products').document(f"p{i:04d}"), {
+                "name": f"Product {i}", "description": "bench", "price": 1.0 + i,
+                "stock": 100, "vendor_id": "v0",
+            })
+        batch_write.commit()
+
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            rng = random.Random(5)
+            print(f"{args.latency * 1000:g} ms per backend call")
+            print(f"{'items':>6}  {'method':<22}{'cold ms':>9}{'db calls':>9}{'warm ms':>9}{'db calls':>9}")
+            for size in [int(n) for n in args.sizes.split(",")]:
+                ids = rng.sample([f"p{i:04d}" for i in range(SEED_PRODUCTS)], size)
+                for label, fetch in (("N x GET (sequential)", sequential),
+                                     ("N x GET (concurrent)", concurrent),
+                                     ("POST /products/batch", batch)):
+                    cold_ms, cold_calls = await measure(api, client, fetch, ids, cold=True)
+                    warm_ms, warm_calls = await measure(api, client, fetch, ids, cold=False)
+                    print(f"{size:>6}  {label:<22}{cold_ms:>9.1f}{cold_calls:>9}{warm_ms:>9.1f}{warm_calls:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per backend call")
+    parser.add_argument("--sizes", default="10,50,300", help="comma-separated cart sizes")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,47 @@
+"""Concurrent document reads with injected latency, on and off the event loop.
+
+    python -m benchmarks.concurrency_bench
+
+Each request performs one Firestore read that takes ``LATENCY`` seconds. Called
+directly from a coroutine the reads serialise on the event loop and N requests
+take N latencies; through ``run_blocking`` they overlap and take about one.
+"""
+import asyncio
+import time
+
+from async_io import IO_THREADS, run_blocking
+from memory_firestore import MemoryFirestore
+
+LATENCY = 0.05
+CONCURRENCY = (1, 8, 32)
+
+
+async def blocking_request(db):
+    return db.collection('products').document('p1').get()
+
+
+async def offloaded_request(db):
+    return await run_blocking(db.collection('products').document('p1').get)
+
+
+async def measure(handler, db, concurrency):
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(db) for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+async def main():
+    db = MemoryFirestore(latency=LATENCY)
+    db.collection('products').document('p1').set({"name": "p1", "stock": 1})
+
+    print(f"latency {LATENCY * 1000:.0f} ms per read, {IO_THREADS} I/O threads")
+    print(f"{'requests':>8} | {'blocking s':>10} {'x latency':>9} | {'offloaded s':>11} {'x latency':>9}")
+    for concurrency in CONCURRENCY:
+        blocking = await measure(blocking_request, db, concurrency)
+        offloaded = await measure(offloaded_request, db, concurrency)
+        print(f"{concurrency:>8} | {blocking:>10.3f} {blocking / LATENCY:>9.1f} | "
+              f"{offloaded:>11.3f} {offloaded / LATENCY:>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""Creating a product with a gallery: sequential vs concurrent image uploads.
+
+    python -m benchmarks.gallery_bench [--upload-latency 0.2] [--images 1,4,8] [--concurrency 1,4,8]
+
+Runs the app in process on the in-memory backends, like ``api_bench``, with
+Cloudinary uploads taking ``--upload-latency`` seconds each. For every gallery
+size and upload concurrency it creates products with that many images through
+``POST /products/`` and reports the median request time, next to the time of
+a single-image product: with enough concurrency a gallery costs about as much
+as its slowest image.
+
+Needs ``httpx`` (installed with FastAPI's test extras) and Pillow.
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import statistics
+import time
+
+ROUNDS = 5
+
+
+def png(seed: int) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 600), (seed * 40 % 256, seed * 90 % 256, 120)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+async def create(client, headers, count, form):
+    files = [("image", ("0.png", png(0), "image/png"))]
+    files += [("gallery_images", (f"{i}.png", png(i), "image/png")) for i in range(1, count)]
+    started = time.perf_counter()
+    response = await client.post("/products/", data=form, files=files, headers=headers)
+    response.raise_for_status()
+    assert len(response.json()["gallery"]) == count
+    return time.perf_counter() - started
+
+
+async def main(args):
+    # Read by create_backends() when the lifespan starts
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["MEMORY_LATENCY"] = str(args.latency)
+    import httpx
+
+    import gallery
+    import main as api
+    from images import warm_pool
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    async with api.app.router.lifespan_context(api.app):
+        api.images.latency = args.upload_latency
+        warm_pool()
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post("/auth/register", json={
+                "name": "vendor", "email": "vendor@bench.test", "password": "secret123", "user_type": "vendor"
+            })
+            vendor = {"Authorization": f"Bearer {response.json()['token']}"}
+            form = {"name": "Gallery", "description": "bench", "price": "9.5", "stock": "10"}
+
+            print(f"{args.upload_latency * 1000:g} ms per upload, {args.latency * 1000:g} ms per other call")
+            print(f"{'images':>7}{'concurrency':>13}{'median ms':>11}")
+            for count in [int(n) for n in args.images.split(",")]:
+                for concurrency in [int(n) for n in args.concurrency.split(",")]:
+                    gallery.GALLERY_UPLOAD_CONCURRENCY = concurrency
+                    times = [await create(client, vendor, count, form) for _ in range(ROUNDS)]
+                    print(f"{count:>7}{concurrency:>13}{statistics.median(times) * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per Firestore/Auth call")
+    parser.add_argument("--upload-latency", type=float, default=0.2, help="seconds per Cloudinary upload")
+    parser.add_argument("--images", default="1,4,8", help="comma-separated gallery sizes")
+    parser.add_argument("--concurrency", default="1,4,8", help="comma-separated upload concurrencies")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""Flash sale on one product: single stock document vs sharded stock.
+
+    python -m benchmarks.hot_stock_bench [--orders 400] [--workers 32] [--shards 4,16]
+
+Every checkout buys one unit of the same product, concurrently, against a
+store with injected latency, through ``checkout.place_order`` as
+``POST /orders/`` does. For each configuration it reports committed
+orders per second, the abort rate and the p50/p99 checkout latency from the
+``place_order`` transaction counters, then checks that no unit was sold
+twice.
+"""
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from checkout import place_order
+from memory_firestore import MemoryFirestore
+from sharded_stock import configure_stock_shards, shard_totals
+from transactions import TransactionContentionError, transaction_stats
+
+LATENCY = 0.002
+STOCK = 100_000
+
+
+def seed(db, shards):
+    db.collection('products').document("hot").set(
+        {"name": "hot", "price": 1.0, "stock": STOCK, "vendor_id": "v0"}
+    )
+    if shards >= 2:
+        configure_stock_shards(db, "hot", shards)
+
+
+def remaining_stock(db, shards):
+    if shards >= 2:
+        return shard_totals(db, {"hot": shards})["hot"]
+    return db.collection('products').document("hot").get().get("stock")
+
+
+def checkout(db):
+    started = time.perf_counter()
+    try:
+        products = [{"product_id": "hot", "quantity": 1}]
+        order = {"user_id": "u0", "products": products, "total_price": 1.0, "status": "pending"}
+        place_order(db, order, products, str(uuid.uuid4()))
+    except TransactionContentionError:
+        return None
+    return time.perf_counter() - started
+
+
+def run(shards, orders, workers):
+    db = MemoryFirestore(latency=LATENCY)
+    seed(db, shards)
+    before = transaction_stats().get("place_order", {})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        durations = list(pool.map(lambda _: checkout(db), range(orders)))
+    elapsed = time.perf_counter() - started
+
+    after = transaction_stats()["place_order"]
+    attempts = after["attempts"] - before.get("attempts", 0)
+    retries = after["retries"] - before.get("retries", 0)
+    committed = sorted(d for d in durations if d is not None)
+    sold = STOCK - remaining_stock(db, shards)
+    assert sold == len(committed), f"sold {sold} units for {len(committed)} orders"
+
+    def percentile(p):
+        return committed[min(len(committed) - 1, int(p * len(committed)))] * 1000 if committed else 0.0
+
+    label = f"{shards} shards" if shards >= 2 else "single doc"
+    print(f"  {label:<10} {len(committed) / elapsed:7.0f} orders/s  "
+          f"committed {len(committed):4}/{orders}  abort rate {retries / attempts if attempts else 0:.2f}  "
+          f"p50 {percentile(0.50):6.1f} ms  p99 {percentile(0.99):6.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--shards", default="4,16", help="comma-separated shard counts to compare")
+    args = parser.parse_args()
+
+    print(f"{args.orders} one-unit checkouts of one product, {args.workers} workers, "
+          f"{LATENCY * 1000:.0f} ms per round trip")
+    for shards in [1] + [int(n) for n in args.shards.split(",")]:
+        run(shards, args.orders, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Product search: inverted index vs scanning the catalog, as the catalog grows.
+
+    python -m benchmarks.search_bench
+
+Builds a synthetic French catalog of up to 100k products one product at a
+time (the way the index is maintained in production), then times a mix of
+queries against the index and against a linear scan that folds and matches
+every product, which is what clients do today with the full ``/products/``
+payload. Also times single-product re-indexing.
+"""
+import random
+import statistics
+import time
+
+from search import SearchIndex, fold, tokenize
+
+SIZES = (1_000, 10_000, 100_000)
+SCAN_MAX_SIZE = 10_000
+QUERIES = (
+    "chocolat",           # exact term
+    "choco",              # prefix
+    "creme brulee",       # accents folded, two terms
+    "fromage chevre bio", # three terms
+    "chocolt",            # misspelled
+    "ca",                 # short, wide prefix
+)
+REPEAT = 50
+
+NOUNS = (
+    "chocolat", "fromage", "café", "crème", "baguette", "confiture", "miel", "thé",
+    "saucisson", "chèvre", "brioche", "croissant", "madeleine", "pâté", "cidre",
+    "moutarde", "huile", "savon", "bougie", "panier", "écharpe", "chaussette",
+    "tablier", "céramique", "lavande", "caramel", "praliné", "nougat", "galette",
+)
+ADJECTIVES = (
+    "bio", "artisanal", "fermier", "fumé", "doux", "noir", "blanc", "brûlée",
+    "épicé", "léger", "traditionnel", "rustique", "fin", "grand", "petit", "frais",
+)
+WORDS = (
+    "produit", "région", "recette", "goût", "saveur", "idéal", "famille", "été",
+    "hiver", "cadeau", "qualité", "naturel", "local", "fabriqué", "main", "France",
+    "Normandie", "Provence", "Bretagne", "Alsace", "parfait", "apéritif", "dessert",
+)
+
+
+def make_product(rng, i):
+    name = f"{rng.choice(NOUNS).capitalize()} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+    description = " ".join(rng.choice(WORDS + NOUNS + ADJECTIVES) for _ in range(20))
+    return {
+        "name": name,
+        "description": description,
+        "barcode": f"{3000000000000 + i}",
+        "price": round(rng.uniform(1, 80), 2),
+        "stock": rng.randrange(0, 50),
+    }
+
+
+def scan(products, query):
+    """Client-side filtering: fold every product and look for each query word"""
+    words = tokenize(query)
+    matches = []
+    for product_id, product in products.items():
+        text = fold(f"{product['name']} {product['description']} {product['barcode']}")
+        if all(word in text for word in words):
+            matches.append(product_id)
+    return matches
+
+
+def timed(fn, *args, repeat=REPEAT):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return result, statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    rng = random.Random(7)
+    products = {}
+    index = SearchIndex()
+
+    for size in SIZES:
+        started = time.perf_counter()
+        for i in range(len(products), size):
+            products[f"p{i}"] = make_product(rng, i)
+            index.update(f"p{i}", products[f"p{i}"])
+        build = time.perf_counter() - started
+        print(f"\n{size:,} products (indexed {build:.1f} s incrementally, "
+              f"{len(index._postings):,} terms)")
+        print(f"  {'query':<22}{'hits':>8}{'index p50':>12}{'index p95':>12}{'scan p50':>12}")
+
+        for query in QUERIES:
+            (hits, _), p50, p95 = timed(index.search, query, 20)
+            if size <= SCAN_MAX_SIZE:
+                _, scan_p50, _ = timed(scan, products, query, repeat=5)
+                scan_text = f"{scan_p50 * 1000:>9.2f} ms"
+            else:
+                scan_text = f"{'-':>12}"
+            print(f"  {query:<22}{hits:>8}{p50 * 1000:>9.3f} ms{p95 * 1000:>9.3f} ms{scan_text}")
+
+        _, p50, p95 = timed(index.search, "chocolat", 20, 5.0, 20.0, 1)
+        print(f"  {'chocolat, 5-20, stock':<22}{'':>8}{p50 * 1000:>9.3f} ms{p95 * 1000:>9.3f} ms")
+
+        victim = f"p{rng.randrange(size)}"
+        _, p50, _ = timed(index.update, victim, dict(products[victim], name="Galette bretonne"))
+        print(f"  re-index one product: {p50 * 1e6:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
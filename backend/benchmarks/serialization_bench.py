@@ -0,0 +1,114 @@
+"""JSON rendering of large list responses: FastAPI's default path vs orjson.
+
+    python -m benchmarks.serialization_bench [--sizes 1000,10000] [--repeat 10]
+
+Renders product and order lists, with Firestore ``DatetimeWithNanoseconds``
+timestamps, three ways:
+
+- ``jsonable_encoder``: what FastAPI does with a plain return value;
+- ``response_model``: pydantic validation and serialisation of the typed models;
+- ``orjson``: the ``FirestoreJSONResponse`` the list endpoints return.
+
+For each it reports wall and CPU time per response, responses per second and
+the body size, and checks that the three bodies decode to the same data.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from pydantic import TypeAdapter
+
+from main import OrderOut, ProductOut
+from serialization import FirestoreJSONResponse
+
+
+def products(count):
+    created_at = DatetimeWithNanoseconds.now(timezone.utc)
+    return [{
+        "id": f"p{i:06d}",
+        "name": f"Product {i}",
+        "description": "A product description of a realistic length for a catalog tile.",
+        "price": 9.99 + i % 100,
+        "image_url": f"https://res.cloudinary.com/demo/image/upload/v1/shopease/products/p{i}.jpg",
+        "image_variants": {
+            "thumbnail": f"https://res.cloudinary.com/demo/image/upload/v1/shopease/products/p{i}_thumbnail.jpg",
+            "medium": f"https://res.cloudinary.com/demo/image/upload/v1/shopease/products/p{i}_medium.jpg",
+        },
+        "stock": i % 50,
+        "vendor_id": f"v{i % 20}",
+        "barcode": f"{i:013d}",
+        "created_at": created_at,
+    } for i in range(count)]
+
+
+def orders(count):
+    created_at = DatetimeWithNanoseconds.now(timezone.utc)
+    return [{
+        "id": f"o{i:06d}",
+        "user_id": f"u{i % 500}",
+        "products": [{"product_id": f"p{j}", "quantity": 1 + j % 3} for j in range(i % 4 + 1)],
+        "total_price": 25.5 + i % 30,
+        "status": "pending",
+        "vendor_ids": [f"v{i % 20}"],
+        "created_at": created_at,
+    } for i in range(count)]
+
+
+def renderers(model):
+    adapter = TypeAdapter(List[model])
+    return {
+        "jsonable_encoder": lambda body: JSONResponse(jsonable_encoder(body)).body,
+        "response_model": lambda body: JSONResponse(
+            adapter.dump_python(adapter.validate_python(body), mode="json", exclude_unset=True)
+        ).body,
+        "orjson": lambda body: FirestoreJSONResponse(body).body,
+    }
+
+
+def _normalised(body):
+    # Compare timestamps as instants: pydantic writes UTC as "Z"
+    def fix(value):
+        if isinstance(value, dict):
+            return {k: fix(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [fix(v) for v in value]
+        if isinstance(value, str) and value.endswith(("Z", "+00:00")) and value[:2] == "20":
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return value
+    return fix(json.loads(body))
+
+
+def run(label, body, model, repeat):
+    print(f"\n{label}")
+    outputs = {}
+    for name, render in renderers(model).items():
+        render(body)  # warm up
+        wall, cpu = time.perf_counter(), time.process_time()
+        for _ in range(repeat):
+            outputs[name] = render(body)
+        wall = (time.perf_counter() - wall) / repeat
+        cpu = (time.process_time() - cpu) / repeat
+        print(f"  {name:<17} {wall * 1000:8.1f} ms  cpu {cpu * 1000:8.1f} ms  "
+              f"{1 / wall:7.1f} responses/s  {len(outputs[name]) / 1024:8.0f} KiB")
+    reference = _normalised(outputs["jsonable_encoder"])
+    assert all(_normalised(out) == reference for out in outputs.values()), "bodies differ"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000", help="comma-separated item counts")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    for size in [int(n) for n in args.sizes.split(",")]:
+        run(f"{size} products", products(size), ProductOut, args.repeat)
+        run(f"{size} orders", orders(size), OrderOut, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
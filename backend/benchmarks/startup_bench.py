@@ -0,0 +1,70 @@
+"""Cold start of an API worker: import time and lifespan startup time.
+
+    python -m benchmarks.startup_bench [--runs 5] [--products 1000] [--no-warmup]
+
+Each run is a fresh interpreter, like a newly forked or scaled-out worker. It
+imports ``main`` with ``STORAGE_BACKEND=memory``, seeds ``--products``
+products, runs the lifespan and prints the ``startup_report`` that
+``/health/ready`` serves. The import time excludes the interpreter's own
+start; ``startup_seconds`` covers client creation, the product index load and
+the warmup steps, each also reported on its own.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = """
+import asyncio, json, logging, sys
+
+import main
+from backends import get_backends
+
+logging.disable(logging.INFO)
+db = get_backends().db
+for start in range(0, {products}, 500):
+    batch = db.batch()
+    for i in range(start, min(start + 500, {products})):
+        ref = db.collection('products').document(f'p{{i}}')
+        batch.set(ref, {{'name': f'Product {{i}}', 'description': 'seeded', 'price': 1.0, 'stock': 10,
+                        'barcode': str(3000000000000 + i)}})
+    batch.commit()
+
+async def start():
+    async with main.app.router.lifespan_context(main.app):
+        return dict(main.startup_report)
+
+sys.stdout.write(json.dumps(asyncio.run(start())) + "\\n")
+"""
+
+
+def run_once(products, warmup):
+    env = dict(os.environ, STORAGE_BACKEND="memory", MEMORY_LATENCY="0",
+               STARTUP_WARMUP="true" if warmup else "false")
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD.format(products=products)],
+        env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    reports = [run_once(args.products, args.warmup) for _ in range(args.runs)]
+    print(f"{args.runs} cold starts, {args.products} products, warmup {'on' if args.warmup else 'off'}")
+    print(f"{'phase':<20}{'median ms':>11}{'max ms':>9}")
+    rows = [("import", [r["import_seconds"] for r in reports]),
+            ("startup", [r["startup_seconds"] for r in reports])]
+    rows += [(f"  {step}", [r["steps"][step] for r in reports]) for step in reports[0]["steps"]]
+    for name, samples in rows:
+        print(f"{name:<20}{statistics.median(samples) * 1000:>11.1f}{max(samples) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--products", type=int, default=1000, help="catalog size loaded at startup")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    main(parser.parse_args())
@@ -0,0 +1,111 @@
+"""Checkout transaction: per-line reads vs one batched read.
+
+    python -m benchmarks.stock_txn_bench
+
+Part 1 times a single 20-line checkout (with duplicate lines) against a store
+with injected latency. Part 2 runs concurrent checkouts on overlapping
+products and reports the retry/abort counters of ``run_transaction``. Both go
+through ``checkout.place_order``, with an idempotency key, as ``POST /orders/``
+does.
+"""
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+
+from checkout import place_order
+from memory_firestore import MemoryFirestore
+from transactions import TransactionContentionError, transaction_stats
+
+LATENCY = 0.01
+LINES = 20
+DISTINCT_PRODUCTS = 12
+CONCURRENT_CHECKOUTS = 64
+WORKERS = 16
+
+
+def seed(db, stock=10_000):
+    for i in range(DISTINCT_PRODUCTS):
+        db.collection('products').document(f"p{i}").set(
+            {"name": f"p{i}", "price": 1.0, "stock": stock, "vendor_id": f"v{i % 3}"}
+        )
+
+
+def cart(rng):
+    return [{"product_id": f"p{rng.randrange(DISTINCT_PRODUCTS)}", "quantity": 1} for _ in range(LINES)]
+
+
+def order_for(products):
+    return {"user_id": "u0", "products": products, "total_price": float(len(products)), "status": "pending"}
+
+
+def legacy_checkout(db, products):
+    """The previous implementation: one transactional read per order line"""
+    order_ref = db.collection('orders').document()
+
+    @firestore.transactional
+    def update_in_transaction(transaction, products):
+        updates = {}
+        for item in products:
+            ref = db.collection('products').document(item['product_id'])
+            doc = ref.get(transaction=transaction)
+            updates[ref.id] = (ref, doc.to_dict()['stock'] - item['quantity'])
+        for ref, new_stock in updates.values():
+            transaction.update(ref, {'stock': new_stock})
+        transaction.set(order_ref, dict(order_for(products), created_at=firestore.SERVER_TIMESTAMP))
+
+    update_in_transaction(db.transaction(), products)
+    return order_ref.get()
+
+
+def checkout_once(db, products):
+    return place_order(db, order_for(products), products, str(uuid.uuid4()))
+
+
+def single_checkout(rng):
+    products = cart(rng)
+    print(f"single {LINES}-line checkout, {LATENCY * 1000:.0f} ms per round trip")
+    for label, fn in (("per-line reads", legacy_checkout), ("batched get_all", checkout_once)):
+        db = MemoryFirestore(latency=LATENCY)
+        seed(db)
+        db.reset_stats()
+        started = time.perf_counter()
+        fn(db, products)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"  {label:<16} {elapsed:7.1f} ms  {db.stats['calls']:3} round trips  {db.stats['reads']:3} reads")
+
+
+def checkout(db, products):
+    try:
+        checkout_once(db, products)
+    except TransactionContentionError:
+        pass  # counted as "exhausted" in the transaction stats
+
+
+def contention(rng):
+    db = MemoryFirestore(latency=LATENCY / 5)
+    seed(db)
+    carts = [cart(rng) for _ in range(CONCURRENT_CHECKOUTS)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        list(pool.map(lambda products: checkout(db, products), carts))
+    elapsed = time.perf_counter() - started
+
+    stats = transaction_stats()["place_order"]
+    print(f"\n{CONCURRENT_CHECKOUTS} concurrent checkouts on {DISTINCT_PRODUCTS} products, {WORKERS} workers")
+    print(f"  {CONCURRENT_CHECKOUTS / elapsed:.0f} checkouts/s, committed {stats['committed']}, "
+          f"exhausted {stats['exhausted']}, retries {stats['retries']}, "
+          f"abort rate {stats['abort_rate']:.2f}, "
+          f"max {stats['max_seconds'] * 1000:.0f} ms")
+
+
+def main():
+    rng = random.Random(7)
+    single_checkout(rng)
+    contention(rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Firestore reads per vendor order listing: full scan vs indexed query.
+
+    python -m benchmarks.vendor_orders_bench
+"""
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from memory_firestore import MemoryFirestore
+from orders import list_orders
+from pagination import DEFAULT_PAGE_SIZE
+from vendor_orders import backfill_vendor_ids
+
+VENDORS = 20
+PRODUCTS_PER_VENDOR = 25
+LINES_PER_ORDER = 3
+ORDER_COUNTS = (100, 1000, 5000)
+
+
+def seed(db, order_count, rng):
+    product_ids = []
+    for v in range(VENDORS):
+        for p in range(PRODUCTS_PER_VENDOR):
+            ref = db.collection('products').document(f"p{v}_{p}")
+            ref.set({"name": ref.id, "price": 1.0, "stock": 100, "vendor_id": f"v{v}"})
+            product_ids.append(ref.id)
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    batch = db.batch()
+    for i in range(order_count):
+        items = [{"product_id": pid, "quantity": 1}
+                 for pid in rng.sample(product_ids, LINES_PER_ORDER)]
+        batch.set(db.collection('orders').document(f"o{i}"), {
+            "user_id": "customer",
+            "products": items,
+            "total_price": float(LINES_PER_ORDER),
+            "status": "pending",
+            "created_at": start + timedelta(minutes=i),
+        })
+        if (i + 1) % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+
+
+def legacy_vendor_orders(db, vendor_id):
+    """The previous implementation: scan every order, read products one by one"""
+    vendor_orders = []
+    for doc in db.collection('orders').stream():
+        order_data = doc.to_dict()
+        for product in order_data.get("products", []):
+            product_doc = db.collection('products').document(product["product_id"]).get()
+            if product_doc.exists and product_doc.to_dict().get("vendor_id") == vendor_id:
+                order_data["id"] = doc.id
+                vendor_orders.append(order_data)
+                break
+    return vendor_orders
+
+
+def measure(db, fn):
+    db.reset_stats()
+    started = time.perf_counter()
+    fn()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return db.stats["calls"], db.stats["reads"], elapsed_ms
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'orders':>8} | {'legacy calls':>12} {'reads':>8} {'ms':>8} | "
+          f"{'indexed calls':>13} {'reads':>6} {'ms':>6}")
+    for order_count in ORDER_COUNTS:
+        db = MemoryFirestore()
+        seed(db, order_count, rng)
+        backfill_vendor_ids(db)
+
+        legacy = measure(db, lambda: legacy_vendor_orders(db, "v0"))
+        indexed = measure(db, lambda: list_orders(db, DEFAULT_PAGE_SIZE, vendor_id="v0"))
+        print(f"{order_count:>8} | {legacy[0]:>12} {legacy[1]:>8} {legacy[2]:>8.1f} | "
+              f"{indexed[0]:>13} {indexed[1]:>6} {indexed[2]:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
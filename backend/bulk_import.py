@@ -0,0 +1,292 @@
+"""Bulk product import from CSV or NDJSON, with an optional zip of images.
+
+An import runs as a background task of the worker that received it. Rows are
+validated against the ``Product`` model and written in Firestore
+transactions of up to ``BATCH_SIZE`` products, each with the registration of
+its barcode; a row whose barcode another product holds fails alone. Images
+referenced by the ``image`` column are taken from the zip and uploaded at
+most ``IMPORT_UPLOAD_CONCURRENCY`` at a time. Progress and per-row errors are
+stored in ``import_jobs/{job_id}`` after every batch so any worker can report
+them.
+"""
+import asyncio
+import csv
+import itertools
+import json
+import logging
+import os
+import uuid
+import zipfile
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from firebase_admin import firestore
+from pydantic import ValidationError
+
+from async_io import run_blocking
+from barcodes import barcode_index, normalize_barcode, register_barcodes
+from transactions import run_transaction
+from uploads import UPLOAD_CHUNK_SIZE, UPLOAD_DIR, UPLOAD_MAX_BYTES, remove_temp_file, sniff_image_type
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+IMPORT_UPLOAD_CONCURRENCY = int(os.getenv("IMPORT_UPLOAD_CONCURRENCY", "4"))
+# Firestore accepts at most 500 writes per transaction: a product and its barcode each
+BATCH_SIZE = 250
+# Keeps the job document far below Firestore's 1 MiB limit
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+# Strong references to running imports, so they are not garbage collected
+_running = set()
+
+
+def _create_products(transaction, db, products):
+    """Write the products whose barcode is free; returns the ids of the others"""
+    refused = set(register_barcodes(
+        transaction, db, [(ref.id, product.get("barcode"), None) for ref, product in products]
+    ))
+    for ref, product in products:
+        if ref.id not in refused:
+            transaction.set(ref, dict(product, created_at=firestore.SERVER_TIMESTAMP))
+    return refused
+
+
+def import_format(filename: Optional[str]) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Import file must be .csv, .ndjson or .jsonl"
+        )
+    return IMPORT_FORMATS[extension]
+
+
+def iter_rows(path: str, fmt: str):
+    """Yield ``(row_number, row)``; ``row`` is a dict, or the error that made it unreadable"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            for row_number, row in enumerate(csv.DictReader(f), start=1):
+                yield row_number, row
+            return
+        for row_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, ValueError(f"Invalid JSON: {e.msg}")
+                continue
+            yield row_number, row if isinstance(row, dict) else ValueError("Row is not a JSON object")
+
+
+def _read_rows(rows, count: int) -> list:
+    """The next ``count`` items of ``iter_rows`` (blocking: reads and parses the file)"""
+    return list(itertools.islice(rows, count))
+
+
+def _clean(row: dict) -> dict:
+    # CSV cells are strings; an empty cell means "no value"
+    cleaned = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip() or None
+        if value is not None:
+            cleaned[key.strip()] = value
+    return cleaned
+
+
+def _format_error(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in exc.errors()
+        )
+    if isinstance(exc, HTTPException):
+        return str(exc.detail)
+    return str(exc)
+
+
+class ProductImport:
+    """One import job: validates rows, uploads their images and writes them in batches.
+
+    ``upload_image(path)`` must return ``(image_url, image_variants)`` and
+    ``delete_images(product)`` undo it; ``on_created(product_id, product)`` is
+    called for every committed product so callers can refresh their caches.
+    """
+
+    def __init__(self, db, vendor_id, model, upload_image, delete_images, on_created):
+        self.db = db
+        self.vendor_id = vendor_id
+        self.model = model
+        self.upload_image = upload_image
+        self.delete_images = delete_images
+        self.on_created = on_created
+        self.job_id = uuid.uuid4().hex
+        self.job_ref = db.collection('import_jobs').document(self.job_id)
+        self._semaphore = asyncio.Semaphore(IMPORT_UPLOAD_CONCURRENCY)
+        self._zip = None
+        self.processed = 0
+        self.created = 0
+        self.errors = []
+        self.failed = 0
+
+    def _fail_row(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def _progress(self, **extra):
+        progress = {
+            "processed": self.processed,
+            "created": self.created,
+            "failed": self.failed,
+            "errors": self.errors,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }
+        progress.update(extra)
+        return progress
+
+    def _extract_image(self, name: str) -> str:
+        """Copy one archive member to a temporary file (blocking)"""
+        if self._zip is None:
+            raise ValueError("Row references an image but no images archive was uploaded")
+        try:
+            info = self._zip.getinfo(name)
+        except KeyError:
+            raise ValueError(f"Image '{name}' not found in the archive")
+        if info.file_size > UPLOAD_MAX_BYTES:
+            raise ValueError(f"Image '{name}' is larger than {UPLOAD_MAX_BYTES / (1024 * 1024):g} MB")
+
+        with self._zip.open(info) as member:
+            head = member.read(UPLOAD_CHUNK_SIZE)
+            sniffed = sniff_image_type(head)
+            if sniffed is None:
+                raise ValueError(f"Image '{name}' is not a supported image format")
+            path = os.path.join(UPLOAD_DIR, f"temp_{uuid.uuid4()}{sniffed[1]}")
+            with open(path, "wb") as out:
+                while head:
+                    out.write(head)
+                    head = member.read(UPLOAD_CHUNK_SIZE)
+        return path
+
+    async def _prepare(self, row_number, row):
+        """Validate a row, reserve its barcode and upload its image.
+
+        Returns ``(document_ref, product)``, or None if the row failed.
+        """
+        temp_path = None
+        ref = None
+        try:
+            row = _clean(row)
+            image_name = row.pop("image", None)
+            product = self.model(**dict(row, vendor_id=self.vendor_id)).dict(exclude={"id"})
+            product["barcode"] = normalize_barcode(product.get("barcode"))
+            ref = self.db.collection('products').document()
+            await run_blocking(barcode_index.claim, self.db, ref.id, product["barcode"])
+            if image_name:
+                async with self._semaphore:
+                    temp_path = await run_blocking(self._extract_image, image_name)
+                    product["image_url"], product["image_variants"] = await self.upload_image(temp_path)
+            return ref, product
+        except Exception as e:
+            if ref is not None:
+                barcode_index.remove(ref.id)
+            self._fail_row(row_number, _format_error(e))
+            return None
+        finally:
+            remove_temp_file(temp_path)
+
+    async def _write_chunk(self, chunk):
+        prepared = await asyncio.gather(*(self._prepare(n, row) for n, row in chunk))
+        products = [(n, p) for (n, _), p in zip(chunk, prepared) if p is not None]
+
+        if products:
+            try:
+                refused = await run_blocking(
+                    run_transaction, self.db, "product_import", _create_products,
+                    self.db, [prepared for _, prepared in products]
+                )
+            except Exception as e:
+                for row_number, (ref, product) in products:
+                    self._fail_row(row_number, f"Write failed: {e}")
+                    barcode_index.remove(ref.id)
+                    await self.delete_images(product)
+            else:
+                for row_number, (ref, product) in products:
+                    if ref.id in refused:
+                        self._fail_row(row_number, f"Barcode {product['barcode']} is already used by another product")
+                        barcode_index.remove(ref.id)
+                        await self.delete_images(product)
+                    else:
+                        self.created += 1
+                        self.on_created(ref.id, product)
+
+        self.processed += len(chunk)
+        await run_blocking(self.job_ref.update, self._progress())
+
+    async def run(self, data_path: str, fmt: str, zip_path: Optional[str] = None):
+        rows = None
+        try:
+            await run_blocking(self.job_ref.update, {"status": "running"})
+            if zip_path:
+                self._zip = await run_blocking(zipfile.ZipFile, zip_path)
+
+            # The file is read and parsed in the I/O pool, BATCH_SIZE rows at a time
+            rows = iter_rows(data_path, fmt)
+            chunk = []
+            while True:
+                read = await run_blocking(_read_rows, rows, BATCH_SIZE)
+                if not read:
+                    break
+                for row_number, row in read:
+                    if isinstance(row, Exception):
+                        self.processed += 1
+                        self._fail_row(row_number, str(row))
+                        continue
+                    chunk.append((row_number, row))
+                    if len(chunk) == BATCH_SIZE:
+                        await self._write_chunk(chunk)
+                        chunk = []
+            if chunk:
+                await self._write_chunk(chunk)
+
+            await run_blocking(self.job_ref.update, self._progress(
+                status="completed", finished_at=firestore.SERVER_TIMESTAMP
+            ))
+        except Exception as e:
+            logger.exception("product import failed", extra={"job_id": self.job_id})
+            await run_blocking(self.job_ref.update, self._progress(
+                status="failed", error=str(e), finished_at=firestore.SERVER_TIMESTAMP
+            ))
+        finally:
+            if rows is not None:
+                rows.close()
+            if self._zip is not None:
+                self._zip.close()
+            remove_temp_file(data_path)
+            remove_temp_file(zip_path)
+
+    async def start(self, filename: str, data_path: str, fmt: str, zip_path: Optional[str] = None) -> str:
+        """Record the job as queued and run it in the background; returns the job id"""
+        await run_blocking(self.job_ref.set, {
+            "status": "queued",
+            "vendor_id": self.vendor_id,
+            "filename": filename,
+            "processed": 0,
+            "created": 0,
+            "failed": 0,
+            "errors": [],
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        })
+        task = asyncio.create_task(self.run(data_path, fmt, zip_path))
+        _running.add(task)
+        task.add_done_callback(_running.discard)
+        return self.job_id
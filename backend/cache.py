@@ -0,0 +1,108 @@
+"""Small in-process caches used to avoid repeated Firestore and Firebase calls."""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+# Named caches, reported together by cache_stats()
+_registry = {}
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after a time-to-live.
+
+    Every entry gets the cache-wide ``ttl`` unless a shorter one is passed to
+    ``set``. When full, the least recently used entry is evicted. Hits, misses,
+    evictions and expirations are counted for sizing. Caches created with a
+    ``name`` are included in ``cache_stats()``.
+
+    Entries of very different sizes can also be bounded together: with
+    ``weigh``, the sum of ``weigh(value)`` over the entries is kept within
+    ``maxweight``, and a value heavier than that on its own is not cached.
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic, name=None, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self._weigh = weigh
+        self.weight = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if name:
+            _registry[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at, weight = entry
+                if expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.weight -= weight
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        weight = self._weigh(value) if self._weigh else 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self.weight -= previous[2]
+            if self.maxweight is not None and weight > self.maxweight:
+                return
+            self._entries[key] = (value, self._clock() + ttl, weight)
+            self.weight += weight
+            while len(self._entries) > self.maxsize or (
+                self.maxweight is not None and self.weight > self.maxweight
+            ):
+                self.weight -= self._entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self.weight -= entry[2]
+            return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "weight": self.weight,
+            "maxweight": self.maxweight,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def cache_stats():
+    """Statistics of every named cache, keyed by name"""
+    return {name: cache.stats() for name, cache in _registry.items()}
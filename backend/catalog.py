@@ -0,0 +1,137 @@
+"""Product catalog queries: cursor pagination, field projection, sorting and NDJSON export."""
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from firebase_admin import firestore
+
+from async_io import run_blocking
+from pagination import fetch_page, iter_pages
+from serialization import dumps_line
+from sharded_stock import shard_totals
+
+PRODUCT_FIELDS = {
+    "id", "name", "description", "price", "image_url", "image_variants", "gallery", "stock",
+    "vendor_id", "barcode", "created_at",
+}
+# Fields covered by Firestore's automatic single-field indexes that clients may sort on
+SORTABLE_FIELDS = {"name", "price", "stock", "created_at"}
+EXPORT_PAGE_SIZE = 500
+# Largest number of ids resolved by one batch fetch
+MAX_BATCH_PRODUCTS = 300
+# Derivatives produced by images.py that image_url can be swapped for
+IMAGE_VARIANT_PATTERN = "^(thumbnail|medium|webp)$"
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Turn ``fields=id,name,price`` into a projection list (None means all fields)"""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = sorted(set(requested) - PRODUCT_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown product fields: {', '.join(unknown)}"
+        )
+    return requested
+
+
+def parse_sort(sort: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Turn ``sort=price`` / ``sort=-price`` into ``(field, direction)``"""
+    if not sort:
+        return None
+    field = sort.lstrip("-")
+    if field not in SORTABLE_FIELDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cannot sort on '{field}', use one of: {', '.join(sorted(SORTABLE_FIELDS))}"
+        )
+    direction = firestore.Query.DESCENDING if sort.startswith("-") else firestore.Query.ASCENDING
+    return field, direction
+
+
+def apply_image_variant(product: dict, variant: Optional[str]) -> dict:
+    """Point ``image_url`` at the requested derivative when the product has one, also in its gallery"""
+    if not variant:
+        return product
+    variant_url = (product.get("image_variants") or {}).get(variant)
+    if variant_url:
+        product = dict(product, image_url=variant_url)
+    if product.get("gallery"):
+        product = dict(product, gallery=[apply_image_variant(entry, variant) for entry in product["gallery"]])
+    return product
+
+
+def products_query(db, sort: Optional[Tuple[str, str]] = None, fields: Optional[List[str]] = None,
+                   variant: Optional[str] = None):
+    query = db.collection('products')
+    if sort:
+        query = query.order_by(sort[0], direction=sort[1])
+    if fields is not None:
+        # The document id comes with every snapshot, it is not a stored field.
+        # The sort field is always read so projected snapshots can act as cursors.
+        selected = {f for f in fields if f != "id"}
+        if sort:
+            selected.add(sort[0])
+        if variant and "image_url" in selected:
+            selected.add("image_variants")
+        if "stock" in selected:
+            selected.add("stock_shards")
+        query = query.select(sorted(selected))
+    return query
+
+
+def sharded_stock_of(db, docs) -> Dict[str, int]:
+    """Current stock of the products among ``docs`` that keep it in stock shards (blocking)"""
+    sharded = {}
+    for doc in docs:
+        shard_count = doc.to_dict().get("stock_shards") or 0
+        if shard_count >= 2:
+            sharded[doc.id] = shard_count
+    return shard_totals(db, sharded) if sharded else {}
+
+
+def product_from_doc(doc, fields: Optional[List[str]] = None, variant: Optional[str] = None,
+                     stock: Optional[int] = None) -> dict:
+    """``stock`` overrides the stored value, for products with sharded stock"""
+    product_data = doc.to_dict()
+    product_data["id"] = doc.id
+    if stock is not None and "stock" in product_data:
+        product_data["stock"] = stock
+    return project_product(product_data, fields, variant)
+
+
+def project_product(product: dict, fields: Optional[List[str]] = None, variant: Optional[str] = None) -> dict:
+    """Apply an image variant, then keep only ``fields`` (None keeps every field)"""
+    product = apply_image_variant(product, variant)
+    if fields is not None:
+        product = {f: product[f] for f in fields if f in product}
+    return product
+
+
+def list_products(db, sort=None, fields=None, variant=None) -> List[dict]:
+    """Return the whole catalog (used when no page size is requested)"""
+    docs = list(products_query(db, sort, fields, variant).stream())
+    stock = sharded_stock_of(db, docs)
+    return [product_from_doc(doc, fields, variant, stock.get(doc.id)) for doc in docs]
+
+
+def list_products_page(db, limit, start_after=None, sort=None, fields=None, variant=None):
+    """Return one page of the catalog as ``(products, next_cursor)``"""
+    docs, next_cursor = fetch_page(
+        products_query(db, sort, fields, variant), db.collection('products'), limit, start_after
+    )
+    stock = sharded_stock_of(db, docs)
+    return [product_from_doc(doc, fields, variant, stock.get(doc.id)) for doc in docs], next_cursor
+
+
+async def stream_products_ndjson(db, sort=None, fields=None, variant=None, page_size=EXPORT_PAGE_SIZE):
+    """Yield the catalog as NDJSON lines, fetching one Firestore page at a time"""
+    pages = iter_pages(products_query(db, sort, fields, variant), page_size)
+    while True:
+        docs = await run_blocking(next, pages, None)
+        if docs is None:
+            return
+        stock = await run_blocking(sharded_stock_of, db, docs)
+        for doc in docs:
+            yield dumps_line(product_from_doc(doc, fields, variant, stock.get(doc.id)))
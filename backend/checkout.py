@@ -0,0 +1,96 @@
+"""Order placement: stock, sales aggregates and the order written in one transaction.
+
+A request may carry an ``Idempotency-Key`` header. The key is stored in
+``idempotency_keys`` together with the id of the order, in the same
+transaction that reserves the stock and writes the order, so a retried request
+either finds that record and gets the original order back, or finds nothing
+because the first attempt never committed. Two concurrent requests with the
+same key conflict on the key document; the loser retries and replays the
+winner's order. Keys are scoped to the user and expire after
+``IDEMPOTENCY_TTL`` seconds; enable a Firestore TTL policy on
+``idempotency_keys.expires_at`` to have expired records deleted.
+
+The response is the order as stored, read back after the commit, so its
+``created_at`` is the server timestamp Firestore assigned. The ordered
+products are returned too, with their new stock, for ``product_feed``.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from firebase_admin import firestore
+
+from orders import order_from_doc
+from sharded_stock import with_shard_totals
+from stock import merge_lines, reserve_in_transaction
+from transactions import run_transaction
+
+load_dotenv()
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+IDEMPOTENT_REPLAY_HEADER = "Idempotent-Replayed"
+
+
+def _fingerprint(order: dict) -> str:
+    # Identifies the request body, so a key reused for another order is caught
+    body = {key: value for key, value in order.items() if key != "created_at"}
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _key_ref(db, user_id: str, key: str):
+    digest = hashlib.sha256(f"{user_id}\n{key}".encode()).hexdigest()
+    return db.collection('idempotency_keys').document(digest)
+
+
+def _place_in_transaction(transaction, db, order_ref, order, quantities, key_ref, fingerprint):
+    now = datetime.now(timezone.utc)
+    if key_ref is not None:
+        record = key_ref.get(transaction=transaction)
+        if record.exists and record.get('expires_at') > now:
+            if record.get('fingerprint') != fingerprint:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Idempotency-Key already used for a different order"
+                )
+            return record.get('order_id'), True, {}
+
+    vendor_ids, reserved = reserve_in_transaction(transaction, db, quantities)
+    # Denormalised so vendors can list their orders with one indexed query
+    order = dict(order, vendor_ids=vendor_ids, created_at=firestore.SERVER_TIMESTAMP)
+    transaction.set(order_ref, order)
+
+    if key_ref is not None:
+        transaction.set(key_ref, {
+            "user_id": order["user_id"],
+            "order_id": order_ref.id,
+            "fingerprint": fingerprint,
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL),
+        })
+    return order_ref.id, False, reserved
+
+
+def place_order(db, order: dict, products: List[dict],
+                idempotency_key: Optional[str] = None) -> Tuple[dict, bool, Dict[str, dict]]:
+    """
+    Reserve stock for ``products`` and write ``order`` atomically. Returns the created
+    order, whether it is the replay of an earlier request with the same idempotency
+    key, and ``{product_id: data}`` of the ordered products with their new stock (empty
+    for a replay). Blocking: run it through ``run_blocking``.
+    """
+    quantities = merge_lines(products)
+    order_ref = db.collection('orders').document()
+    key_ref = _key_ref(db, order["user_id"], idempotency_key) if idempotency_key else None
+    order_id, replayed, reserved = run_transaction(
+        db, "place_order", _place_in_transaction,
+        db, order_ref, order, quantities, key_ref, _fingerprint(order),
+    )
+    # Sharded stock is only known once the shards are read back
+    reserved = with_shard_totals(db, reserved)
+    # Read back so the response carries the created_at Firestore stored
+    return order_from_doc(db.collection('orders').document(order_id).get()), replayed, reserved
@@ -1,10 +1,13 @@
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
+import logging
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 def initialize_firebase_app():
     """Initialize Firebase Admin SDK"""
     cred_path = os.getenv('FIREBASE_CREDENTIALS_PATH', 'serviceAccountKey.json')
@@ -20,7 +23,7 @@ def initialize_firebase_app():
         
         return db
     except Exception as e:
-        print(f"Error initializing Firebase: {e}")
+        logger.exception("could not initialize Firebase")
         raise e
 
 def get_db():
@@ -0,0 +1,122 @@
+"""Ordered image galleries of products.
+
+A product stores its images as ``gallery``, a list of
+``{"id", "image_url", "image_variants"}``, and keeps ``image_url`` and
+``image_variants`` as a copy of the first one so clients that know a single
+image keep working. Products written before galleries have no ``gallery``
+field; their single image is their gallery.
+
+An image's ``id`` is the name of its Cloudinary asset, so reordering or
+removing images only rewrites the list and never uploads anything again.
+The images of one request are uploaded concurrently, at most
+``GALLERY_UPLOAD_CONCURRENCY`` at a time, so a request takes about as long as
+its slowest upload. If one fails, those not started yet are skipped and those
+that succeeded are deleted again.
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile, status
+
+from image_cleanup import public_id_from_url
+
+load_dotenv()
+
+GALLERY_MAX_IMAGES = int(os.getenv("GALLERY_MAX_IMAGES", "12"))
+GALLERY_UPLOAD_CONCURRENCY = int(os.getenv("GALLERY_UPLOAD_CONCURRENCY", "4"))
+
+
+def gallery_entry(image_url: str, image_variants: Optional[Dict[str, str]]) -> dict:
+    public_id = public_id_from_url(image_url) or os.path.splitext(image_url)[0]
+    return {
+        "id": public_id.rsplit("/", 1)[-1],
+        "image_url": image_url,
+        "image_variants": image_variants or {},
+    }
+
+
+def product_gallery(product_data: dict) -> List[dict]:
+    """The gallery of a stored product"""
+    gallery = product_data.get("gallery")
+    if gallery is not None:
+        return list(gallery)
+    if product_data.get("image_url"):
+        return [gallery_entry(product_data["image_url"], product_data.get("image_variants"))]
+    return []
+
+
+def gallery_fields(gallery: List[dict]) -> dict:
+    """The product fields to write for ``gallery``"""
+    cover = gallery[0] if gallery else {}
+    return {
+        "gallery": gallery,
+        "image_url": cover.get("image_url"),
+        "image_variants": cover.get("image_variants") or {},
+    }
+
+
+def arrange_gallery(gallery: List[dict], order: Optional[str]) -> List[dict]:
+    """Keep the images named in ``order`` (comma-separated ids), in that order.
+
+    None keeps the gallery as it is. Raises 400 for ids that are not in the gallery.
+    """
+    if order is None:
+        return gallery
+    ids = [image_id.strip() for image_id in order.split(",") if image_id.strip()]
+    by_id = {entry["id"]: entry for entry in gallery}
+    unknown = [image_id for image_id in ids if image_id not in by_id]
+    if unknown or len(set(ids)) != len(ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"gallery must list distinct ids of the product's images; unknown: {', '.join(unknown)}"
+        )
+    return [by_id[image_id] for image_id in ids]
+
+
+def new_images(*files: Optional[UploadFile]) -> List[UploadFile]:
+    """The uploaded files of a form, without the empty parts some clients send"""
+    return [file for file in files if file is not None and file.filename]
+
+
+def check_gallery_size(count: int) -> None:
+    if count > GALLERY_MAX_IMAGES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A product can have at most {GALLERY_MAX_IMAGES} images"
+        )
+
+
+async def upload_gallery(
+    files: List[UploadFile],
+    upload: Callable[[UploadFile], Awaitable[Tuple[str, Dict[str, str]]]],
+    discard: Callable[[List[dict]], Awaitable[None]],
+    concurrency: Optional[int] = None,
+) -> List[dict]:
+    """Upload ``files`` concurrently and return their gallery entries in the same order.
+
+    ``upload(file)`` returns ``(image_url, image_variants)``; ``discard(entries)``
+    deletes uploaded images again. Should any upload fail, the images already
+    uploaded are discarded and the first error is raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency or GALLERY_UPLOAD_CONCURRENCY)
+    failed = asyncio.Event()
+
+    async def upload_one(file):
+        async with semaphore:
+            if failed.is_set():
+                return None
+            try:
+                return gallery_entry(*await upload(file))
+            except BaseException:
+                failed.set()
+                raise
+
+    results = await asyncio.gather(*(upload_one(file) for file in files), return_exceptions=True)
+    if failed.is_set():
+        uploaded = [entry for entry in results if isinstance(entry, dict)]
+        if uploaded:
+            await discard(uploaded)
+        raise next(error for error in results if isinstance(error, BaseException))
+    return results
@@ -0,0 +1,134 @@
+"""Deferred deletion of product images and sweeping of leftovers.
+
+Requests never wait for Cloudinary to delete an image: ``schedule_image_deletion``
+enqueues one ``delete_image`` job per asset and the background job queue
+retries it until Cloudinary confirms. Two periodic sweeps catch what slips
+through anyway:
+
+- temporary files older than ``TEMP_FILE_MAX_AGE`` in ``UPLOAD_DIR``, left
+  behind by a worker that died mid-upload (each worker sweeps its own disk);
+- assets under ``ASSET_FOLDER`` that no product references, older than
+  ``ORPHAN_ASSET_GRACE`` so uploads whose product is still being written are
+  spared. This sweep lists every asset and reads the image fields of every
+  product, so it runs as a single ``sweep_assets`` job shared by all workers.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional, Set
+
+from dotenv import load_dotenv
+
+from jobs import job_queue
+from uploads import UPLOAD_DIR
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ASSET_FOLDER = "shopease/products"
+DELETE_IMAGE_JOB = "delete_image"
+SWEEP_ASSETS_JOB = "sweep_assets"
+
+SWEEP_INTERVAL = float(os.getenv("SWEEP_INTERVAL", "3600"))
+# Long enough for the slowest bulk import, which keeps its spooled file open
+TEMP_FILE_MAX_AGE = float(os.getenv("TEMP_FILE_MAX_AGE", str(6 * 3600)))
+ORPHAN_ASSET_GRACE = float(os.getenv("ORPHAN_ASSET_GRACE", "3600"))
+
+
+def public_id_from_url(image_url: Optional[str]) -> Optional[str]:
+    """Cloudinary public id of a delivery URL, None if it is not a Cloudinary URL.
+
+    URL format: https://res.cloudinary.com/cloud_name/image/upload/v1234567890/shopease/products/filename.jpg
+    """
+    if not image_url or "cloudinary.com" not in image_url:
+        return None
+    parts = image_url.split("upload/", 1)
+    if len(parts) < 2:
+        return None
+    path = parts[1]
+    # Drop the version segment (v1234567890/) when there is one
+    version, _, rest = path.partition("/")
+    if rest and version[:1] == "v" and version[1:].isdigit():
+        path = rest
+    return os.path.splitext(path)[0]
+
+
+def product_image_urls(product_data: dict) -> list:
+    """The images of a product, or of a gallery entry, and all their derivatives"""
+    urls = [product_data.get("image_url")] + list((product_data.get("image_variants") or {}).values())
+    for entry in product_data.get("gallery") or ():
+        urls.extend(product_image_urls(entry))
+    return [url for url in urls if url]
+
+
+def schedule_image_deletion(db, urls: Iterable[str]) -> None:
+    """Enqueue the deletion of ``urls`` from Cloudinary (blocking, one batched write)"""
+    public_ids = {public_id_from_url(url) for url in urls} - {None}
+    job_queue.enqueue(db, DELETE_IMAGE_JOB, [{"public_id": public_id} for public_id in sorted(public_ids)])
+
+
+def delete_image(images, public_id: str) -> None:
+    """Delete one asset; raises so the job is retried unless Cloudinary confirms"""
+    result = images.destroy(public_id)
+    # "not found" means an earlier attempt already deleted it
+    if result.get("result") not in ("ok", "not found"):
+        raise RuntimeError(f"Cloudinary did not delete {public_id}: {result}")
+
+
+def sweep_temp_files(directory: str = UPLOAD_DIR, max_age: float = TEMP_FILE_MAX_AGE) -> int:
+    """Delete the files of ``directory`` not modified for ``max_age`` seconds; returns the count"""
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass  # removed by its request in the meantime
+    if removed:
+        logger.info("removed stale temporary files", extra={"count": removed, "directory": directory})
+    return removed
+
+
+def referenced_public_ids(db) -> Set[str]:
+    """Public ids of every image a product points at (blocking, one projected scan)"""
+    referenced = set()
+    for doc in db.collection('products').select(["gallery", "image_url", "image_variants"]).stream():
+        for url in product_image_urls(doc.to_dict() or {}):
+            public_id = public_id_from_url(url)
+            if public_id:
+                referenced.add(public_id)
+    return referenced
+
+
+def sweep_orphaned_assets(db, images, grace: float = ORPHAN_ASSET_GRACE) -> int:
+    """Enqueue the deletion of unreferenced assets older than ``grace`` seconds; returns the count"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace)
+    # Listed first: an asset uploaded after the scan below is too recent to be swept
+    assets = images.list_assets(ASSET_FOLDER)
+    referenced = referenced_public_ids(db)
+    orphans = sorted(public_id for public_id, created_at in assets
+                     if created_at < cutoff and public_id not in referenced)
+    job_queue.enqueue(db, DELETE_IMAGE_JOB, [{"public_id": public_id} for public_id in orphans])
+    if orphans:
+        logger.info("scheduled deletion of orphaned images", extra={"count": len(orphans)})
+    return len(orphans)
+
+
+def register_cleanup(db, images) -> None:
+    """Register the image jobs and the periodic sweeps with the job queue"""
+    job_queue.register(DELETE_IMAGE_JOB, lambda payload: delete_image(images, payload["public_id"]))
+    job_queue.register(SWEEP_ASSETS_JOB, lambda payload: sweep_orphaned_assets(db, images))
+    job_queue.every("sweep_temp_files", SWEEP_INTERVAL, sweep_temp_files)
+    # Every worker schedules the asset sweep under the same id, so they share one job
+    job_queue.every(
+        "schedule_asset_sweep", SWEEP_INTERVAL,
+        lambda: job_queue.enqueue_once(db, SWEEP_ASSETS_JOB, SWEEP_ASSETS_JOB, {}),
+    )
@@ -0,0 +1,92 @@
+"""Resized derivatives of product images, generated in a process pool.
+
+Decoding and resizing photos is CPU-bound and holds the GIL, so it runs in
+separate worker processes (``IMAGE_WORKERS``) rather than in the I/O threads
+or on the event loop. Each source image yields one file per entry of
+``DERIVATIVES``; the catalog serves the small ones instead of the original.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+load_dotenv()
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# name -> (longest side in pixels, Pillow format, file extension)
+DERIVATIVES = {
+    "thumbnail": (200, "JPEG", ".jpg"),
+    "medium": (800, "JPEG", ".jpg"),
+    "webp": (800, "WEBP", ".webp"),
+}
+
+_pool = None
+
+
+def make_derivatives(source_path: str) -> Dict[str, str]:
+    """Write every derivative of ``source_path`` next to it and return their paths.
+
+    Runs inside a pool process, so it only takes and returns picklable values.
+    """
+    base = os.path.splitext(source_path)[0]
+    paths = {}
+    try:
+        with Image.open(source_path) as image:
+            image.load()
+            # Phone photos are stored sideways with an EXIF Orientation tag
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            for name, (size, image_format, extension) in DERIVATIVES.items():
+                resized = image.copy()
+                resized.thumbnail((size, size), Image.LANCZOS)
+                path = f"{base}_{name}{extension}"
+                paths[name] = path
+                resized.save(path, image_format, quality=85, optimize=True)
+    except BaseException:
+        # The caller never sees these paths, so it cannot remove them
+        for path in paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return paths
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked: the parent runs gRPC and I/O threads
+        _pool = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+def warm_pool() -> None:
+    """Start the resizing processes now rather than on the first upload (blocking)"""
+    pool = _get_pool()
+    for future in [pool.submit(_ready) for _ in range(IMAGE_WORKERS)]:
+        future.result()
+
+
+async def generate_derivatives(source_path: str) -> Dict[str, str]:
+    """Create the derivatives of an image in the process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), make_derivatives, source_path)
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,230 @@
+"""Persistent background jobs with retries and exponential backoff.
+
+Side effects that must happen eventually but need not delay a response, such
+as deleting images from Cloudinary, are written to the ``jobs`` collection by
+``enqueue`` and run by a thread in every worker. A worker claims a due job in
+a transaction by moving its ``due_at`` ``JOB_LEASE`` seconds ahead, so no two
+workers run it at once, and a job whose worker died becomes due again when the
+lease runs out. Jobs survive restarts because they live in Firestore.
+
+A job that succeeds is deleted. One that raises is retried after a full-jitter
+exponential backoff; after ``JOB_MAX_ATTEMPTS`` attempts it is kept with
+``status: failed`` and its last error. Handlers must be idempotent, since a job
+runs again if its worker dies before deleting it.
+
+The same thread runs the periodic tasks registered with ``every``.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable
+
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+from transactions import TransactionContentionError, backoff_delay, run_transaction
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "8"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "5"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "3600"))
+# Seconds a claimed job stays invisible to other workers while it runs
+JOB_LEASE = float(os.getenv("JOB_LEASE", "300"))
+# Seconds between two looks for due jobs when nothing wakes the worker up
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+JOB_BATCH = 20
+# Firestore's limit on the writes of one batch
+MAX_BATCH_WRITES = 500
+
+
+class JobQueue:
+    def __init__(self):
+        self._handlers = {}
+        self._periodic = {}
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._db = None
+
+    def register(self, kind: str, handler: Callable[[dict], None]) -> None:
+        """Run ``handler(payload)`` for the jobs of ``kind``"""
+        self._handlers[kind] = handler
+
+    def every(self, name: str, interval: float, task: Callable[[], None]) -> None:
+        """Call ``task()`` from the worker thread every ``interval`` seconds, replacing ``name``"""
+        self._periodic[name] = [interval, task, time.monotonic() + interval]
+
+    def _count(self, kind, key):
+        with self._stats_lock:
+            entry = self._stats.setdefault(kind, dict.fromkeys(("enqueued", "succeeded", "retried", "failed"), 0))
+            entry[key] += 1
+
+    def stats(self) -> Dict[str, dict]:
+        """Jobs enqueued, succeeded, retried and failed per kind by this worker"""
+        with self._stats_lock:
+            return {kind: dict(entry) for kind, entry in self._stats.items()}
+
+    @staticmethod
+    def _new_job(kind: str, payload: dict, delay: float) -> dict:
+        return {
+            "kind": kind,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "due_at": datetime.now(timezone.utc) + timedelta(seconds=delay),
+            "created_at": firestore.SERVER_TIMESTAMP,
+        }
+
+    def enqueue(self, db, kind: str, payloads: Iterable[dict], delay: float = 0.0) -> None:
+        """Persist one job per payload, in batched writes (blocking)"""
+        jobs = db.collection('jobs')
+        payloads = list(payloads)
+        for start in range(0, len(payloads), MAX_BATCH_WRITES):
+            batch = db.batch()
+            for payload in payloads[start:start + MAX_BATCH_WRITES]:
+                batch.set(jobs.document(), self._new_job(kind, payload, delay))
+            batch.commit()
+        for _ in payloads:
+            self._count(kind, "enqueued")
+        if payloads:
+            self._wake.set()
+
+    def _enqueue_once_in_transaction(self, transaction, ref, job):
+        doc = ref.get(field_paths=["status"], transaction=transaction)
+        if doc.exists and doc.to_dict().get("status") == "pending":
+            return False
+        transaction.set(ref, job)
+        return True
+
+    def enqueue_once(self, db, kind: str, job_id: str, payload: dict, delay: float = 0.0) -> bool:
+        """Persist the job ``job_id`` unless it is already pending (blocking).
+
+        A pending job, whether waiting, leased by a worker or backing off, is
+        left alone so it never runs twice at once; a failed one is replaced.
+        Returns whether the job was written.
+        """
+        ref = db.collection('jobs').document(job_id)
+        try:
+            created = run_transaction(
+                db, "job_enqueue", self._enqueue_once_in_transaction, ref, self._new_job(kind, payload, delay),
+                max_attempts=1,
+            )
+        except TransactionContentionError:
+            # Another worker wrote the job at the same moment
+            return False
+        if created:
+            self._count(kind, "enqueued")
+            self._wake.set()
+        return created
+
+    def _claim_in_transaction(self, transaction, ref):
+        now = datetime.now(timezone.utc)
+        doc = ref.get(transaction=transaction)
+        if not doc.exists:
+            return None
+        job = doc.to_dict()
+        if job.get("status") != "pending" or job["due_at"] > now:
+            return None
+        job["attempts"] = job.get("attempts", 0) + 1
+        transaction.update(ref, {
+            "attempts": job["attempts"],
+            "due_at": now + timedelta(seconds=JOB_LEASE),
+        })
+        return job
+
+    def _run(self, ref, job) -> None:
+        kind = job["kind"]
+        try:
+            handler = self._handlers.get(kind)
+            if handler is None:
+                raise LookupError(f"No handler for job kind {kind!r}")
+            handler(job["payload"])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job["attempts"] >= JOB_MAX_ATTEMPTS:
+                ref.update({"status": "failed", "last_error": error})
+                self._count(kind, "failed")
+                logger.error("background job failed", extra={"job_id": ref.id, "kind": kind, "error": error})
+            else:
+                delay = backoff_delay(job["attempts"], JOB_BACKOFF_BASE, JOB_BACKOFF_MAX)
+                ref.update({
+                    "due_at": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                    "last_error": error,
+                })
+                self._count(kind, "retried")
+                logger.warning("background job will be retried",
+                               extra={"job_id": ref.id, "kind": kind, "attempt": job["attempts"], "error": error})
+            return
+        ref.delete()
+        self._count(kind, "succeeded")
+
+    def run_due(self, db, limit: int = JOB_BATCH) -> int:
+        """Claim and run up to ``limit`` due jobs; returns how many were found (blocking)"""
+        query = (
+            db.collection('jobs')
+            .where('status', '==', 'pending')
+            .where('due_at', '<=', datetime.now(timezone.utc))
+            .order_by('due_at')
+            .limit(limit)
+        )
+        docs = list(query.stream())
+        for doc in docs:
+            try:
+                # One attempt: an aborted claim means another worker got the job
+                job = run_transaction(db, "job_claim", self._claim_in_transaction, doc.reference, max_attempts=1)
+            except TransactionContentionError:
+                continue
+            if job is not None:
+                self._run(doc.reference, job)
+        return len(docs)
+
+    def _run_periodic(self) -> None:
+        now = time.monotonic()
+        for name, entry in list(self._periodic.items()):
+            interval, task, due = entry
+            if now >= due:
+                entry[2] = now + interval
+                try:
+                    task()
+                except Exception:
+                    logger.exception("periodic task failed", extra={"task": name})
+
+    def _loop(self) -> None:
+        while not self._stopping.is_set():
+            self._run_periodic()
+            try:
+                found = self.run_due(self._db)
+            except Exception:
+                logger.exception("could not run background jobs")
+                found = 0
+            if found < JOB_BATCH:
+                self._wake.wait(JOB_POLL_INTERVAL)
+                self._wake.clear()
+
+    def start(self, db) -> None:
+        """Start the worker thread of this process"""
+        if self._thread is not None:
+            return
+        self._db = db
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop, name="job-queue", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Let the running job finish and stop the worker thread"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+
+job_queue = JobQueue()
@@ -1,49 +1,153 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Header, UploadFile, File, Form
+import time
+
+# Import time of this module (framework, SDKs, routes), reported once ready
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Depends, HTTPException, status, Header, UploadFile, File, Form, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
-from firebase_admin import auth, firestore, initialize_app
-from firebase_admin import credentials
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any, Union
-import firebase_admin
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from firebase_admin import auth, firestore
+from pydantic import BaseModel, ConfigDict
+from typing import List, Optional, Dict, Any, Tuple, Union
+import asyncio
 import os
+import secrets
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
 import json
+import logging
 import requests
 import shutil
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
 from pathlib import Path
 from dotenv import load_dotenv
 
+from async_io import run_blocking
+from auth_cache import get_user_profile, invalidate_user_profile, verify_id_token
+from backends import get_backends
+from barcodes import MAX_BATCH_BARCODES, barcode_index, normalize_barcode, register_barcode
+from bulk_import import IMPORT_MAX_BYTES, ProductImport, import_format
+from cache import cache_stats
+from checkout import IDEMPOTENT_REPLAY_HEADER, MAX_IDEMPOTENCY_KEY_LENGTH, place_order
+from catalog import (
+    IMAGE_VARIANT_PATTERN, MAX_BATCH_PRODUCTS, apply_image_variant, list_products, list_products_page,
+    parse_fields, parse_sort, project_product, stream_products_ndjson,
+)
+from gallery import (
+    GALLERY_MAX_IMAGES, arrange_gallery, check_gallery_size, gallery_fields, new_images, product_gallery,
+    upload_gallery,
+)
+from image_cleanup import (
+    ASSET_FOLDER, product_image_urls, register_cleanup, schedule_image_deletion, sweep_temp_files
+)
+from images import generate_derivatives, shutdown_pool, warm_pool
+from jobs import job_queue
+from logs import configure_logging
+from metrics import MetricsMiddleware, prometheus_text, route_stats, service_stats
+from orders import list_orders, stream_orders_ndjson
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from product_feed import product_feed
+from product_stream import product_stream
+from product_vendors import forget_product, remember_vendor, vendor_in_order
+from product_cache import (
+    etag_matches, get_catalog, get_product as get_cached_product, get_products as get_cached_products,
+    invalidate_product,
+)
+from sales_stats import product_sales, vendor_sales
+from sharded_stock import configure_stock_shards, delete_stock_shards
+from single_flight import get_document, single_flight_stats
+from search import search_index
+from serialization import FirestoreJSONResponse
+from transactions import TransactionContentionError, run_transaction, transaction_stats
+from uploads import (
+    FORM_OVERHEAD_BYTES, UPLOAD_DIR, UPLOAD_MAX_BYTES, UploadLimitMiddleware,
+    remove_temp_file, save_upload, spool_upload,
+)
+
 # Load environment variables
 load_dotenv()
-FIREBASE_WEB_API_KEY = os.getenv("FIREBASE_WEB_API_KEY")
-
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    secure=True
-)
 
-# Initialize Firebase Admin
-cred_path = os.getenv("FIREBASE_CREDENTIALS_PATH", "serviceAccountKey.json")
-cred = credentials.Certificate(cred_path)
-firebase_app = initialize_app(cred)
-db = firestore.client()
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Bearer token for scraping /metrics without a user session (e.g. Prometheus)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Open the Firestore channel, fill the default catalog page and start the
+# image processes before serving, instead of on the first requests
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Firestore, Firebase Auth and Cloudinary, or their in-memory stand-ins
+# (STORAGE_BACKEND). Set by the lifespan in each worker, so importing this
+# module reads no credentials and opens no connection.
+backends = db = identity = images = None
+
+# Import and startup durations of this worker, filled in by the lifespan
+startup_report = {}
+
+async def _warm(steps: dict, name: str, fn, *args) -> None:
+    """Run an optional warmup step and time it; a failure is logged, not fatal"""
+    started = time.perf_counter()
+    try:
+        await fn(*args)
+    except Exception:
+        logger.warning("warmup step failed", exc_info=True, extra={"step": name})
+    steps[name] = time.perf_counter() - started
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global backends, db, identity, images
+    started = time.perf_counter()
+    steps = {}
 
-# Create temporary upload directory if it doesn't exist
-UPLOAD_DIR = "tmp_uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+    backends = await run_blocking(get_backends)
+    db, identity, images = backends
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    steps["clients"] = time.perf_counter() - started
+
+    # Image deletions and sweeps run in the background; start with the
+    # temporary files a crashed predecessor may have left
+    register_cleanup(db, images)
+    await run_blocking(sweep_temp_files)
+    job_queue.start(db)
+
+    # Load the catalog into the barcode and search indexes before serving requests
+    feed_started = time.perf_counter()
+    await run_blocking(product_feed.start, db)
+    steps["product_indexes"] = time.perf_counter() - feed_started
+
+    if STARTUP_WARMUP:
+        # One read opens the gRPC channel and fetches the access token
+        await _warm(steps, "firestore", run_blocking, lambda: db.collection('users').limit(1).get())
+        await _warm(steps, "catalog", load_catalog)
+        await _warm(steps, "image_pool", run_blocking, warm_pool)
+
+    startup_report.update(
+        import_seconds=IMPORT_SECONDS,
+        startup_seconds=time.perf_counter() - started,
+        steps=steps,
+    )
+    logger.info("worker ready", extra=startup_report)
+    try:
+        yield
+    finally:
+        job_queue.stop()
+        product_feed.stop()
+        # Stop the image resizing processes with the server
+        shutdown_pool()
 
 # FastAPI app
-app = FastAPI(title="ShopEase API")
+app = FastAPI(title="ShopEase API", lifespan=lifespan)
+
+# Refuse oversized uploads from their headers, before Starlette reads the body.
+# Added first so its 413 still goes through the CORS and metrics middlewares.
+app.add_middleware(
+    UploadLimitMiddleware,
+    max_bytes=GALLERY_MAX_IMAGES * UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES,
+    limits={"/products/import": 2 * IMPORT_MAX_BYTES + FORM_OVERHEAD_BYTES},
+)
 
 # Add CORS middleware
 app.add_middleware(
@@ -54,6 +158,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Latency, status and backend calls per route, served by /metrics
+app.add_middleware(MetricsMiddleware)
+
 # OAuth2 password bearer for token handling
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
@@ -78,16 +185,52 @@ class LoginResponse(BaseModel):
     token: str
     user: User
     
+class GalleryImage(BaseModel):
+    id: str  # name of the Cloudinary asset
+    image_url: str
+    image_variants: Dict[str, str] = {}
+
 class Product(BaseModel):
     id: Optional[str] = None
     name: str
     description: str
     price: float
     image_url: Optional[str] = None
+    image_variants: Optional[Dict[str, str]] = None  # thumbnail, medium and webp derivatives
+    gallery: Optional[List[GalleryImage]] = None  # image_url and image_variants are those of the first one
     stock: int
     vendor_id: str
     barcode: Optional[str] = None  # Adding barcode field to Product model
     
+class ProductOut(BaseModel):
+    """A product as served; a ``fields`` projection may leave out any field but ``id``"""
+    model_config = ConfigDict(extra="allow")
+
+    id: str
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    image_url: Optional[str] = None
+    image_variants: Optional[Dict[str, str]] = None
+    gallery: Optional[List[GalleryImage]] = None
+    stock: Optional[int] = None
+    vendor_id: Optional[str] = None
+    barcode: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class BarcodeLookup(BaseModel):
+    barcodes: List[str]
+
+class ProductBatch(BaseModel):
+    ids: List[str]
+
+class BatchProduct(BaseModel):
+    id: str
+    product: Optional[ProductOut] = None  # null when no product has this id
+
+class StockShards(BaseModel):
+    shards: int  # 0 or 1 keeps the stock on the product document
+
 class Order(BaseModel):
     id: Optional[str] = None
     user_id: str
@@ -95,18 +238,29 @@ class Order(BaseModel):
     total_price: float
     status: str = "pending"  # pending, confirmed, shipped, delivered
     created_at: Optional[str] = None
+
+class OrderOut(BaseModel):
+    """An order as stored, with the vendors of its products"""
+    model_config = ConfigDict(extra="allow")
+
+    id: str
+    user_id: str
+    products: List[dict]
+    total_price: float
+    status: str
+    vendor_ids: List[str] = []
+    created_at: Optional[datetime] = None
     
 # Helper functions
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = await verify_id_token(identity, token)
         uid = decoded_token['uid']
-        user_doc = db.collection('users').document(uid).get()
+        user_data = await get_user_profile(db, uid)
         
-        if not user_doc.exists:
+        if user_data is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
         
-        user_data = user_doc.to_dict()
         return {
             "id": uid,
             "name": user_data.get("name", ""),
@@ -120,163 +274,107 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-# Function to upload an image to Cloudinary
-async def upload_image_to_cloudinary(image_file: UploadFile) -> str:
-    """Upload an image to Cloudinary and return the URL"""
-    if not image_file or not image_file.filename:
-        return None
-        
+async def upload_image_file(temp_file_path: str) -> Tuple[str, Dict[str, str]]:
+    """Upload an image file and its derivatives to Cloudinary and return their URLs"""
+    derivative_paths = {}
     try:
-        # Create a temporary file
-        temp_file_path = os.path.join(UPLOAD_DIR, f"temp_{uuid.uuid4()}{os.path.splitext(image_file.filename)[1]}")
-        
-        # Write file content to temporary file
-        with open(temp_file_path, "wb") as buffer:
-            contents = await image_file.read()
-            buffer.write(contents)
-        
-        # Reset file pointer for potential reuse
-        await image_file.seek(0)
+        # Resize in the process pool; a format Pillow cannot decode just gets no derivatives
+        try:
+            derivative_paths = await generate_derivatives(temp_file_path)
+        except Exception as e:
+            logger.warning("could not generate image derivatives", extra={"error": str(e)})
         
         # Upload to Cloudinary with a unique public_id based on timestamp and random ID
-        folder = "shopease/products"
-        public_id = f"{folder}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        public_id = f"{ASSET_FOLDER}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
         
-        upload_result = cloudinary.uploader.upload(
-            temp_file_path,
-            public_id=public_id,
-            folder=None,  # Already included in public_id
-            overwrite=True,
-            resource_type="auto"
+        # The original and its derivatives are uploaded concurrently
+        names = list(derivative_paths)
+        urls = await asyncio.gather(
+            run_blocking(images.upload, temp_file_path, public_id),
+            *(run_blocking(images.upload, derivative_paths[name], f"{public_id}_{name}")
+              for name in names),
+            return_exceptions=True
         )
+        errors = [url for url in urls if isinstance(url, BaseException)]
+        if errors:
+            # Do not leave half an image behind
+            await run_blocking(schedule_image_deletion, db, [url for url in urls if isinstance(url, str)])
+            raise errors[0]
         
-        # Delete temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        # Return the secure URLs
+        return urls[0], dict(zip(names, urls[1:]))
+    finally:
+        for path in derivative_paths.values():
+            remove_temp_file(path)
+
+# Function to upload an image and its derivatives to Cloudinary
+async def upload_image_to_cloudinary(image_file: UploadFile) -> Tuple[Optional[str], Dict[str, str]]:
+    """Upload an image to Cloudinary and return its URL and the URLs of its derivatives"""
+    if not image_file or not image_file.filename:
+        return None, {}
+        
+    temp_file_path = None
+    try:
+        # Stream the upload to a temporary file in fixed-size chunks; rejects
+        # non-image content and files above UPLOAD_MAX_BYTES early
+        temp_file_path = await save_upload(image_file)
+        
+        # Reset file pointer for potential reuse
+        await image_file.seek(0)
         
-        # Return the secure URL
-        return upload_result["secure_url"]
+        return await upload_image_file(temp_file_path)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error uploading to Cloudinary: {e}")
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        logger.exception("image upload failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error uploading image: {str(e)}"
         )
+    finally:
+        # Delete temporary file, whatever happened
+        remove_temp_file(temp_file_path)
 
-# Function to delete an image from Cloudinary
-def delete_image_from_cloudinary(image_url: str) -> bool:
-    """Delete an image from Cloudinary using its URL"""
-    if not image_url or "cloudinary.com" not in image_url:
-        return False
-        
-    try:
-        # Extract public_id from URL
-        # URL format: https://res.cloudinary.com/cloud_name/image/upload/v1234567890/shopease/products/filename.jpg
-        parts = image_url.split("upload/")
-        if len(parts) < 2:
-            print(f"Could not parse Cloudinary URL: {image_url}")
-            return False
-            
-        # Get the path after version number (v1234567890/)
-        path_with_version = parts[1]
-        # Find the version part (v1234567890/)
-        version_parts = path_with_version.split("/", 1)
-        if len(version_parts) < 2:
-            # No version number, use the whole path
-            public_id = path_with_version
-        else:
-            # Remove the version number
-            public_id = version_parts[1]
-        
-        # Remove file extension
-        public_id = os.path.splitext(public_id)[0]
-        
-        # Delete from Cloudinary
-        result = cloudinary.uploader.destroy(public_id)
-        
-        if result.get("result") == "ok":
-            return True
-        else:
-            print(f"Cloudinary deletion returned: {result}")
-            return False
-            
-    except Exception as e:
-        print(f"Error deleting from Cloudinary: {e}")
-        return False
+async def delete_product_images(product_data: dict) -> None:
+    """Schedule the deletion of a product's images and all their derivatives from Cloudinary"""
+    await run_blocking(schedule_image_deletion, db, product_image_urls(product_data))
+
+async def upload_product_images(files: List[UploadFile]) -> List[dict]:
+    """Upload gallery images concurrently; on failure none of them is kept"""
+    return await upload_gallery(
+        files, upload_image_to_cloudinary, lambda entries: delete_product_images({"gallery": entries})
+    )
 
-# Function to check stock and update product quantities
-async def check_and_update_stock(products: List[dict]) -> bool:
+# Function to reserve stock and write the order
+async def place_order_with_stock(order_dict: dict, products: List[dict],
+                                 idempotency_key: Optional[str]) -> Tuple[dict, bool]:
     """
-    Check if all products in the order have sufficient stock and update the stock levels.
-    Returns True if all products are available and stock is updated, False otherwise.
+    Check that all products in the order have sufficient stock, update the stock levels
+    and write the order, in one transaction. Returns the created order and whether it
+    replays an earlier request with the same idempotency key.
     """
-    transaction = db.transaction()
-    
-    @firestore.transactional
-    def update_in_transaction(transaction, products):
-        insufficient_stock = []
-        product_updates = {}
-        
-        # First check all products have sufficient stock
-        for item in products:
-            product_id = item.get('product_id')
-            quantity = item.get('quantity', 1)
-            
-            if not product_id or quantity <= 0:
-                raise ValueError(f"Invalid product data: {item}")
-                
-            product_ref = db.collection('products').document(product_id)
-            product_doc = product_ref.get(transaction=transaction)
-            
-            if not product_doc.exists:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Product {product_id} not found"
-                )
-                
-            product_data = product_doc.to_dict()
-            current_stock = product_data.get('stock', 0)
-            
-            if current_stock < quantity:
-                insufficient_stock.append({
-                    'product_id': product_id,
-                    'name': product_data.get('name', 'Unknown'),
-                    'requested': quantity,
-                    'available': current_stock
-                })
-            else:
-                # Store the update to apply later
-                product_updates[product_id] = {
-                    'ref': product_ref,
-                    'new_stock': current_stock - quantity
-                }
-        
-        # If any product has insufficient stock, abort the transaction
-        if insufficient_stock:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail={
-                    'message': 'Insufficient stock for some products',
-                    'products': insufficient_stock
-                }
-            )
-            
-        # Update all products' stock levels
-        for product_id, update_info in product_updates.items():
-            transaction.update(update_info['ref'], {'stock': update_info['new_stock']})
-            
-        return True
-        
     try:
-        return update_in_transaction(transaction, products)
+        created_order, replayed, reserved = await run_blocking(
+            place_order, db, order_dict, products, idempotency_key
+        )
+        # The new stock reaches the indexes and product streams without waiting for the listener
+        for product_id, product in reserved.items():
+            invalidate_product(product_id)
+            product_feed.publish(product_id, product)
+        return created_order, replayed
     except HTTPException as e:
         # Re-raise HTTP exceptions directly
         raise e
+    except TransactionContentionError as e:
+        logger.warning("stock transaction contention", extra={"error": str(e)})
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent orders for these products, please retry",
+            headers={"Retry-After": "1"}
+        )
     except Exception as e:
-        print(f"Error in stock transaction: {e}")
+        logger.exception("stock transaction failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update stock: {str(e)}"
@@ -287,7 +385,8 @@ async def check_and_update_stock(products: List[dict]) -> bool:
 async def register_user(user: UserCreate):
     try:
         # Create user in Firebase Auth
-        firebase_user = auth.create_user(
+        uid = await run_blocking(
+            identity.create_user,
             email=user.email,
             password=user.password,
             display_name=user.name
@@ -300,18 +399,11 @@ async def register_user(user: UserCreate):
             "user_type": user.user_type,
             "created_at": firestore.SERVER_TIMESTAMP
         }
-        db.collection('users').document(firebase_user.uid).set(user_data)
+        await run_blocking(db.collection('users').document(uid).set, user_data)
+        invalidate_user_profile(uid)
 
         # Sign in the user immediately using REST API to get an ID token
-        rest_api_url = "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword"
-        payload = json.dumps({
-            "email": user.email,
-            "password": user.password,
-            "returnSecureToken": True
-        })
-        params = {"key": FIREBASE_WEB_API_KEY}
-        
-        rest_response = requests.post(rest_api_url, params=params, data=payload)
+        rest_response = await run_blocking(identity.sign_in_with_password, user.email, user.password)
         rest_response.raise_for_status() # Raise exception for bad status codes
         
         auth_data = rest_response.json()
@@ -324,7 +416,7 @@ async def register_user(user: UserCreate):
         return {
             "token": id_token,
             "user": {
-                "id": firebase_user.uid,
+                "id": uid,
                 "name": user.name,
                 "email": user.email,
                 "user_type": user.user_type
@@ -343,35 +435,21 @@ async def register_user(user: UserCreate):
 
 @app.post("/auth/login", response_model=LoginResponse)
 async def login_user(user: UserLogin):
-    if not FIREBASE_WEB_API_KEY:
+    if not identity.configured:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Firebase Web API Key not configured")
         
     try:
-        # Debug logging
-        print(f"Login attempt for email: {user.email}")
-        
         # Verify user credentials with Firebase Auth REST API
-        rest_api_url = "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword"
-        payload = json.dumps({
-            "email": user.email,
-            "password": user.password,
-            "returnSecureToken": True
-        })
-        params = {"key": FIREBASE_WEB_API_KEY}
-        
-        print(f"Sending request to Firebase Auth API: {rest_api_url}")
-        rest_response = requests.post(rest_api_url, params=params, data=payload)
-        print(f"Firebase response status: {rest_response.status_code}")
+        rest_response = await run_blocking(identity.sign_in_with_password, user.email, user.password)
         
         if rest_response.status_code != 200:
-            # Debug logging
-            print(f"Firebase error response: {rest_response.text}")
-            
             # Attempt to parse Firebase error
             try:
                 error_data = rest_response.json()
                 error_message = error_data.get("error", {}).get("message", "Invalid credentials")
-                print(f"Firebase error message: {error_message}")
+                logger.info("login rejected", extra={
+                    "status_code": rest_response.status_code, "reason": error_message
+                })
                 
                 # Return appropriate HTTP status based on error type
                 if error_message == "INVALID_LOGIN_CREDENTIALS":
@@ -393,6 +471,9 @@ async def login_user(user: UserLogin):
                     
             except json.JSONDecodeError:
                 # Fallback if response is not JSON
+                logger.warning("unparseable Firebase Auth error response", extra={
+                    "status_code": rest_response.status_code
+                })
                 return JSONResponse(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     content={"detail": "Identifiants invalides"},
@@ -403,24 +484,21 @@ async def login_user(user: UserLogin):
         id_token = auth_data.get("idToken")
         uid = auth_data.get("localId")
         
-        print(f"Successfully authenticated user with ID: {uid}")
-
         if not id_token or not uid:
-            print("Missing idToken or localId in Firebase response")
+            logger.error("Firebase Auth response without idToken or localId")
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                                 detail="Failed to retrieve token or user ID from Firebase")
 
         # Get user data from Firestore
-        print(f"Fetching user data from Firestore for UID: {uid}")
-        user_doc = db.collection('users').document(uid).get()
-        if not user_doc.exists:
-            print(f"User document not found in Firestore for UID: {uid}")
+        # Goes through the profile cache so the requests that follow the login hit it
+        user_data = await get_user_profile(db, uid)
+        if user_data is None:
+            logger.warning("user document missing for authenticated account", extra={"uid": uid})
             # This case might happen if Firestore data is inconsistent with Auth
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                                detail="User data not found in database")
              
-        user_data = user_doc.to_dict()
-        print(f"Successfully retrieved user data: {user_data}")
+        logger.debug("login succeeded", extra={"uid": uid})
 
         # Return user and Firebase ID token
         return {
@@ -433,14 +511,12 @@ async def login_user(user: UserLogin):
             }
         }
     except requests.exceptions.RequestException as e:
-        print(f"Request exception during login: {e}")
+        logger.warning("Firebase Auth unreachable during login", extra={"error": str(e)})
         # Handle network or other request errors
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
                            detail=f"Firebase Auth service unavailable: {e}")
     except Exception as e:
-        print(f"Unexpected error during login: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("unexpected error during login")
         # Catch-all for other unexpected errors
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
@@ -458,29 +534,293 @@ async def logout_user(current_user: dict = Depends(get_current_user)):
 async def get_current_user_profile(current_user: dict = Depends(get_current_user)):
     return current_user
 
+@app.get("/cache/stats")
+async def get_cache_stats(current_user: dict = Depends(get_current_user)):
+    if current_user["user_type"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, 
+            detail="Only admins can view cache statistics"
+        )
+    return cache_stats()
+
+@app.get("/stats/transactions")
+async def get_transaction_stats(current_user: dict = Depends(get_current_user)):
+    if current_user["user_type"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, 
+            detail="Only admins can view transaction statistics"
+        )
+    return transaction_stats()
+
+@app.get("/metrics")
+async def get_metrics(
+    format: str = Query("json", pattern="^(json|prometheus)$"),
+    token: str = Depends(oauth2_scheme),
+):
+    """Per-route latency and backend calls, backend call durations, transactions, caches, coalesced reads, jobs and streams.
+
+    Readable by admins, or with ``Authorization: Bearer $METRICS_TOKEN`` so a
+    scraper needs no user account.
+    """
+    if not (METRICS_TOKEN and secrets.compare_digest(token, METRICS_TOKEN)):
+        current_user = await get_current_user(token)
+        if current_user["user_type"] != "admin":
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Only admins can view metrics"
+            )
+    routes, services = route_stats(), service_stats()
+    transactions, caches, jobs = transaction_stats(), cache_stats(), job_queue.stats()
+    stream, flights = product_stream.stats(), single_flight_stats()
+    if format == "prometheus":
+        return PlainTextResponse(
+            prometheus_text(routes, services, transactions, caches, startup_report, jobs, stream, flights)
+        )
+    return {
+        "routes": routes, "services": services, "transactions": transactions, "caches": caches,
+        "single_flight": flights, "jobs": jobs, "product_stream": stream, "startup": startup_report,
+    }
+
+@app.get("/health/ready")
+async def get_readiness():
+    """200 once this worker has started and loaded its product indexes, 503 before.
+
+    Meant for load balancer and rollout readiness probes, so it needs no token.
+    """
+    if not startup_report or not product_feed.ready:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "starting"},
+            headers={"Retry-After": "1"},
+        )
+    return dict(startup_report, status="ready")
+
+async def load_catalog(limit=None, start_after=None, sort_order=None, projection=None, image_variant=None):
+    """A catalog page and the cursor after it, with their ETag, through the catalog cache"""
+    cache_key = (limit, start_after, sort_order, tuple(projection) if projection else None, image_variant)
+    # Without a limit the whole catalog is returned, as existing clients expect
+    if limit is None:
+        return await get_catalog(
+            cache_key, lambda: (list_products(db, sort_order, projection, image_variant), None)
+        )
+    return await get_catalog(
+        cache_key, list_products_page, db, limit, start_after, sort_order, projection, image_variant
+    )
+
 # Product endpoints
-@app.get("/products/")
-async def get_products():
-    products = []
-    docs = db.collection('products').stream()
-    
-    for doc in docs:
-        product_data = doc.to_dict()
-        product_data["id"] = doc.id
-        products.append(product_data)
-        
-    return products
+@app.get("/products/", response_model=List[ProductOut])
+async def get_products(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    start_after: Optional[str] = None,
+    fields: Optional[str] = None,
+    sort: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    image_variant: Optional[str] = Query(None, pattern=IMAGE_VARIANT_PATTERN),
+    if_none_match: Optional[str] = Header(None)
+):
+    # fields=id,name,price limits the returned fields; sort=price / sort=-price orders them
+    projection = parse_fields(fields)
+    sort_order = parse_sort(sort)
+    # image_variant=thumbnail makes image_url point at the small derivative, for list tiles
+    
+    # Full exports are streamed page by page instead of being built in memory
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_products_ndjson(db, sort_order, projection, image_variant),
+            media_type="application/x-ndjson"
+        )
+    
+    (products, next_cursor), etag = await load_catalog(limit, start_after, sort_order, projection, image_variant)
+    
+    headers = {"ETag": etag}
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FirestoreJSONResponse(products, headers=headers)
 
-@app.get("/products/{product_id}")
-async def get_product(product_id: str):
-    doc = db.collection('products').document(product_id).get()
+@app.get("/products/search", response_model=List[ProductOut])
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    in_stock: bool = False,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    image_variant: Optional[str] = Query(None, pattern=IMAGE_VARIANT_PATTERN)
+):
+    if not search_index.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Search index is loading, retry shortly",
+            headers={"Retry-After": "1"}
+        )
     
-    if not doc.exists:
+    # Ranked in memory, in the I/O pool since scoring a short prefix over a large
+    # catalog takes tens of milliseconds; only the returned page is read, mostly
+    # from the product cache
+    total, product_ids = await run_blocking(
+        search_index.search, q, offset + limit, min_price, max_price, 1 if in_stock else None
+    )
+    page_ids = product_ids[offset:]
+    products = await get_cached_products(db, page_ids)
+    
+    return FirestoreJSONResponse(
+        [apply_image_variant(products[pid][0], image_variant) for pid in page_ids if pid in products],
+        headers={"X-Total-Count": str(total)},
+    )
+
+@app.get("/products/stream")
+async def stream_product_changes(
+    ids: Optional[str] = Query(None, description="Comma-separated ids of the products to follow"),
+    vendor_id: Optional[str] = None,
+):
+    """Server-sent events for product creations, deletions and price, stock and name changes.
+
+    Replaces polling ``GET /products/``: open the stream first, then load what
+    to show. A client that falls behind receives a ``dropped`` event and is
+    disconnected.
+    """
+    product_ids = None
+    if ids:
+        product_ids = frozenset(pid.strip() for pid in ids.split(",") if pid.strip())
+        if len(product_ids) > MAX_BATCH_PRODUCTS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {MAX_BATCH_PRODUCTS} products can be followed per stream"
+            )
+    if product_stream.full:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many open product streams, please retry",
+            headers={"Retry-After": "5"},
+        )
+    return StreamingResponse(
+        product_stream.events(product_ids, vendor_id),
+        media_type="text/event-stream",
+        # Proxies must pass events through as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/products/{product_id}", response_model=ProductOut)
+async def get_product(
+    product_id: str,
+    image_variant: Optional[str] = Query(None, pattern=IMAGE_VARIANT_PATTERN),
+    if_none_match: Optional[str] = Header(None)
+):
+    product_data, etag = await get_cached_product(db, product_id)
+    
+    if product_data is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-        
-    product_data = doc.to_dict()
-    product_data["id"] = doc.id
-    return product_data
+    
+    if image_variant:
+        product_data = apply_image_variant(product_data, image_variant)
+        etag = f'{etag[:-1]}-{image_variant}"'
+    
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return FirestoreJSONResponse(product_data, headers={"ETag": etag})
+
+@app.get("/products/by-barcode/{barcode}")
+async def get_product_by_barcode(
+    barcode: str,
+    image_variant: Optional[str] = Query(None, pattern=IMAGE_VARIANT_PATTERN)
+):
+    # Answered from memory once the index is ready; until then it queries Firestore
+    if barcode_index.ready:
+        product_id = barcode_index.lookup(db, barcode)
+    else:
+        product_id = await run_blocking(barcode_index.lookup, db, barcode)
+    product_data = (await get_cached_product(db, product_id))[0] if product_id else None
+    
+    if product_data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    return apply_image_variant(product_data, image_variant)
+
+@app.post("/products/by-barcode")
+async def get_products_by_barcode(
+    lookup: BarcodeLookup,
+    image_variant: Optional[str] = Query(None, pattern=IMAGE_VARIANT_PATTERN)
+):
+    if len(lookup.barcodes) > MAX_BATCH_BARCODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_BARCODES} barcodes per lookup"
+        )
+    
+    # One index pass, then one batched read for the products missing from the cache
+    if barcode_index.ready:
+        product_ids = barcode_index.lookup_many(db, lookup.barcodes)
+    else:
+        product_ids = await run_blocking(barcode_index.lookup_many, db, lookup.barcodes)
+    products = await get_cached_products(db, (pid for pid in product_ids.values() if pid))
+    
+    # Results follow the request order; unknown codes get a null product
+    results = []
+    for barcode in lookup.barcodes:
+        found = products.get(product_ids[barcode])
+        results.append({
+            "barcode": barcode,
+            "product": apply_image_variant(found[0], image_variant) if found else None,
+        })
+    return results
+
+@app.post("/products/batch", response_model=List[BatchProduct])
+async def get_products_batch(
+    batch: ProductBatch,
+    fields: Optional[str] = None,
+    image_variant: Optional[str] = Query(None, pattern=IMAGE_VARIANT_PATTERN)
+):
+    """Resolve many product ids at once, e.g. the lines of a cart or an order"""
+    if len(batch.ids) > MAX_BATCH_PRODUCTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_PRODUCTS} ids per batch"
+        )
+    projection = parse_fields(fields)
+    
+    # Cache hits first, then one batched read for the rest; an id that cannot
+    # name a document is simply not found
+    products = await get_cached_products(db, (pid for pid in batch.ids if pid and "/" not in pid))
+    
+    # Results follow the request order; unknown ids get a null product
+    results = []
+    for product_id in batch.ids:
+        found = products.get(product_id)
+        results.append({
+            "id": product_id,
+            "product": project_product(found[0], projection, image_variant) if found else None,
+        })
+    return FirestoreJSONResponse(results)
+
+def _create_product_in_transaction(transaction, ref, data):
+    register_barcode(transaction, db, ref.id, data.get("barcode"))
+    transaction.set(ref, data)
+
+def _update_product_in_transaction(transaction, ref, data):
+    # The previous barcode is read again so a concurrent update cannot leave it registered
+    current = ref.get(field_paths=["barcode"], transaction=transaction)
+    if not current.exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    register_barcode(transaction, db, ref.id, data.get("barcode"), current.to_dict().get("barcode"))
+    transaction.update(ref, data)
+
+def _delete_product_in_transaction(transaction, ref):
+    current = ref.get(field_paths=["barcode"], transaction=transaction)
+    if current.exists:
+        register_barcode(transaction, db, ref.id, None, current.to_dict().get("barcode"))
+    transaction.delete(ref)
+
+async def write_product(fn, *args):
+    """Run a product write together with its barcode registration"""
+    try:
+        await run_blocking(run_transaction, db, "product_write", fn, *args)
+    except TransactionContentionError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The product is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
 
 @app.post("/products/")
 async def create_product(
@@ -489,6 +829,7 @@ async def create_product(
     price: float = Form(...),
     stock: int = Form(...),
     image: UploadFile = File(None),
+    gallery_images: List[UploadFile] = File(None),  # further images, in order
     barcode: Optional[str] = Form(None),  # Adding barcode field to product creation
     current_user: dict = Depends(get_current_user)
 ):
@@ -498,9 +839,20 @@ async def create_product(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="Only vendors can create products"
         )
+    uploads = new_images(image, *(gallery_images or []))
+    check_gallery_size(len(uploads))
     
-    # Upload the image to Cloudinary if provided
-    image_url = await upload_image_to_cloudinary(image) if image else None
+    # Reserve the barcode first so a duplicate is rejected before any upload
+    doc_ref = db.collection('products').document()
+    barcode = normalize_barcode(barcode)
+    await run_blocking(barcode_index.claim, db, doc_ref.id, barcode)
+    
+    # Upload the images and their derivatives to Cloudinary, concurrently
+    try:
+        gallery = await upload_product_images(uploads)
+    except BaseException:
+        barcode_index.remove(doc_ref.id)
+        raise
     
     # Create product document
     product_dict = {
@@ -508,7 +860,7 @@ async def create_product(
         "description": description,
         "price": price,
         "stock": stock,
-        "image_url": image_url,
+        **gallery_fields(gallery),
         "vendor_id": current_user["id"],
         "barcode": barcode,  # Adding barcode to product document
         # Ne pas utiliser SERVER_TIMESTAMP ici pour éviter les erreurs de sérialisation
@@ -516,17 +868,77 @@ async def create_product(
     }
     
     # Add to Firestore
-    doc_ref = db.collection('products').document()
     # Copie du dictionnaire pour ajouter SERVER_TIMESTAMP uniquement lors de l'enregistrement
     firestore_dict = product_dict.copy()
     firestore_dict["created_at"] = firestore.SERVER_TIMESTAMP
-    doc_ref.set(firestore_dict)
+    try:
+        await write_product(_create_product_in_transaction, doc_ref, firestore_dict)
+    except BaseException:
+        barcode_index.remove(doc_ref.id)
+        await delete_product_images(product_dict)
+        raise
+    invalidate_product(doc_ref.id)
+    remember_vendor(doc_ref.id, current_user["id"])
+    product_feed.publish(doc_ref.id, product_dict)
     
     # Return created product
     created_product = product_dict.copy()
     created_product["id"] = doc_ref.id
     return created_product
 
+def _imported_product_created(product_id: str, product: dict) -> None:
+    invalidate_product(product_id)
+    remember_vendor(product_id, product["vendor_id"])
+    product_feed.publish(product_id, product)
+
+@app.post("/products/import", status_code=status.HTTP_202_ACCEPTED)
+async def import_products(
+    file: UploadFile = File(...),
+    images: UploadFile = File(None),
+    current_user: dict = Depends(get_current_user)
+):
+    # Ensure user is a vendor
+    if current_user["user_type"] != "vendor" and current_user["user_type"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, 
+            detail="Only vendors can import products"
+        )
+    
+    # Spool the row file and the optional images zip to disk; the job reads them from there
+    fmt = import_format(file.filename)
+    data_path = await spool_upload(file, f".{fmt}", IMPORT_MAX_BYTES)
+    zip_path = None
+    try:
+        if images and images.filename:
+            zip_path = await spool_upload(images, ".zip", IMPORT_MAX_BYTES)
+        job = ProductImport(
+            db, current_user["id"], Product,
+            upload_image_file, delete_product_images, _imported_product_created
+        )
+        job_id = await job.start(file.filename, data_path, fmt, zip_path)
+    except BaseException:
+        remove_temp_file(data_path)
+        remove_temp_file(zip_path)
+        raise
+    
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/products/import/{job_id}")
+async def get_import_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    doc = await get_document(db, 'import_jobs', job_id)
+    if not doc.exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import job not found")
+    
+    job_data = doc.to_dict()
+    if job_data["vendor_id"] != current_user["id"] and current_user["user_type"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, 
+            detail="You can only view your own imports"
+        )
+    
+    job_data["id"] = doc.id
+    return job_data
+
 @app.put("/products/{product_id}")
 async def update_product(
     product_id: str, 
@@ -536,11 +948,13 @@ async def update_product(
     stock: int = Form(...),
     image: UploadFile = File(None),
     delete_image: bool = Form(False),
+    gallery_images: List[UploadFile] = File(None),  # images to add at the end
+    gallery: Optional[str] = Form(None),  # ids of the images to keep, in their new order
     barcode: Optional[str] = Form(None),  # Adding barcode field to product update
     current_user: dict = Depends(get_current_user)
 ):
     # Check if product exists
-    doc = db.collection('products').document(product_id).get()
+    doc = await run_blocking(db.collection('products').document(product_id).get)
     if not doc.exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     
@@ -553,29 +967,53 @@ async def update_product(
             detail="You can only update your own products"
         )
     
-    # Handle image operations
-    image_url = None
-    current_image_url = product_data.get("image_url")
+    # Existing images are reordered or removed without being uploaded again.
+    # delete_image drops them all; a new image replaces the first one.
+    kept = [] if delete_image else arrange_gallery(product_gallery(product_data), gallery)
+    cover = new_images(image)
+    if cover:
+        kept = kept[1:]
+    added = new_images(*(gallery_images or []))
+    check_gallery_size(len(kept) + len(cover) + len(added))
     
-    # Delete existing image if requested or if a new one is being uploaded
-    if (delete_image or image) and current_image_url:
-        delete_image_from_cloudinary(current_image_url)
-        current_image_url = None
+    # Reserve the new barcode before touching the images
+    barcode = normalize_barcode(barcode)
+    await run_blocking(barcode_index.claim, db, product_id, barcode)
     
-    # Upload the new image if provided
-    if image:
-        image_url = await upload_image_to_cloudinary(image)
+    uploaded = []
+    try:
+        uploaded = await upload_product_images(cover + added)
+        new_gallery = uploaded[:len(cover)] + kept + uploaded[len(cover):]
+        
+        # Update product
+        update_data = {
+            "name": name,
+            "description": description,
+            "price": price,
+            "stock": stock,
+            **gallery_fields(new_gallery),
+            "barcode": barcode  # Adding barcode to product update
+        }
+        await write_product(_update_product_in_transaction, db.collection('products').document(product_id), update_data)
+    except BaseException:
+        # Give the old barcode back and drop the new images if the update did not happen
+        barcode_index.set(product_id, product_data.get("barcode"))
+        if uploaded:
+            await delete_product_images({"gallery": uploaded})
+        raise
+    try:
+        if product_data.get("stock_shards"):
+            # Sharded stock lives in the shards: spread the new value over them
+            await run_blocking(configure_stock_shards, db, product_id, product_data["stock_shards"], stock)
+    finally:
+        # The document is written even if the shards are not: readers must see it
+        invalidate_product(product_id)
+        product_feed.publish(product_id, dict(product_data, **update_data))
     
-    # Update product
-    update_data = {
-        "name": name,
-        "description": description,
-        "price": price,
-        "stock": stock,
-        "image_url": image_url if image else (None if delete_image else current_image_url),
-        "barcode": barcode  # Adding barcode to product update
-    }
-    db.collection('products').document(product_id).update(update_data)
+    # Removed images are deleted only once the product no longer points at them
+    removed = set(product_image_urls(product_data)) - set(product_image_urls(update_data))
+    if removed:
+        await run_blocking(schedule_image_deletion, db, removed)
     
     # Return updated product
     updated_product = update_data.copy()
@@ -589,7 +1027,7 @@ async def delete_product(
     current_user: dict = Depends(get_current_user)
 ):
     # Check if product exists
-    doc = db.collection('products').document(product_id).get()
+    doc = await run_blocking(db.collection('products').document(product_id).get)
     if not doc.exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     
@@ -602,93 +1040,97 @@ async def delete_product(
             detail="You can only delete your own products"
         )
     
-    # Delete the image from Cloudinary if it exists
-    if product_data.get("image_url"):
-        delete_image_from_cloudinary(product_data["image_url"])
+    # Delete product and release its barcode
+    await write_product(_delete_product_in_transaction, db.collection('products').document(product_id))
+    if product_data.get("stock_shards"):
+        await run_blocking(delete_stock_shards, db, product_id, product_data["stock_shards"])
     
-    # Delete product
-    db.collection('products').document(product_id).delete()
+    # Then schedule the deletion of its image and derivatives from Cloudinary
+    await delete_product_images(product_data)
+    invalidate_product(product_id)
+    forget_product(product_id)
+    product_feed.publish(product_id, None)
     
     return {"message": "Product deleted successfully"}
 
 # Order endpoints
-@app.post("/orders/")
-async def create_order(order: Order, current_user: dict = Depends(get_current_user)):
+@app.post("/orders/", response_model=OrderOut)
+async def create_order(
+    order: Order,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=MAX_IDEMPOTENCY_KEY_LENGTH),
+    current_user: dict = Depends(get_current_user)
+):
     try:
         # Extract products from the order
         products = order.products
         
-        # Check and update stock levels in a transaction
-        await check_and_update_stock(products)
-        
-        # Create order document once stock is confirmed and updated
         order_dict = order.dict(exclude={"id"})
         order_dict["user_id"] = current_user["id"]
-        order_dict["created_at"] = firestore.SERVER_TIMESTAMP
         
         # Add delivery address if not present
         if "delivery_address" not in order_dict and hasattr(order, "delivery_address"):
             order_dict["delivery_address"] = order.delivery_address
         
-        # Add to Firestore
-        doc_ref = db.collection('orders').document()
-        doc_ref.set(order_dict)
-        
-        # Return created order
-        created_order = order_dict.copy()
-        created_order["id"] = doc_ref.id
-        
-        # Format timestamps for serialization
-        if "created_at" in created_order:
-            created_order["created_at"] = datetime.now().isoformat()
-            
-        return created_order
+        # Reserve the stock and create the order document together, so a retried
+        # request can neither reserve twice nor leave stock reserved without an order.
+        # With an Idempotency-Key, a retry gets the first response back.
+        created_order, replayed = await place_order_with_stock(order_dict, products, idempotency_key)
+        headers = {IDEMPOTENT_REPLAY_HEADER: "true"} if replayed else None
+        return FirestoreJSONResponse(created_order, headers=headers)
         
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
     except Exception as e:
-        print(f"Error creating order: {e}")
+        logger.exception("order creation failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create order: {str(e)}"
         )
 
-@app.get("/orders/")
-async def get_user_orders(current_user: dict = Depends(get_current_user)):
-    orders = []
-    
+@app.get("/orders/", response_model=List[OrderOut])
+async def get_user_orders(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    start_after: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    user_id: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    # Newest first, filtered on status and a created_at range [created_from, created_to).
+    # Pages are chained through the X-Next-Cursor response header; without limit
+    # or start_after every order is returned, as existing clients expect.
+    filters = {"status": status_filter, "created_from": created_from, "created_to": created_to}
     if current_user["user_type"] == "admin":
-        # Admins can see all orders
-        docs = db.collection('orders').stream()
+        # Admins can see all orders, or one customer's
+        filters["user_id"] = user_id
+    elif user_id and user_id != current_user["id"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admins can list the orders of other users"
+        )
     elif current_user["user_type"] == "vendor":
         # Vendors can see orders with their products
-        # This is a simplification - in a real app, you'd need a more efficient query
-        docs = db.collection('orders').stream()
-        vendor_orders = []
-        for doc in docs:
-            order_data = doc.to_dict()
-            for product in order_data.get("products", []):
-                product_doc = db.collection('products').document(product["product_id"]).get()
-                if product_doc.exists and product_doc.to_dict().get("vendor_id") == current_user["id"]:
-                    order_data["id"] = doc.id
-                    vendor_orders.append(order_data)
-                    break
-        return vendor_orders
+        filters["vendor_id"] = current_user["id"]
     else:
         # Customers can only see their own orders
-        docs = db.collection('orders').where("user_id", "==", current_user["id"]).stream()
-    
-    for doc in docs:
-        order_data = doc.to_dict()
-        order_data["id"] = doc.id
-        orders.append(order_data)
-        
-    return orders
+        filters["user_id"] = current_user["id"]
+
+    # Full exports are streamed page by page instead of being built in memory
+    if format == "ndjson":
+        return StreamingResponse(stream_orders_ndjson(db, **filters), media_type="application/x-ndjson")
 
-@app.get("/orders/{order_id}")
+    if limit is None and start_after:
+        limit = DEFAULT_PAGE_SIZE
+    orders, next_cursor = await run_blocking(list_orders, db, limit, start_after, **filters)
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return FirestoreJSONResponse(orders, headers=headers)
+
+@app.get("/orders/{order_id}", response_model=OrderOut)
 async def get_order(order_id: str, current_user: dict = Depends(get_current_user)):
-    doc = db.collection('orders').document(order_id).get()
+    doc = await get_document(db, 'orders', order_id)
     
     if not doc.exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
@@ -700,12 +1142,8 @@ async def get_order(order_id: str, current_user: dict = Depends(get_current_user
         order_data["user_id"] != current_user["id"]):
         # For vendors, check if they have products in this order
         if current_user["user_type"] == "vendor":
-            vendor_has_product = False
-            for product in order_data.get("products", []):
-                product_doc = db.collection('products').document(product["product_id"]).get()
-                if product_doc.exists and product_doc.to_dict().get("vendor_id") == current_user["id"]:
-                    vendor_has_product = True
-                    break
+            # Answered from the order's vendor_ids, or one batched read for older orders
+            vendor_has_product = await run_blocking(vendor_in_order, db, current_user["id"], order_data)
             
             if not vendor_has_product:
                 raise HTTPException(
@@ -719,7 +1157,57 @@ async def get_order(order_id: str, current_user: dict = Depends(get_current_user
             )
     
     order_data["id"] = doc.id
-    return order_data
+    return FirestoreJSONResponse(order_data)
+
+# Vendor endpoints
+@app.get("/vendors/me/stats")
+async def get_vendor_stats(current_user: dict = Depends(get_current_user)):
+    """Revenue, units sold and order count of the current vendor, from the sales aggregates"""
+    if current_user["user_type"] != "vendor":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only vendors have sales statistics"
+        )
+    return await run_blocking(vendor_sales, db, current_user["id"])
+
+@app.get("/products/{product_id}/stats")
+async def get_product_stats(product_id: str, current_user: dict = Depends(get_current_user)):
+    """Revenue, units sold and order count of one product (owner or admin)"""
+    product_data, _ = await get_cached_product(db, product_id)
+    if product_data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    if (product_data.get("vendor_id") != current_user["id"] and
+        current_user["user_type"] != "admin"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You can only view the statistics of your own products"
+        )
+    return await run_blocking(product_sales, db, product_id)
+
+@app.put("/products/{product_id}/stock-shards")
+async def set_stock_shards(product_id: str, body: StockShards, current_user: dict = Depends(get_current_user)):
+    """Split a hot product's stock over several documents so concurrent checkouts stop colliding"""
+    product_data, _ = await get_cached_product(db, product_id)
+    if product_data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    if (product_data.get("vendor_id") != current_user["id"] and
+        current_user["user_type"] != "admin"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You can only configure your own products"
+        )
+    try:
+        stock = await run_blocking(configure_stock_shards, db, product_id, body.shards)
+    except TransactionContentionError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The product is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    invalidate_product(product_id)
+    return {"id": product_id, "stock_shards": body.shards if body.shards >= 2 else 0, "stock": stock}
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,451 @@
+"""In-memory stand-in for the subset of the Firestore client used by the API.
+
+Mirrors the call shapes of ``firestore.client()`` closely enough for the helper
+modules and benchmarks to run without a Firebase project, and counts every
+round trip and document read so query costs can be compared.
+"""
+import copy
+import functools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from google.api_core import exceptions
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+MAX_BATCH_SIZE = 500
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+    "array_contains_any": lambda a, b: isinstance(a, list) and any(v in a for v in b),
+}
+
+_MISSING = object()
+
+
+def _get_field(data, field_path):
+    """Resolve a dotted field path inside a document dict"""
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set_field(data, field_path, value):
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    if value is _MISSING:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = value
+
+
+def _resolve_value(value, current):
+    """Apply Firestore sentinels and transforms against the stored value"""
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if value is firestore.DELETE_FIELD:
+        return _MISSING
+    if isinstance(value, firestore.Increment):
+        base = current if isinstance(current, (int, float)) else 0
+        return base + value.value
+    if isinstance(value, firestore.ArrayUnion):
+        base = list(current) if isinstance(current, list) else []
+        return base + [v for v in value.values if v not in base]
+    if isinstance(value, firestore.ArrayRemove):
+        base = list(current) if isinstance(current, list) else []
+        return [v for v in base if v not in value.values]
+    if isinstance(value, dict):
+        base = current if isinstance(current, dict) else {}
+        resolved = {}
+        for key, item in value.items():
+            item = _resolve_value(item, base.get(key, _MISSING))
+            if item is not _MISSING:
+                resolved[key] = item
+        return resolved
+    return copy.deepcopy(value)
+
+
+def _direction_sign(direction):
+    return -1 if str(direction).upper() == firestore.Query.DESCENDING else 1
+
+
+class MemorySnapshot:
+    """Read-only view of a document, shaped like ``DocumentSnapshot``"""
+
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = _get_field(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class MemoryDocumentReference:
+    def __init__(self, client, collection_path, doc_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._collection_path}/{self.id}"
+
+    def collection(self, name):
+        return MemoryCollection(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        self._client._count(calls=1, reads=1)
+        return self._client._snapshot(self, field_paths, transaction)
+
+    def set(self, document_data, merge=False):
+        self._client._count(calls=1)
+        self._client._apply_set(self, document_data, merge)
+
+    def update(self, field_updates):
+        self._client._count(calls=1)
+        self._client._apply_update(self, field_updates)
+
+    def delete(self):
+        self._client._count(calls=1)
+        self._client._apply_delete(self)
+
+
+class MemoryQuery:
+    def __init__(self, client, collection_path, filters=(), orders=(),
+                 limit=None, cursor=None, projection=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes):
+        state = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "cursor": self._cursor,
+            "projection": self._projection,
+        }
+        state.update(changes)
+        return MemoryQuery(self._client, self._collection_path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in _OPERATORS:
+            raise ValueError(f"Unsupported operator: {op_string}")
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=firestore.Query.ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, _direction_sign(direction)),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def _compare(self, left, right):
+        for field_path, sign in self._orders:
+            a, b = _get_field(left[1], field_path), _get_field(right[1], field_path)
+            if a != b:
+                return sign * (-1 if a < b else 1)
+        return (left[0] > right[0]) - (left[0] < right[0])
+
+    def _matches(self, data):
+        for field_path, op_string, value in self._filters:
+            current = _get_field(data, field_path)
+            if current is _MISSING or not _OPERATORS[op_string](current, value):
+                return False
+        # Firestore drops documents that lack an ordered field
+        return all(_get_field(data, f) is not _MISSING for f, _ in self._orders)
+
+    def stream(self, transaction=None):
+        self._client._count(calls=1)
+        with self._client._lock:
+            collection = self._client._collections.get(self._collection_path, {})
+            rows = [(doc_id, data) for doc_id, data in collection.items() if self._matches(data)]
+        rows.sort(key=functools.cmp_to_key(self._compare))
+
+        if self._cursor is not None:
+            if isinstance(self._cursor, MemorySnapshot):
+                anchor = (self._cursor.id, self._cursor._data or {})
+            else:
+                anchor = ("", self._cursor)
+            rows = [row for row in rows if self._compare(row, anchor) > 0]
+
+        if self._limit is not None:
+            rows = rows[:self._limit]
+
+        self._client._count(reads=len(rows))
+        for doc_id, data in rows:
+            ref = MemoryDocumentReference(self._client, self._collection_path, doc_id)
+            if transaction is not None:
+                transaction._record_read(ref)
+            yield MemorySnapshot(ref, _project(data, self._projection))
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class MemoryCollection(MemoryQuery):
+    def __init__(self, client, collection_path):
+        super().__init__(client, collection_path)
+        self.id = collection_path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        return MemoryDocumentReference(self._client, self._collection_path,
+                                       document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data):
+        ref = self.document()
+        ref.set(document_data)
+        return None, ref
+
+    def on_snapshot(self, callback):
+        """Call ``callback(docs, changes, read_time)`` now and after every write.
+
+        Unlike the real client, callbacks run synchronously in the writing thread.
+        """
+        return self._client._watch(self._collection_path, callback)
+
+
+class MemoryWatch:
+    def __init__(self, client, collection_path, callback):
+        self._client = client
+        self._collection_path = collection_path
+        self._callback = callback
+
+    def unsubscribe(self):
+        with self._client._lock:
+            watchers = self._client._watchers.get(self._collection_path, [])
+            if self in watchers:
+                watchers.remove(self)
+
+
+class MemoryWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference, document_data, merge=False):
+        self._ops.append(lambda: self._client._apply_set(reference, document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._ops.append(lambda: self._client._apply_update(reference, field_updates))
+
+    def delete(self, reference):
+        self._ops.append(lambda: self._client._apply_delete(reference))
+
+    def commit(self):
+        if len(self._ops) > MAX_BATCH_SIZE:
+            raise ValueError(f"A batch can contain at most {MAX_BATCH_SIZE} writes")
+        self._client._count(calls=1)
+        with self._client._lock:
+            for op in self._ops:
+                op()
+        self._ops = []
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """Optimistic transaction compatible with ``@firestore.transactional``.
+
+    Reads remember the version of each document; the commit aborts with
+    ``Aborted`` (which the decorator retries) if any of them changed since.
+    """
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _record_read(self, ref):
+        with self._client._lock:
+            self._reads.setdefault(ref.path, self._client._versions.get(ref.path, 0))
+
+    def _clean_up(self):
+        self._ops = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client._count(calls=1)
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        self._client._count(calls=1)
+        with self._client._lock:
+            for path, version in self._reads.items():
+                if self._client._versions.get(path, 0) != version:
+                    self._clean_up()
+                    raise exceptions.Aborted(f"Contention on {path}")
+            for op in self._ops:
+                op()
+        self._clean_up()
+        return []
+
+
+def _project(data, field_paths):
+    if data is None or field_paths is None:
+        return copy.deepcopy(data)
+    projected = {}
+    for field_path in field_paths:
+        value = _get_field(data, field_path)
+        if value is not _MISSING:
+            _set_field(projected, field_path, copy.deepcopy(value))
+    return projected
+
+
+class MemoryFirestore:
+    """Drop-in replacement for ``firestore.client()`` backed by dicts.
+
+    ``latency`` (seconds) is slept on every round trip to simulate the network;
+    like the real client, the sleep blocks the calling thread.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._collections = {}
+        self._versions = {}
+        self._watchers = {}
+        self._lock = threading.RLock()
+        self.stats = {"calls": 0, "reads": 0, "writes": 0}
+
+    def _count(self, calls=0, reads=0, writes=0):
+        with self._lock:
+            self.stats["calls"] += calls
+            self.stats["reads"] += reads
+            self.stats["writes"] += writes
+        if calls and self.latency:
+            time.sleep(self.latency * calls)
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"calls": 0, "reads": 0, "writes": 0}
+
+    def collection(self, collection_path):
+        return MemoryCollection(self, collection_path)
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return MemoryTransaction(self, max_attempts, read_only)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._count(calls=1, reads=len(references))
+        for ref in references:
+            yield self._snapshot(ref, field_paths, transaction)
+
+    def _snapshot(self, ref, field_paths=None, transaction=None):
+        with self._lock:
+            if transaction is not None:
+                transaction._record_read(ref)
+            data = self._collections.get(ref._collection_path, {}).get(ref.id)
+            return MemorySnapshot(ref, _project(data, field_paths))
+
+    def _bump(self, ref):
+        self._versions[ref.path] = self._versions.get(ref.path, 0) + 1
+        self.stats["writes"] += 1
+
+    def _watch(self, collection_path, callback):
+        with self._lock:
+            watch = MemoryWatch(self, collection_path, callback)
+            self._watchers.setdefault(collection_path, []).append(watch)
+            docs = [
+                MemorySnapshot(MemoryDocumentReference(self, collection_path, doc_id), copy.deepcopy(data))
+                for doc_id, data in self._collections.get(collection_path, {}).items()
+            ]
+        changes = [DocumentChange(ChangeType.ADDED, doc, -1, i) for i, doc in enumerate(docs)]
+        callback(docs, changes, datetime.now(timezone.utc))
+        return watch
+
+    def _notify(self, ref, existed):
+        with self._lock:
+            watchers = list(self._watchers.get(ref._collection_path, []))
+            if not watchers:
+                return
+            data = self._collections.get(ref._collection_path, {}).get(ref.id)
+            snapshot = MemorySnapshot(ref, copy.deepcopy(data))
+        if data is None:
+            change_type = ChangeType.REMOVED
+        else:
+            change_type = ChangeType.MODIFIED if existed else ChangeType.ADDED
+        change = DocumentChange(change_type, snapshot, -1, -1)
+        for watch in watchers:
+            watch._callback([snapshot], [change], datetime.now(timezone.utc))
+
+    def _apply_set(self, ref, document_data, merge):
+        with self._lock:
+            collection = self._collections.setdefault(ref._collection_path, {})
+            current = collection.get(ref.id) if merge else None
+            resolved = _resolve_value(document_data, current or {})
+            if merge and current:
+                merged = copy.deepcopy(current)
+                merged.update(resolved)
+                resolved = merged
+            existed = ref.id in collection
+            collection[ref.id] = resolved
+            self._bump(ref)
+        self._notify(ref, existed)
+
+    def _apply_update(self, ref, field_updates):
+        with self._lock:
+            collection = self._collections.get(ref._collection_path, {})
+            if ref.id not in collection:
+                raise KeyError(f"No document to update: {ref.path}")
+            current = copy.deepcopy(collection[ref.id])
+            for field_path, value in field_updates.items():
+                _set_field(current, field_path,
+                           _resolve_value(value, _get_field(current, field_path)))
+            collection[ref.id] = current
+            self._bump(ref)
+        self._notify(ref, True)
+
+    def _apply_delete(self, ref):
+        with self._lock:
+            existed = self._collections.get(ref._collection_path, {}).pop(ref.id, None) is not None
+            self._bump(ref)
+        if existed:
+            self._notify(ref, True)
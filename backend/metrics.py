@@ -0,0 +1,361 @@
+"""Request and backend call metrics, served by ``GET /metrics``.
+
+``MetricsMiddleware`` records a latency histogram and status counts per route
+template (``/products/{product_id}``, not the concrete URL). Calls to
+Firestore, Cloudinary and Firebase Auth are timed per service by ``traced``
+(a proxy around the Firestore client) and ``instrumented`` (a decorator for
+the other backends), and are also charged to the request that made them so
+each route reports its backend calls per request. The request is found through
+a context variable, which ``run_blocking`` carries into the I/O threads.
+
+Histograms use fixed buckets, so recording is O(1) and memory does not grow
+with traffic; percentiles are interpolated from the buckets.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+# Upper bounds in seconds, as in Prometheus' default buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+class _RequestCalls:
+    """Backend calls made while serving one request"""
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.lock = threading.Lock()
+
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+_lock = threading.Lock()
+_routes = {}
+_services = {}
+
+
+def _route_entry(key):
+    entry = _routes.get(key)
+    if entry is None:
+        entry = _routes[key] = {
+            "latency": Histogram(),
+            "status": defaultdict(int),
+            "backend_calls": defaultdict(int),
+            "backend_seconds": defaultdict(float),
+        }
+    return entry
+
+
+def record_call(service: str, seconds: float, failed: bool = False) -> None:
+    """Account one backend call to its service and to the current request"""
+    with _lock:
+        entry = _services.get(service)
+        if entry is None:
+            entry = _services[service] = {"latency": Histogram(), "errors": 0}
+        entry["latency"].observe(seconds)
+        if failed:
+            entry["errors"] += 1
+    request = _current_request.get()
+    if request is not None:
+        with request.lock:
+            request.calls[service] += 1
+            request.seconds[service] += seconds
+
+
+def instrumented(service: str):
+    """Decorator timing every call of a blocking backend method"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record_call(service, time.perf_counter() - started, failed)
+        return wrapper
+
+    return decorator
+
+
+# Methods of the Firestore objects that make a round trip
+_ROUND_TRIPS = {
+    "get", "stream", "set", "create", "update", "delete", "add", "commit", "get_all",
+    "list_documents", "_begin", "_commit", "_rollback",
+}
+# Writes that batches and transactions only buffer until their commit
+_BUFFERED_WRITES = {"set", "create", "update", "delete"}
+_BUFFERING_TYPES = {"WriteBatch", "Transaction", "MemoryWriteBatch", "MemoryTransaction"}
+# Objects handed out by the client whose calls are traced in turn
+_TRACED_TYPES = {
+    "Client", "CollectionReference", "DocumentReference", "Query", "CollectionGroup",
+    "WriteBatch", "Transaction",
+    "MemoryFirestore", "MemoryCollection", "MemoryDocumentReference", "MemoryQuery",
+    "MemoryWriteBatch", "MemoryTransaction",
+}
+
+
+class _Traced:
+    """Proxy timing the round trips of a Firestore client and the objects it returns"""
+
+    __slots__ = ("_target", "_service")
+
+    def __init__(self, target, service):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_service", service)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value) or inspect.isclass(value):
+            return value
+        timed = name in _ROUND_TRIPS and not (
+            name in _BUFFERED_WRITES and type(self._target).__name__ in _BUFFERING_TYPES
+        )
+        service = self._service
+
+        def call(*args, **kwargs):
+            if not timed:
+                return _wrap(value(*args, **kwargs), service)
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = value(*args, **kwargs)
+                failed = False
+            finally:
+                if failed:
+                    record_call(service, time.perf_counter() - started, True)
+            if inspect.isgenerator(result):
+                # Streams are lazy: the round trips happen while iterating
+                return _timed_iteration(result, service, started)
+            record_call(service, time.perf_counter() - started)
+            return _wrap(result, service)
+
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __repr__(self):
+        return f"traced({self._target!r})"
+
+
+def _wrap(value, service):
+    return _Traced(value, service) if type(value).__name__ in _TRACED_TYPES else value
+
+
+def _timed_iteration(iterator, service, started):
+    failed = True
+    try:
+        yield from iterator
+        failed = False
+    finally:
+        record_call(service, time.perf_counter() - started, failed)
+
+
+def traced(client, service: str = "firestore"):
+    """Wrap a Firestore (or in-memory) client so its round trips are recorded"""
+    return _Traced(client, service)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and backend calls per route"""
+
+    def __init__(self, app):
+        self.app = app
+        self._templates = {}
+
+    def _template(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        template = self._templates.get(endpoint)
+        if template is None:
+            # The router stores the matched endpoint in the scope, not the route
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    template = route.path
+                    break
+            template = self._templates[endpoint] = template or scope["path"]
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = _RequestCalls()
+        token = _current_request.set(request)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_request.reset(token)
+            key = (scope["method"], self._template(scope))
+            with _lock:
+                entry = _route_entry(key)
+                entry["latency"].observe(elapsed)
+                entry["status"][f"{status_code // 100}xx"] += 1
+                for service, calls in request.calls.items():
+                    entry["backend_calls"][service] += calls
+                    entry["backend_seconds"][service] += request.seconds[service]
+
+
+def route_stats() -> Dict[str, dict]:
+    with _lock:
+        stats = {}
+        for (method, path), entry in sorted(_routes.items(), key=lambda item: item[0][::-1]):
+            latency = entry["latency"].snapshot()
+            requests = latency["count"] or 1
+            stats[f"{method} {path}"] = {
+                "latency": latency,
+                "status": dict(entry["status"]),
+                "backend_calls_per_request": {
+                    service: {
+                        "calls": calls / requests,
+                        "seconds": entry["backend_seconds"][service] / requests,
+                    }
+                    for service, calls in entry["backend_calls"].items()
+                },
+            }
+        return stats
+
+
+def service_stats() -> Dict[str, dict]:
+    with _lock:
+        return {
+            service: dict(entry["latency"].snapshot(), errors=entry["errors"])
+            for service, entry in sorted(_services.items())
+        }
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def _histogram_lines(name, histogram, labels):
+    cumulative = 0
+    for bound, count in histogram["buckets"].items():
+        cumulative += count
+        yield f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}"
+    yield f"{name}_sum{_labels(**labels)} {histogram['sum']}"
+    yield f"{name}_count{_labels(**labels)} {histogram['count']}"
+
+
+def _family(name, kind, samples):
+    """The lines of one metric family: its type, then ``(labels, value)`` samples"""
+    yield f"# TYPE {name} {kind}"
+    for labels, value in samples:
+        yield f"{name}{_labels(**labels) if labels else ''} {value}"
+
+
+def prometheus_text(routes, services, transactions, caches, startup=None, jobs=None, stream=None,
+                    flights=None) -> str:
+    """Render the ``/metrics`` payload in the Prometheus text exposition format"""
+    lines = []
+    if startup:
+        lines.append("# TYPE shopease_import_seconds gauge")
+        lines.append(f"shopease_import_seconds {startup['import_seconds']}")
+        lines.append("# TYPE shopease_startup_seconds gauge")
+        lines.append(f"shopease_startup_seconds {startup['startup_seconds']}")
+        lines.extend(_family("shopease_startup_step_seconds", "gauge", (
+            ({"step": step}, seconds) for step, seconds in startup["steps"].items()
+        )))
+    lines.append("# TYPE shopease_request_duration_seconds histogram")
+    for route, stats in routes.items():
+        method, path = route.split(" ", 1)
+        lines.extend(_histogram_lines(
+            "shopease_request_duration_seconds", stats["latency"], {"method": method, "route": path}
+        ))
+    lines.append("# TYPE shopease_responses_total counter")
+    for route, stats in routes.items():
+        method, path = route.split(" ", 1)
+        for status_class, count in stats["status"].items():
+            lines.append(f"shopease_responses_total"
+                         f"{_labels(method=method, route=path, status=status_class)} {count}")
+    lines.append("# TYPE shopease_backend_call_duration_seconds histogram")
+    for service, stats in services.items():
+        lines.extend(_histogram_lines(
+            "shopease_backend_call_duration_seconds", stats, {"service": service}
+        ))
+    lines.append("# TYPE shopease_backend_call_errors_total counter")
+    for service, stats in services.items():
+        lines.append(f"shopease_backend_call_errors_total{_labels(service=service)} {stats['errors']}")
+    for key in ("attempts", "retries", "committed", "failed", "exhausted"):
+        lines.extend(_family(f"shopease_transaction_{key}_total", "counter", (
+            ({"transaction": name}, stats[key]) for name, stats in transactions.items()
+        )))
+    for key in ("hits", "misses", "evictions", "expirations"):
+        lines.extend(_family(f"shopease_cache_{key}_total", "counter", (
+            ({"cache": name}, stats[key]) for name, stats in caches.items()
+        )))
+    lines.extend(_family("shopease_cache_size", "gauge", (
+        ({"cache": name}, stats["size"]) for name, stats in caches.items()
+    )))
+    for key in ("calls", "coalesced", "errors"):
+        lines.extend(_family(f"shopease_single_flight_{key}_total", "counter", (
+            ({"flight": name}, stats[key]) for name, stats in (flights or {}).items()
+        )))
+    for key in ("enqueued", "succeeded", "retried", "failed"):
+        lines.extend(_family(f"shopease_jobs_{key}_total", "counter", (
+            ({"kind": kind}, stats[key]) for kind, stats in (jobs or {}).items()
+        )))
+    if stream:
+        lines.append("# TYPE shopease_product_stream_clients gauge")
+        lines.append(f"shopease_product_stream_clients {stream['clients']}")
+        for key in ("events", "delivered", "dropped"):
+            lines.extend(_family(f"shopease_product_stream_{key}_total", "counter", [({}, stream[key])]))
+    return "\n".join(lines) + "\n"
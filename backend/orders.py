@@ -0,0 +1,79 @@
+"""Order listings: filters, cursor pagination and NDJSON export.
+
+Every listing is one Firestore query ordered by ``created_at``, newest first,
+narrowed by equality filters on ``status``, ``user_id`` or ``vendor_ids`` and
+by a ``created_at`` range. Admins may filter on anything; customers are
+pinned to their own ``user_id`` and vendors to their ``vendor_ids``. Each
+combination of equality filters is backed by a composite index declared in
+``firestore.indexes.json``.
+
+A page, or without a limit the whole result, is fetched with
+``list_orders``. ``stream_orders_ndjson`` walks the
+whole result one Firestore page at a time, so an export of any size holds a
+single page in memory.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+from firebase_admin import firestore
+
+from async_io import run_blocking
+from pagination import fetch_page, iter_pages
+from serialization import dumps_line
+
+EXPORT_PAGE_SIZE = 500
+
+
+def _utc(moment: Optional[datetime]) -> Optional[datetime]:
+    # Firestore timestamps are UTC; a date without an offset is read as UTC
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def orders_query(db, vendor_id=None, user_id=None, status=None, created_from=None, created_to=None):
+    """Orders matching every given filter, newest first.
+
+    ``created_from`` is inclusive and ``created_to`` exclusive.
+    """
+    query = db.collection('orders')
+    if vendor_id:
+        query = query.where('vendor_ids', 'array_contains', vendor_id)
+    if user_id:
+        query = query.where('user_id', '==', user_id)
+    if status:
+        query = query.where('status', '==', status)
+    if created_from is not None:
+        query = query.where('created_at', '>=', _utc(created_from))
+    if created_to is not None:
+        query = query.where('created_at', '<', _utc(created_to))
+    return query.order_by('created_at', direction=firestore.Query.DESCENDING)
+
+
+def order_from_doc(doc) -> dict:
+    order_data = doc.to_dict()
+    order_data["id"] = doc.id
+    return order_data
+
+
+def list_orders(db, limit, start_after=None, **filters):
+    """Return one page of orders as ``(orders, next_cursor)`` (blocking).
+
+    A ``limit`` of None returns every matching order and no cursor.
+    """
+    query = orders_query(db, **filters)
+    if limit is None:
+        return [order_from_doc(doc) for doc in query.stream()], None
+    docs, next_cursor = fetch_page(query, db.collection('orders'), limit, start_after)
+    return [order_from_doc(doc) for doc in docs], next_cursor
+
+
+async def stream_orders_ndjson(db, page_size=EXPORT_PAGE_SIZE, **filters):
+    """Yield every matching order as an NDJSON line, fetching one Firestore page at a time"""
+    pages = iter_pages(orders_query(db, **filters), page_size)
+    while True:
+        docs = await run_blocking(next, pages, None)
+        if docs is None:
+            return
+        for doc in docs:
+            yield dumps_line(order_from_doc(doc))
@@ -0,0 +1,48 @@
+"""Cursor pagination helpers shared by the list endpoints.
+
+Pages are addressed by the id of the last document of the previous page; the
+id of the next cursor is sent back in the ``X-Next-Cursor`` response header so
+list responses keep their plain JSON array shape.
+"""
+from fastapi import HTTPException, status
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def fetch_page(query, collection_ref, limit, start_after=None):
+    """Run ``query`` for one page and return ``(snapshots, next_cursor)``.
+
+    ``query`` must already carry its ``order_by`` clauses. One extra document
+    is requested so the absence of a next page costs no additional round trip.
+    """
+    if start_after:
+        cursor_doc = collection_ref.document(start_after).get()
+        if not cursor_doc.exists:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid pagination cursor"
+            )
+        query = query.start_after(cursor_doc)
+
+    docs = list(query.limit(limit + 1).stream())
+    next_cursor = docs[limit - 1].id if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def iter_pages(query, page_size):
+    """Lazily yield successive pages of snapshots for ``query``.
+
+    Each page resumes after the last snapshot of the previous one, so only one
+    page is held in memory at a time and no cursor document is re-read.
+    """
+    last_doc = None
+    while True:
+        page_query = query.start_after(last_doc) if last_doc is not None else query
+        docs = list(page_query.limit(page_size).stream())
+        if docs:
+            yield docs
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
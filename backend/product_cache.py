@@ -0,0 +1,137 @@
+"""Read-through cache for product documents and catalog pages, with ETags.
+
+Entries hold the response body together with its ETag so cache hits and
+``If-None-Match`` checks never re-serialise anything. Every product write must
+call ``invalidate_product``: it drops the product and all cached catalog pages
+(a page cannot tell which products it contains without being re-read). The
+cache is per worker, so other workers serve at most ``PRODUCT_CACHE_TTL``
+seconds of stale data. Concurrent misses for the same product share one read.
+"""
+import hashlib
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from async_io import run_blocking
+from cache import TTLCache
+from catalog import product_from_doc, sharded_stock_of
+from serialization import dumps
+from single_flight import SingleFlight
+
+load_dotenv()
+
+product_cache = TTLCache(
+    maxsize=int(os.getenv("PRODUCT_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "30")),
+    name="products",
+)
+# Bounded by the products the cached pages hold in total too: an unpaginated
+# listing holds the whole catalog, so 256 of them would hold it 256 times
+catalog_cache = TTLCache(
+    maxsize=int(os.getenv("CATALOG_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "30")),
+    name="catalog_pages",
+    maxweight=int(os.getenv("CATALOG_CACHE_MAX_PRODUCTS", "50000")),
+    weigh=lambda cached: len(cached[0][0]),
+)
+product_reads = SingleFlight(name="products")
+
+# Bumped by every invalidation. A read that started before a write must not
+# store what it fetched, or it would resurrect the pre-write state.
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def etag_for(body) -> str:
+    return f'W/"{hashlib.sha1(dumps(body, sort_keys=True)).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an ``If-None-Match`` header value matches ``etag``"""
+    if not if_none_match:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    # Weak comparison: W/"x" and "x" name the same representation
+    normalized = {tag[2:] if tag.startswith("W/") else tag for tag in candidates}
+    return "*" in candidates or etag[2:] in normalized
+
+
+def invalidate_product(product_id: str) -> None:
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        product_cache.pop(product_id)
+        catalog_cache.clear()
+    product_reads.forget(product_id)
+
+
+def _store(cache, key, value, generation):
+    with _generation_lock:
+        if generation == _generation:
+            cache.set(key, value)
+
+
+async def _load_product(db, product_id: str) -> Tuple[Optional[dict], Optional[str]]:
+    generation = _generation
+    doc = await run_blocking(db.collection('products').document(product_id).get)
+    if not doc.exists:
+        return None, None
+    stock = await run_blocking(sharded_stock_of, db, [doc])
+    product = product_from_doc(doc, stock=stock.get(doc.id))
+    cached = (product, etag_for(product))
+    _store(product_cache, product_id, cached, generation)
+    return cached
+
+
+async def get_product(db, product_id: str) -> Tuple[Optional[dict], Optional[str]]:
+    """Return ``(product, etag)``, or ``(None, None)`` if it does not exist"""
+    cached = product_cache.get(product_id)
+    if cached is None:
+        cached = await product_reads.do(product_id, _load_product, db, product_id)
+    return cached
+
+
+def _load_products(db, product_ids, generation):
+    loaded = {}
+    refs = [db.collection('products').document(pid) for pid in product_ids]
+    docs = [doc for doc in db.get_all(refs) if doc.exists]
+    stock = sharded_stock_of(db, docs)
+    for doc in docs:
+        product = product_from_doc(doc, stock=stock.get(doc.id))
+        loaded[doc.id] = (product, etag_for(product))
+        _store(product_cache, doc.id, loaded[doc.id], generation)
+    return loaded
+
+
+async def get_products(db, product_ids: Iterable[str]) -> Dict[str, Tuple[dict, str]]:
+    """Return ``{id: (product, etag)}`` for the ids that exist.
+
+    Cache misses are fetched together with one batched read.
+    """
+    found = {}
+    missing = []
+    for product_id in dict.fromkeys(product_ids):
+        cached = product_cache.get(product_id)
+        if cached is None:
+            missing.append(product_id)
+        else:
+            found[product_id] = cached
+    if missing:
+        found.update(await run_blocking(_load_products, db, missing, _generation))
+    return found
+
+
+async def get_catalog(key, loader, *args):
+    """Return ``(body, etag)`` for a catalog listing identified by ``key``.
+
+    On a miss ``loader(*args)`` runs in the I/O pool and its result is cached.
+    """
+    cached = catalog_cache.get(key)
+    if cached is None:
+        generation = _generation
+        body = await run_blocking(loader, *args)
+        cached = (body, etag_for(body))
+        _store(catalog_cache, key, cached, generation)
+    return cached
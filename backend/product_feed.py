@@ -0,0 +1,92 @@
+"""One snapshot listener on ``products`` shared by the in-memory product indexes.
+
+Indexes such as the barcode and search indexes ``subscribe`` a callback that
+receives ``(product_id, data)`` for every product, with ``data`` None once the
+product is deleted. The listener's first snapshot delivers the whole catalog,
+so it doubles as the startup warmup, and later snapshots carry writes made by
+other workers or the console. The worker's own writes are ``publish``-ed right
+away so its responses never wait for the listener's round trip; applying a
+change twice is harmless.
+
+With ``PRODUCT_LISTENER`` disabled the catalog is read once at startup with a
+projected query and only this worker's writes are seen afterwards.
+
+The ``stock`` stored on a product with sharded stock is stale, so documents
+read from Firestore have it replaced by the sum of their shards; checkouts
+publish the new stock of the products they reserved.
+"""
+import os
+import threading
+from typing import Callable, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from sharded_stock import with_shard_totals
+
+load_dotenv()
+
+PRODUCT_LISTENER = os.getenv("PRODUCT_LISTENER", "true").lower() in ("1", "true", "yes")
+# Seconds startup waits for the first snapshot before serving requests anyway
+PRODUCT_WARMUP_TIMEOUT = float(os.getenv("PRODUCT_WARMUP_TIMEOUT", "30"))
+
+
+class ProductFeed:
+    def __init__(self):
+        self._subscribers = []
+        self._fields = set()
+        self._ready = threading.Event()
+        self._watch = None
+        self._db = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether the subscribers have received the whole catalog"""
+        return self._ready.is_set()
+
+    def subscribe(self, callback: Callable[[str, Optional[dict]], None], fields: Iterable[str]) -> None:
+        """Register ``callback``; ``fields`` are the product fields it reads"""
+        self._subscribers.append(callback)
+        self._fields.update(fields)
+
+    def publish(self, product_id: str, data: Optional[dict]) -> None:
+        for callback in self._subscribers:
+            callback(product_id, data)
+
+    def _publish_docs(self, db, docs) -> None:
+        products = with_shard_totals(db, {doc.id: doc.to_dict() or {} for doc in docs})
+        for product_id, data in products.items():
+            self.publish(product_id, data)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        removed = [change.document.id for change in changes if change.type.name == "REMOVED"]
+        self._publish_docs(self._db, [change.document for change in changes if change.type.name != "REMOVED"])
+        for product_id in removed:
+            self.publish(product_id, None)
+        # The first callback carries the whole collection
+        self._ready.set()
+
+    def _warm(self, db) -> None:
+        query = db.collection('products').select(sorted(self._fields | {'stock_shards'}))
+        self._publish_docs(db, list(query.stream()))
+        self._ready.set()
+
+    def start(self, db) -> None:
+        """Load the catalog into the subscribers and follow later changes (blocking)"""
+        self._db = db
+        if not PRODUCT_LISTENER:
+            self._warm(db)
+            return
+        self._watch = db.collection('products').on_snapshot(self._on_snapshot)
+        self._ready.wait(PRODUCT_WARMUP_TIMEOUT)
+
+    def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    @property
+    def fields(self) -> List[str]:
+        return sorted(self._fields)
+
+
+product_feed = ProductFeed()
@@ -0,0 +1,154 @@
+"""Live product changes pushed to clients over server-sent events.
+
+Instead of polling ``GET /products/``, clients open ``GET /products/stream``
+and receive one event per change:
+
+- ``create``: a new product, with its name, price, stock and vendor;
+- ``update``: the product's vendor and whichever of name, price and stock changed;
+- ``delete``: the product is gone.
+
+Changes come from ``product_feed``, so the worker's one Firestore listener
+serves every connection. The stream remembers the tracked fields of each
+product to turn full documents into deltas, which also makes the worker's own
+writes, published right away and seen again by the listener, a single event.
+Checkouts publish the new stock of what they sold, sharded or not.
+
+Each connection has a queue of ``STREAM_BUFFER`` events. A client reading too
+slowly to keep its queue from filling up is dropped: the queue is discarded
+and the client receives a last ``dropped`` event, after which it should reload
+what it shows and reconnect. Idle streams carry a comment every
+``STREAM_HEARTBEAT`` seconds so proxies keep them open.
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import AsyncIterator, FrozenSet, Optional
+
+from dotenv import load_dotenv
+
+from product_feed import product_feed
+from serialization import dumps
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TRACKED_FIELDS = ("name", "price", "stock", "vendor_id")
+STREAM_BUFFER = int(os.getenv("STREAM_BUFFER", "256"))
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", "1000"))
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))
+DROPPED_EVENT = "dropped"
+
+
+def format_event(event: dict) -> bytes:
+    """One server-sent event, named after the event type"""
+    return b"event: " + event["type"].encode() + b"\ndata: " + dumps(event) + b"\n\n"
+
+
+class StreamClient:
+    """One connection: its filters and its bounded queue"""
+
+    def __init__(self, product_ids: Optional[FrozenSet[str]], vendor_id: Optional[str], buffer: int):
+        self.product_ids = product_ids
+        self.vendor_id = vendor_id
+        self.queue = asyncio.Queue(maxsize=buffer)
+
+    def wants(self, event: dict) -> bool:
+        if self.product_ids is not None and event["id"] not in self.product_ids:
+            return False
+        return self.vendor_id is None or event["vendor_id"] == self.vendor_id
+
+
+class ProductStream:
+    def __init__(self, buffer: int = STREAM_BUFFER, max_clients: int = STREAM_MAX_CLIENTS):
+        self.buffer = buffer
+        self.max_clients = max_clients
+        # Tracked fields of every product, as a tuple in TRACKED_FIELDS order
+        self._products = {}
+        self._lock = threading.Lock()
+        # Clients and counters are only touched in the event loop
+        self._clients = set()
+        self._loop = None
+        self._stats = {"events": 0, "delivered": 0, "dropped": 0}
+
+    @property
+    def full(self) -> bool:
+        return len(self._clients) >= self.max_clients
+
+    def apply(self, product_id: str, data: Optional[dict]) -> None:
+        """``product_feed`` callback; runs in whichever thread saw the change"""
+        with self._lock:
+            previous = self._products.get(product_id)
+            if data is None:
+                if previous is None:
+                    return
+                del self._products[product_id]
+                event = {"type": "delete", "id": product_id, "vendor_id": previous[-1]}
+            else:
+                current = tuple(data.get(field) for field in TRACKED_FIELDS)
+                if current == previous:
+                    return
+                self._products[product_id] = current
+                if previous is None:
+                    event = {"type": "create", "id": product_id, **dict(zip(TRACKED_FIELDS, current))}
+                else:
+                    event = {"type": "update", "id": product_id, "vendor_id": current[-1]}
+                    event.update(
+                        (field, new) for field, old, new in zip(TRACKED_FIELDS, previous, current) if old != new
+                    )
+            if not self._clients:
+                return
+            # Scheduled under the lock so clients see the changes of a product in order
+            try:
+                self._loop.call_soon_threadsafe(self._dispatch, event)
+            except RuntimeError:
+                pass  # the loop is closed: the server is shutting down
+
+    def _dispatch(self, event: dict) -> None:
+        self._stats["events"] += 1
+        for client in list(self._clients):
+            if not client.wants(event):
+                continue
+            try:
+                client.queue.put_nowait(event)
+                self._stats["delivered"] += 1
+            except asyncio.QueueFull:
+                self._drop(client)
+
+    def _drop(self, client: StreamClient) -> None:
+        self._clients.discard(client)
+        self._stats["dropped"] += 1
+        # Free the backlog now and wake the connection up to close it
+        while not client.queue.empty():
+            client.queue.get_nowait()
+        client.queue.put_nowait({"type": DROPPED_EVENT})
+        logger.info("dropped slow product stream client", extra={"buffer": self.buffer})
+
+    async def events(self, product_ids: Optional[FrozenSet[str]] = None,
+                     vendor_id: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Server-sent events of the changes matching the filters, until the client goes away"""
+        client = StreamClient(product_ids, vendor_id, self.buffer)
+        self._loop = asyncio.get_running_loop()
+        self._clients.add(client)
+        try:
+            # Sends the headers at once, so the client knows it is subscribed
+            yield b": subscribed\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(client.queue.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+                    continue
+                yield format_event(event)
+                if event["type"] == DROPPED_EVENT:
+                    return
+        finally:
+            self._clients.discard(client)
+
+    def stats(self) -> dict:
+        return dict(self._stats, clients=len(self._clients), products=len(self._products))
+
+
+product_stream = ProductStream()
+product_feed.subscribe(product_stream.apply, TRACKED_FIELDS)
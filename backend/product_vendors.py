@@ -0,0 +1,71 @@
+"""Product to vendor ownership lookups for vendor-scoped permission checks.
+
+A product's ``vendor_id`` is set at creation and never updated, so ownership
+is cached for a long time in a bounded LRU. Products missing from the cache
+are resolved together with batched reads that only fetch the ``vendor_id``
+field, so a check costs at most one round trip per ``BATCH_SIZE`` products no
+matter how many lines an order has.
+"""
+import os
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from cache import TTLCache
+
+load_dotenv()
+
+# Firestore batched reads are chunked like the batched writes
+BATCH_SIZE = 500
+
+vendor_cache = TTLCache(
+    maxsize=int(os.getenv("PRODUCT_VENDOR_CACHE_SIZE", "50000")),
+    ttl=float(os.getenv("PRODUCT_VENDOR_CACHE_TTL", "3600")),
+    name="product_vendors",
+)
+
+
+def remember_vendor(product_id: str, vendor_id: Optional[str]) -> None:
+    if vendor_id:
+        vendor_cache.set(product_id, vendor_id)
+
+
+def forget_product(product_id: str) -> None:
+    vendor_cache.pop(product_id)
+
+
+def resolve_vendors(db, product_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Map each product id to its vendor id (None for unknown products).
+
+    Blocking: call it through ``run_blocking`` from async code.
+    """
+    vendors = {}
+    missing = []
+    for product_id in dict.fromkeys(pid for pid in product_ids if pid):
+        vendor_id = vendor_cache.get(product_id)
+        if vendor_id is None:
+            missing.append(product_id)
+        else:
+            vendors[product_id] = vendor_id
+
+    for i in range(0, len(missing), BATCH_SIZE):
+        refs = [db.collection('products').document(pid) for pid in missing[i:i + BATCH_SIZE]]
+        for product_doc in db.get_all(refs, field_paths=['vendor_id']):
+            vendor_id = product_doc.to_dict().get('vendor_id') if product_doc.exists else None
+            vendors[product_doc.id] = vendor_id
+            remember_vendor(product_doc.id, vendor_id)
+
+    return vendors
+
+
+def order_vendor_ids(db, order_data: dict) -> List[str]:
+    """Sorted ids of the vendors whose products appear in an order"""
+    if "vendor_ids" in order_data:
+        return order_data["vendor_ids"]
+    product_ids = [item.get("product_id") for item in order_data.get("products", [])]
+    return sorted({v for v in resolve_vendors(db, product_ids).values() if v})
+
+
+def vendor_in_order(db, vendor_id: str, order_data: dict) -> bool:
+    """Whether ``vendor_id`` sells at least one product of the order"""
+    return vendor_id in order_vendor_ids(db, order_data)
@@ -0,0 +1,81 @@
+"""Sales aggregates per vendor and per product, kept up to date by checkout.
+
+The stock transaction of every order adds the order's revenue, units and
+order count to ``vendor_stats/{vendor_id}`` and ``product_stats/{product_id}``,
+so dashboards read a few small documents instead of scanning orders.
+
+Firestore sustains about one write per second on a single document, so each
+aggregate is split into ``SALES_SHARDS`` shard documents in a ``shards``
+subcollection. A sale increments one shard picked at random, with blind
+``Increment`` writes that add no reads, and therefore no contention, to the
+checkout transaction. Reading an aggregate sums its shards: one query over at
+most ``SALES_SHARDS`` documents, whatever the sales volume.
+
+Orders placed before the aggregates existed are not counted.
+"""
+import os
+import random
+from typing import Iterable, Tuple
+
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+load_dotenv()
+
+# Shards per aggregate; raising it later is safe, lowering it loses the extra shards
+SALES_SHARDS = int(os.getenv("SALES_SHARDS", "10"))
+
+COUNTERS = ("revenue", "units", "orders")
+
+
+def _shard(db, collection: str, key: str):
+    return (
+        db.collection(collection).document(key)
+        .collection('shards').document(str(random.randrange(SALES_SHARDS)))
+    )
+
+
+def _increments(revenue: float, units: int) -> dict:
+    return {
+        "revenue": firestore.Increment(revenue),
+        "units": firestore.Increment(units),
+        "orders": firestore.Increment(1),
+    }
+
+
+def record_sales(transaction, db, lines: Iterable[Tuple[str, str, int, float]]) -> None:
+    """Add an order's ``(product_id, vendor_id, quantity, unit_price)`` lines to the aggregates.
+
+    Only writes, so call it after the transaction's reads. A vendor's order
+    count grows by one per order, however many of its products it contains.
+    """
+    vendors = {}
+    for product_id, vendor_id, quantity, unit_price in lines:
+        revenue = quantity * unit_price
+        transaction.set(_shard(db, 'product_stats', product_id), _increments(revenue, quantity), merge=True)
+        if vendor_id:
+            totals = vendors.setdefault(vendor_id, [0.0, 0])
+            totals[0] += revenue
+            totals[1] += quantity
+    for vendor_id, (revenue, units) in vendors.items():
+        transaction.set(_shard(db, 'vendor_stats', vendor_id), _increments(revenue, units), merge=True)
+
+
+def _read(db, collection: str, key: str) -> dict:
+    totals = {"revenue": 0.0, "units": 0, "orders": 0}
+    for doc in db.collection(collection).document(key).collection('shards').stream():
+        shard = doc.to_dict() or {}
+        for counter in COUNTERS:
+            totals[counter] += shard.get(counter, 0)
+    totals["revenue"] = round(totals["revenue"], 2)
+    return totals
+
+
+def vendor_sales(db, vendor_id: str) -> dict:
+    """Revenue, units sold and order count of a vendor (blocking)"""
+    return _read(db, 'vendor_stats', vendor_id)
+
+
+def product_sales(db, product_id: str) -> dict:
+    """Revenue, units sold and order count of a product (blocking)"""
+    return _read(db, 'product_stats', product_id)
@@ -0,0 +1,215 @@
+"""In-process full-text search over product names, descriptions and barcodes.
+
+Text is accent-folded and lower-cased ("Crème Brûlée" -> "creme brulee")
+before being split into terms. The index keeps, per term, the products that
+contain it with a small integer weight (``FIELD_WEIGHTS``), plus a sorted
+vocabulary for prefix expansion and a trigram map of the vocabulary for
+misspelled words. Every query term must match a product: exactly, as a
+prefix of one of its terms, or, when nothing starts with it, as a close
+trigram match. Products are ranked by the sum of the matched weights scaled
+by inverse document frequency.
+
+The index is updated one product at a time from ``product_feed``; it is
+never rebuilt. Price and stock are kept next to the terms so filters do not
+read the products.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from product_feed import product_feed
+
+FIELD_WEIGHTS = {"name": 3, "barcode": 3, "description": 1}
+INDEXED_FIELDS = ("name", "description", "barcode", "price", "stock")
+# Shorter query terms only match whole terms, not prefixes
+MIN_PREFIX_LENGTH = 2
+# Prefix expansions kept per query term, most frequent terms first
+MAX_EXPANSIONS = 64
+PREFIX_FACTOR = 0.7
+FUZZY_FACTOR = 0.4
+# Dice coefficient of trigram sets above which two terms are considered close
+FUZZY_THRESHOLD = 0.5
+MAX_QUERY_TERMS = 8
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Ligatures NFKD leaves alone
+_LIGATURES = str.maketrans({"œ": "oe", "Œ": "oe", "æ": "ae", "Æ": "ae", "ß": "ss"})
+
+
+def fold(text: str) -> str:
+    """Lower-case ``text`` and strip its accents"""
+    decomposed = unicodedata.normalize("NFKD", text.translate(_LIGATURES))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN.findall(fold(text)) if text else []
+
+
+def _trigrams(term: str) -> Set[str]:
+    padded = f"^{term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self):
+        # term -> {product_id: weight}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        # product_id -> (terms, price, stock)
+        self._products: Dict[str, Tuple[Tuple[str, ...], Optional[float], Optional[int]]] = {}
+        self._vocabulary: List[str] = []
+        self._trigram_terms: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._products)
+
+    @property
+    def ready(self) -> bool:
+        return product_feed.ready
+
+    def _add_term(self, term):
+        bisect.insort(self._vocabulary, term)
+        for trigram in _trigrams(term):
+            self._trigram_terms[trigram].add(term)
+
+    def _drop_term(self, term):
+        del self._postings[term]
+        del self._vocabulary[bisect.bisect_left(self._vocabulary, term)]
+        for trigram in _trigrams(term):
+            terms = self._trigram_terms[trigram]
+            terms.discard(term)
+            if not terms:
+                del self._trigram_terms[trigram]
+
+    def _remove(self, product_id):
+        entry = self._products.pop(product_id, None)
+        if entry is None:
+            return
+        for term in entry[0]:
+            postings = self._postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                self._drop_term(term)
+
+    def update(self, product_id: str, product: Optional[dict]) -> None:
+        """Index, re-index (``product`` given) or remove (None) one product"""
+        weights = defaultdict(int)
+        if product is not None:
+            for field, weight in FIELD_WEIGHTS.items():
+                value = product.get(field)
+                for term in tokenize(value if isinstance(value, str) else None):
+                    weights[term] += weight
+
+        with self._lock:
+            self._remove(product_id)
+            if product is None:
+                return
+            for term, weight in weights.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._add_term(term)
+                postings[product_id] = weight
+            self._products[product_id] = (tuple(weights), product.get("price"), product.get("stock"))
+
+    def _expand(self, token: str) -> Dict[str, float]:
+        """Index terms matching one query term, with their match factor"""
+        matches = {}
+        if token in self._postings:
+            matches[token] = 1.0
+        if len(token) >= MIN_PREFIX_LENGTH:
+            prefixed = []
+            i = bisect.bisect_left(self._vocabulary, token)
+            while i < len(self._vocabulary) and self._vocabulary[i].startswith(token):
+                if self._vocabulary[i] != token:
+                    prefixed.append(self._vocabulary[i])
+                i += 1
+            if len(prefixed) > MAX_EXPANSIONS:
+                prefixed.sort(key=lambda term: -len(self._postings[term]))
+                prefixed = prefixed[:MAX_EXPANSIONS]
+            for term in prefixed:
+                matches[term] = PREFIX_FACTOR
+        if not matches and len(token) >= 3:
+            wanted = _trigrams(token)
+            shared = defaultdict(int)
+            for trigram in wanted:
+                for term in self._trigram_terms.get(trigram, ()):
+                    shared[term] += 1
+            for term, count in shared.items():
+                dice = 2 * count / (len(wanted) + len(term))
+                if dice >= FUZZY_THRESHOLD:
+                    matches[term] = FUZZY_FACTOR * dice
+        return matches
+
+    def _in_range(self, product_id, low, high, floor):
+        _, price, stock = self._products[product_id]
+        if (low, high) != (-math.inf, math.inf):
+            if not isinstance(price, (int, float)) or not low <= price <= high:
+                return False
+        return floor == -math.inf or (isinstance(stock, int) and stock >= floor)
+
+    def _scores(self, token: str, total: int) -> Dict[str, float]:
+        scores = None
+        for term, factor in self._expand(token).items():
+            postings = self._postings[term]
+            scale = math.log(1 + total / len(postings)) * factor
+            if scores is None:
+                scores = {product_id: weight * scale for product_id, weight in postings.items()}
+                continue
+            for product_id, weight in postings.items():
+                score = weight * scale
+                if score > scores.get(product_id, 0.0):
+                    scores[product_id] = score
+        return scores or {}
+
+    def search(
+        self,
+        query: str,
+        limit: int,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_stock: Optional[int] = None,
+    ) -> Tuple[int, List[str]]:
+        """Return ``(match_count, ids)``: the ``limit`` best products matching every term"""
+        tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not tokens:
+            return 0, []
+
+        with self._lock:
+            total = len(self._products)
+            per_token = []
+            for token in tokens:
+                scores = self._scores(token, total)
+                if not scores:
+                    return 0, []
+                per_token.append(scores)
+
+            # Intersect from the most selective term
+            per_token.sort(key=len)
+            matches = per_token[0]
+            for scores in per_token[1:]:
+                matches = {
+                    product_id: score + scores[product_id]
+                    for product_id, score in matches.items() if product_id in scores
+                }
+
+            if min_price is not None or max_price is not None or min_stock is not None:
+                low = -math.inf if min_price is None else min_price
+                high = math.inf if max_price is None else max_price
+                floor = -math.inf if min_stock is None else min_stock
+                matches = {
+                    product_id: score for product_id, score in matches.items()
+                    if self._in_range(product_id, low, high, floor)
+                }
+
+        best = heapq.nsmallest(limit, matches.items(), key=lambda item: (-item[1], item[0]))
+        return len(matches), [product_id for product_id, _ in best]
+
+search_index = SearchIndex()
+product_feed.subscribe(search_index.update, INDEXED_FIELDS)
@@ -0,0 +1,133 @@
+"""Sharded stock for products that sell faster than one document can be written.
+
+Firestore serialises the writes to a document, so concurrent checkouts of
+one product queue up on ``products/{id}`` and abort each other. A product
+flagged with ``stock_shards: N`` (N >= 2) keeps its stock in the shard documents
+``products/{id}/stock_shards/{0..N-1}`` instead, and a reservation touches
+a single shard:
+
+- it reads one shard picked at random and, if that shard holds enough,
+  decrements it; concurrent checkouts collide only when they pick the same one;
+- otherwise it reads every shard, takes the quantity from the total and
+  writes the remainder back evenly split. The rebalance is part of the same
+  transaction, so it costs nothing until a shard runs dry.
+
+The ``stock`` field of a sharded product document is only refreshed when the
+shards are (re)configured; reads report the sum of the shards instead, see
+``shard_totals`` and ``with_shard_totals``.
+"""
+import random
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from firebase_admin import firestore
+
+from transactions import run_transaction
+
+MAX_STOCK_SHARDS = 64
+
+
+def shard_refs(db, product_id: str, count: int) -> list:
+    shards = db.collection('products').document(product_id).collection('stock_shards')
+    return [shards.document(str(i)) for i in range(count)]
+
+
+def split_stock(total: int, count: int) -> List[int]:
+    """``total`` spread over ``count`` shards, the first ones holding one more"""
+    base, extra = divmod(total, count)
+    return [base + 1 if i < extra else base for i in range(count)]
+
+
+def _stock_of(doc) -> int:
+    return (doc.to_dict() or {}).get('stock', 0) if doc.exists else 0
+
+
+def plan_reservation(transaction, db, product_id: str, count: int, quantity: int) -> Tuple[int, list]:
+    """Read the shards needed to take ``quantity`` and return ``(available, writes)``.
+
+    ``writes`` are the ``(shard_ref, new_stock)`` updates to apply once every
+    read of the transaction is done; when ``available < quantity`` they are
+    empty and ``available`` is the product's whole stock.
+    """
+    refs = shard_refs(db, product_id, count)
+    picked = random.randrange(count)
+    stock = _stock_of(refs[picked].get(transaction=transaction))
+    if stock >= quantity:
+        return stock, [(refs[picked], stock - quantity)]
+
+    # Not enough in that shard: read them all and rebalance what remains
+    docs = {doc.id: doc for doc in db.get_all(refs, transaction=transaction)}
+    total = sum(_stock_of(docs[ref.id]) for ref in refs if ref.id in docs)
+    if total < quantity:
+        return total, []
+    return total, list(zip(refs, split_stock(total - quantity, count)))
+
+
+def shard_totals(db, sharded: Dict[str, int]) -> Dict[str, int]:
+    """Current stock of each ``{product_id: shard_count}``, with one batched read (blocking)"""
+    refs = [ref for product_id, count in sharded.items() for ref in shard_refs(db, product_id, count)]
+    # get_all does not keep the order of refs: map each shard back through its path
+    owners = {ref.path: ref.path.split('/')[1] for ref in refs}
+    totals = dict.fromkeys(sharded, 0)
+    for doc in db.get_all(refs):
+        totals[owners[doc.reference.path]] += _stock_of(doc)
+    return totals
+
+
+def with_shard_totals(db, products: Dict[str, dict]) -> Dict[str, dict]:
+    """``{product_id: data}`` with the stock of sharded products taken from their shards (blocking)"""
+    sharded = {product_id: data['stock_shards'] for product_id, data in products.items()
+               if (data.get('stock_shards') or 0) >= 2}
+    if sharded:
+        for product_id, total in shard_totals(db, sharded).items():
+            products[product_id] = dict(products[product_id], stock=total)
+    return products
+
+
+def _configure_in_transaction(transaction, db, product_id, count, total):
+    product_ref = db.collection('products').document(product_id)
+    product_doc = product_ref.get(transaction=transaction)
+    if not product_doc.exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    product_data = product_doc.to_dict()
+    current = product_data.get('stock_shards') or 0
+
+    old_refs = shard_refs(db, product_id, current) if current >= 2 else []
+    if total is None:
+        if old_refs:
+            total = sum(_stock_of(doc) for doc in db.get_all(old_refs, transaction=transaction))
+        else:
+            total = product_data.get('stock', 0)
+
+    new_refs = shard_refs(db, product_id, count) if count >= 2 else []
+    for ref, stock in zip(new_refs, split_stock(total, len(new_refs) or 1)):
+        transaction.set(ref, {'stock': stock})
+    for ref in old_refs[len(new_refs):]:
+        transaction.delete(ref)
+    transaction.update(product_ref, {
+        'stock': total,
+        'stock_shards': count if new_refs else firestore.DELETE_FIELD,
+    })
+    return total
+
+
+def configure_stock_shards(db, product_id: str, count: int, total: Optional[int] = None) -> int:
+    """Spread the product's stock over ``count`` shards (0 or 1 turns sharding off).
+
+    The stock is preserved unless ``total`` replaces it. Returns the stock.
+    Blocking: run it through ``run_blocking``.
+    """
+    if not 0 <= count <= MAX_STOCK_SHARDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Stock shards must be between 0 and {MAX_STOCK_SHARDS}"
+        )
+    return run_transaction(db, "stock_sharding", _configure_in_transaction, db, product_id, count, total)
+
+
+def delete_stock_shards(db, product_id: str, count: int) -> None:
+    """Remove the shard documents of a deleted product (blocking)"""
+    batch = db.batch()
+    for ref in shard_refs(db, product_id, count):
+        batch.delete(ref)
+    batch.commit()
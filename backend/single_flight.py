@@ -0,0 +1,80 @@
+"""Coalescing of concurrent identical reads.
+
+When a product goes viral, hundreds of requests miss the product cache at
+the same moment and would each read the same document. A ``SingleFlight``
+runs the first of them and makes the others await its result; a failure is
+raised to every waiter. The shared call runs as its own task, so a waiter
+that is cancelled (its client went away) does not cancel it for the others.
+
+Keys are only shared while their read is in flight; nothing is cached here.
+``forget`` must be called when the data behind a key is written, so requests
+arriving after the write start a new read instead of joining an older one.
+Instances belong to the event loop and must not be used from other threads.
+Flights created with a ``name`` are reported by ``single_flight_stats()``.
+"""
+import asyncio
+
+from async_io import run_blocking
+
+# Named flights, reported together by single_flight_stats()
+_registry = {}
+
+
+class SingleFlight:
+    def __init__(self, name=None):
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        if name:
+            _registry[name] = self
+
+    async def do(self, key, fn, *args):
+        """Return ``await fn(*args)``, sharing the call with concurrent callers of ``key``"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieving the exception also keeps asyncio from logging it when no waiter is left
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def forget(self, key) -> None:
+        """Make later callers of ``key`` start a new call; current waiters keep theirs"""
+        self._calls.pop(key, None)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "in_flight": len(self._calls),
+        }
+
+
+document_reads = SingleFlight(name="documents")
+
+
+async def get_document(db, collection: str, document_id: str):
+    """Snapshot of ``collection/document_id``, shared with concurrent reads of it.
+
+    Only for reads that serve a response; a read that prepares a write must see
+    the document as it is when it starts, so it reads directly.
+    """
+    return await document_reads.do(
+        (collection, document_id), run_blocking, db.collection(collection).document(document_id).get
+    )
+
+
+def single_flight_stats():
+    """Statistics of every named flight, keyed by name"""
+    return {name: flight.stats() for name, flight in _registry.items()}
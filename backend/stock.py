@@ -0,0 +1,97 @@
+"""Stock reservation for new orders, together with the sales aggregates.
+
+``checkout.place_order`` runs ``reserve_in_transaction`` in the transaction
+that also writes the order.
+"""
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException, status
+
+from sales_stats import record_sales
+from sharded_stock import plan_reservation
+
+
+def merge_lines(products: List[dict]) -> Dict[str, int]:
+    """Sum the quantities of order lines per product, keeping first-seen order"""
+    quantities = {}
+    for item in products:
+        product_id = item.get('product_id')
+        quantity = item.get('quantity', 1)
+
+        if not product_id or quantity <= 0:
+            raise ValueError(f"Invalid product data: {item}")
+
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def reserve_in_transaction(transaction, db, quantities: Dict[str, int]) -> Tuple[List[str], Dict[str, dict]]:
+    """Decrement stock and record the sales inside ``transaction``.
+
+    Returns the vendor ids and ``{product_id: data}`` of the products with their
+    new stock, for publishing once the transaction commits. Reads every product
+    first, so nothing may be written in the transaction before it. Products flagged
+    with ``stock_shards`` are taken from their stock shards and their document is
+    left untouched, see ``sharded_stock``; their returned stock is the stale one of
+    the document, to be replaced by ``with_shard_totals``.
+    """
+    refs = [db.collection('products').document(pid) for pid in quantities]
+    # One batched read for every product of the order, instead of one per line
+    product_docs = {doc.id: doc for doc in db.get_all(refs, transaction=transaction)}
+
+    insufficient_stock = []
+    stock_updates = []
+    sales = []
+    vendor_ids = set()
+    reserved = {}
+
+    for product_ref in refs:
+        product_id = product_ref.id
+        quantity = quantities[product_id]
+        product_doc = product_docs.get(product_id)
+
+        if product_doc is None or not product_doc.exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Product {product_id} not found"
+            )
+
+        product_data = product_doc.to_dict()
+        shard_count = product_data.get('stock_shards') or 0
+        if shard_count >= 2:
+            current_stock, writes = plan_reservation(transaction, db, product_id, shard_count, quantity)
+        else:
+            current_stock = product_data.get('stock', 0)
+            writes = [(product_ref, current_stock - quantity)]
+        if product_data.get('vendor_id'):
+            vendor_ids.add(product_data['vendor_id'])
+
+        if current_stock < quantity:
+            insufficient_stock.append({
+                'product_id': product_id,
+                'name': product_data.get('name', 'Unknown'),
+                'requested': quantity,
+                'available': current_stock
+            })
+        else:
+            stock_updates.extend(writes)
+            reserved[product_id] = dict(product_data, stock=product_data.get('stock', 0) if shard_count >= 2
+                                        else current_stock - quantity)
+            sales.append((product_id, product_data.get('vendor_id'), quantity, product_data.get('price', 0)))
+
+    # If any product has insufficient stock, abort the transaction
+    if insufficient_stock:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                'message': 'Insufficient stock for some products',
+                'products': insufficient_stock
+            }
+        )
+
+    for stock_ref, new_stock in stock_updates:
+        transaction.update(stock_ref, {'stock': new_stock})
+    record_sales(transaction, db, sales)
+
+    return sorted(vendor_ids), reserved
+
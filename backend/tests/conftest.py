@@ -0,0 +1,7 @@
+import os
+
+# The app creates its backends from the environment once per process, so the
+# tests configure them before anything imports it
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["MEMORY_LATENCY"] = "0.1"
+os.environ["STARTUP_WARMUP"] = "false"
@@ -0,0 +1,34 @@
+"""Requests overlap their backend round trips instead of queueing on the event loop."""
+import asyncio
+import time
+
+import httpx
+
+import main as api
+from backends import MEMORY_LATENCY
+
+REQUESTS = 20
+
+
+def test_concurrent_requests_take_about_one_latency():
+    async def scenario():
+        async with api.app.router.lifespan_context(api.app):
+            batch = api.db.batch()
+            for i in range(REQUESTS + 1):
+                batch.set(api.db.collection('products').document(f"p{i}"), {
+                    "name": f"Product {i}", "description": "", "price": 1.0, "stock": 1, "vendor_id": "v",
+                })
+            batch.commit()
+            transport = httpx.ASGITransport(app=api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                await client.get("/products/p0")
+                # Distinct products, so every request misses the cache and reads Firestore
+                started = time.perf_counter()
+                responses = await asyncio.gather(*(client.get(f"/products/p{i}") for i in range(1, REQUESTS + 1)))
+                return responses, time.perf_counter() - started
+
+    responses, elapsed = asyncio.run(scenario())
+    assert [response.status_code for response in responses] == [200] * REQUESTS
+    assert MEMORY_LATENCY > 0
+    # Serialised on the event loop they would take REQUESTS latencies
+    assert MEMORY_LATENCY <= elapsed < 3 * MEMORY_LATENCY
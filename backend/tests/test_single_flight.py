@@ -0,0 +1,114 @@
+"""Coalescing of concurrent reads by ``SingleFlight``."""
+import asyncio
+
+import pytest
+
+import product_cache
+from memory_firestore import MemoryFirestore
+from single_flight import SingleFlight
+
+WAITERS = 50
+LATENCY = 0.05
+
+
+class BackendDown(Exception):
+    pass
+
+
+def test_concurrent_product_misses_share_one_read():
+    db = MemoryFirestore(latency=LATENCY)
+    db.collection('products').document('hot').set({"name": "Hot", "price": 1.0, "stock": 3})
+    product_cache.product_cache.clear()
+    db.reset_stats()
+
+    async def read_all():
+        return await asyncio.gather(*(product_cache.get_product(db, "hot") for _ in range(WAITERS)))
+
+    results = asyncio.run(read_all())
+    assert db.stats["calls"] == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_failure_reaches_every_waiter():
+    flight = SingleFlight()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(LATENCY)
+        raise BackendDown("backend down")
+
+    async def wait_all():
+        return await asyncio.gather(*(flight.do("k", failing) for _ in range(WAITERS)), return_exceptions=True)
+
+    errors = asyncio.run(wait_all())
+    assert calls == 1
+    assert all(isinstance(error, BackendDown) for error in errors)
+    assert all(error is errors[0] for error in errors)
+    assert flight.stats() == {"calls": 1, "coalesced": WAITERS - 1, "errors": 1, "in_flight": 0}
+
+
+def test_failed_call_is_not_shared_with_later_callers():
+    flight = SingleFlight()
+
+    async def failing():
+        raise BackendDown("backend down")
+
+    async def succeeding():
+        return 42
+
+    async def scenario():
+        with pytest.raises(BackendDown):
+            await flight.do("k", failing)
+        return await flight.do("k", succeeding)
+
+    assert asyncio.run(scenario()) == 42
+
+
+def test_cancelled_waiter_leaves_the_call_to_the_others():
+    flight = SingleFlight()
+    calls = 0
+
+    async def slow():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(LATENCY)
+        return "value"
+
+    async def scenario():
+        cancelled = asyncio.ensure_future(flight.do("k", slow))
+        others = [asyncio.ensure_future(flight.do("k", slow)) for _ in range(3)]
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        results = await asyncio.gather(*others)
+        return cancelled.cancelled(), results
+
+    was_cancelled, results = asyncio.run(scenario())
+    assert was_cancelled
+    assert results == ["value"] * 3
+    assert calls == 1
+
+
+def test_forget_starts_a_new_call():
+    flight = SingleFlight()
+    calls = 0
+
+    async def read(release):
+        nonlocal calls
+        calls += 1
+        call = calls
+        await release.wait()
+        return call
+
+    async def scenario():
+        release = asyncio.Event()
+        before = asyncio.ensure_future(flight.do("k", read, release))
+        await asyncio.sleep(0)
+        flight.forget("k")  # the data behind "k" was written
+        after = asyncio.ensure_future(flight.do("k", read, release))
+        await asyncio.sleep(0)
+        release.set()
+        return await before, await after
+
+    assert asyncio.run(scenario()) == (1, 2)
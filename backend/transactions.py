@@ -0,0 +1,109 @@
+"""Firestore transactions with configurable retry, backoff and contention metrics.
+
+``@firestore.transactional`` retries an aborted transaction immediately and
+keeps no record of it. ``run_transaction`` makes a single attempt per
+Firestore transaction and does the retrying itself, sleeping with exponential
+backoff and full jitter between attempts so contending checkouts spread out
+instead of colliding again, and counts attempts, retries and wall time per
+transaction name.
+"""
+import os
+import random
+import threading
+import time
+
+from dotenv import load_dotenv
+from firebase_admin import firestore
+from google.api_core import exceptions
+
+load_dotenv()
+
+TXN_MAX_ATTEMPTS = int(os.getenv("TXN_MAX_ATTEMPTS", "5"))
+TXN_BACKOFF_BASE = float(os.getenv("TXN_BACKOFF_BASE", "0.05"))
+TXN_BACKOFF_MAX = float(os.getenv("TXN_BACKOFF_MAX", "1.0"))
+
+
+class TransactionContentionError(RuntimeError):
+    """Raised when a transaction is still aborted after its last attempt"""
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def _record(name, **increments):
+    with _metrics_lock:
+        entry = _metrics.setdefault(name, {
+            "committed": 0,
+            "failed": 0,
+            "exhausted": 0,
+            "attempts": 0,
+            "retries": 0,
+            "total_seconds": 0.0,
+            "max_seconds": 0.0,
+        })
+        for key, value in increments.items():
+            if key == "max_seconds":
+                entry[key] = max(entry[key], value)
+            else:
+                entry[key] += value
+
+
+def transaction_stats():
+    """Counters per transaction name, with derived abort rate and mean duration"""
+    with _metrics_lock:
+        stats = {}
+        for name, entry in _metrics.items():
+            finished = entry["committed"] + entry["failed"] + entry["exhausted"]
+            stats[name] = dict(
+                entry,
+                abort_rate=entry["retries"] / entry["attempts"] if entry["attempts"] else 0.0,
+                mean_seconds=entry["total_seconds"] / finished if finished else 0.0,
+            )
+        return stats
+
+
+def _is_contention(exc):
+    # A single-attempt transaction reports an aborted commit as a ValueError
+    # caused by Aborted; reads can also raise Aborted directly.
+    return isinstance(exc, exceptions.Aborted) or isinstance(exc.__cause__, exceptions.Aborted)
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Full-jitter exponential backoff before retry number ``attempt`` (1-based)"""
+    base = TXN_BACKOFF_BASE if base is None else base
+    cap = TXN_BACKOFF_MAX if cap is None else cap
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def run_transaction(db, name, fn, *args, max_attempts=None):
+    """Run ``fn(transaction, *args)`` in a Firestore transaction and return its result.
+
+    Blocking: call it through ``run_blocking`` from async code. Exceptions
+    raised by ``fn`` abort the transaction and propagate unchanged.
+    """
+    max_attempts = max_attempts or TXN_MAX_ATTEMPTS
+    transactional = firestore.transactional(fn)
+    started = time.perf_counter()
+
+    for attempt in range(1, max_attempts + 1):
+        _record(name, attempts=1)
+        try:
+            result = transactional(db.transaction(max_attempts=1), *args)
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            if not _is_contention(e):
+                _record(name, failed=1, total_seconds=elapsed, max_seconds=elapsed)
+                raise
+            _record(name, retries=1)
+            if attempt == max_attempts:
+                _record(name, exhausted=1, total_seconds=elapsed, max_seconds=elapsed)
+                raise TransactionContentionError(
+                    f"Transaction '{name}' aborted {max_attempts} times due to contention"
+                ) from e
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        elapsed = time.perf_counter() - started
+        _record(name, committed=1, total_seconds=elapsed, max_seconds=elapsed)
+        return result
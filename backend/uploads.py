@@ -0,0 +1,140 @@
+"""Bounded, chunked spooling of uploaded images to temporary files.
+
+Uploads are copied to disk ``UPLOAD_CHUNK_SIZE`` bytes at a time, in the I/O
+pool, so the memory used per upload does not depend on the size of the file
+and the writes never block the event loop. The first chunk is checked against
+known image signatures before anything is written, and the copy stops as soon
+as ``UPLOAD_MAX_BYTES`` is exceeded.
+
+Those checks run in the endpoint, and Starlette has already received the
+whole multipart body by then, spooling large parts to disk. So that an
+oversized request is not read at all, ``UploadLimitMiddleware`` refuses
+multipart requests whose ``Content-Length`` is above what their route can
+accept. A body sent without a length (chunked) is still read in full before
+the per-file limits apply.
+"""
+import os
+import uuid
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile, status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from async_io import run_blocking
+
+load_dotenv()
+
+UPLOAD_DIR = "tmp_uploads"
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Allowance for the text fields and part headers of a multipart form
+FORM_OVERHEAD_BYTES = 1024 * 1024
+
+# Magic numbers of the image formats accepted for product pictures
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"GIF87a", "image/gif", ".gif"),
+    (b"GIF89a", "image/gif", ".gif"),
+)
+
+
+def sniff_image_type(head: bytes) -> Optional[tuple]:
+    """Return ``(content_type, extension)`` for the image starting with ``head``"""
+    for signature, content_type, extension in _SIGNATURES:
+        if head.startswith(signature):
+            return content_type, extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image/heic", ".heic"
+    return None
+
+
+async def _copy_to_temp(upload: UploadFile, head: bytes, extension: str, max_bytes: int) -> str:
+    await run_blocking(os.makedirs, UPLOAD_DIR, exist_ok=True)
+    temp_file_path = os.path.join(UPLOAD_DIR, f"temp_{uuid.uuid4()}{extension}")
+    size = 0
+    try:
+        # Unbuffered, so every write is one chunk in the I/O pool and closing flushes nothing
+        buffer = await run_blocking(open, temp_file_path, "wb", buffering=0)
+        try:
+            chunk = head
+            while chunk:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"File larger than {max_bytes / (1024 * 1024):g} MB"
+                    )
+                await run_blocking(buffer.write, chunk)
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        finally:
+            buffer.close()
+    except BaseException:
+        remove_temp_file(temp_file_path)
+        raise
+    return temp_file_path
+
+
+async def save_upload(image_file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> str:
+    """Copy an uploaded image into ``UPLOAD_DIR`` and return the temporary file path.
+
+    Raises 415 if the content is not a supported image and 413 if it is larger
+    than ``max_bytes``. The caller owns the returned file and must delete it.
+    """
+    head = await image_file.read(UPLOAD_CHUNK_SIZE)
+    sniffed = sniff_image_type(head)
+    if sniffed is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Unsupported image format, use JPEG, PNG, GIF, WebP or HEIC"
+        )
+    return await _copy_to_temp(image_file, head, sniffed[1], max_bytes)
+
+
+async def spool_upload(upload: UploadFile, extension: str, max_bytes: int) -> str:
+    """Copy any uploaded file into ``UPLOAD_DIR`` in chunks, without type checks"""
+    head = await upload.read(UPLOAD_CHUNK_SIZE)
+    return await _copy_to_temp(upload, head, extension, max_bytes)
+
+
+def remove_temp_file(path: Optional[str]) -> None:
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware answering 413 to multipart requests declared too large.
+
+    ``max_bytes`` applies to every multipart request; ``limits`` gives some
+    paths a different one.
+    """
+
+    def __init__(self, app, max_bytes: int, limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            if headers.get("content-type", "").startswith("multipart/form-data"):
+                max_bytes = self.limits.get(scope["path"], self.max_bytes)
+                try:
+                    length = int(headers.get("content-length", ""))
+                except ValueError:
+                    length = None
+                if length is not None and length > max_bytes:
+                    response = JSONResponse(
+                        {"detail": f"Request larger than {max_bytes / (1024 * 1024):g} MB"},
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
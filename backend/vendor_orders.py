@@ -0,0 +1,59 @@
+"""Backfill of the vendors of each order.
+
+Every order stores the ids of the vendors whose products it contains in a
+``vendor_ids`` array, written by ``checkout.place_order``. Vendor dashboards
+then list their orders with ``orders.list_orders(db, limit, vendor_id=...)``,
+a single indexed ``array_contains`` query instead of a scan of the whole
+``orders`` collection that re-reads each product.
+
+Run this module directly to backfill ``vendor_ids`` on orders created before
+the field existed::
+
+    python vendor_orders.py
+"""
+from product_vendors import BATCH_SIZE, resolve_vendors
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def backfill_vendor_ids(db, batch_size=BATCH_SIZE):
+    """Add ``vendor_ids`` to every order that does not have it yet.
+
+    Product owners are resolved with batched reads and each product is read
+    at most once, whatever the number of orders referencing it. Returns the
+    number of orders updated.
+    """
+    pending = []
+    for doc in db.collection('orders').stream():
+        order_data = doc.to_dict()
+        if "vendor_ids" not in order_data:
+            pending.append((doc.reference, order_data.get("products", [])))
+
+    product_vendors = resolve_vendors(
+        db, (item.get("product_id") for _, items in pending for item in items)
+    )
+
+    updated = 0
+    for chunk in _chunks(pending, batch_size):
+        batch = db.batch()
+        for order_ref, items in chunk:
+            vendor_ids = sorted({
+                product_vendors[item["product_id"]]
+                for item in items
+                if product_vendors.get(item.get("product_id"))
+            })
+            batch.update(order_ref, {"vendor_ids": vendor_ids})
+        batch.commit()
+        updated += len(chunk)
+
+    return updated
+
+
+if __name__ == "__main__":
+    from firebase_admin_config import get_db
+
+    count = backfill_vendor_ids(get_db())
+    print(f"Backfilled vendor_ids on {count} orders")